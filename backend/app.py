@@ -1,21 +1,25 @@
 # app.py (with follow-up question generation)
 import os
 import json
-import sqlite3
 import uuid
 import time
+import importlib.util
 import logging
+import threading
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory
+import db
+from flask import Flask, Response, current_app, g, render_template, request, redirect, url_for, jsonify, send_file, send_from_directory, stream_template, stream_with_context
+import metrics
+from metrics import PROCTOR_STAGE_SECONDS
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("backend")
 
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "data.db"
-UPLOAD_DIR = BASE_DIR / "uploads"
+DB_PATH = db.DB_PATH
+UPLOAD_DIR = Path(os.environ.get("SNAPSHOT_DIR", BASE_DIR / "uploads"))
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 # templates/static directories must exist
@@ -26,108 +30,152 @@ if not TEMPLATES_DIR.exists():
 if not STATIC_DIR.exists():
     log.error("Missing static folder: %s", STATIC_DIR)
 
-# question bank file (create default if missing/empty)
-QUESTION_BANK_FILE = BASE_DIR / "question_bank.json"
-if not QUESTION_BANK_FILE.exists() or QUESTION_BANK_FILE.stat().st_size == 0:
-    log.warning("question_bank.json missing or empty; creating default bank at %s", QUESTION_BANK_FILE)
-    default_bank = {
-        "General Aptitude": [
-            "Tell me about a time you solved a difficult problem.",
-            "Why do you want this position?",
-            "Describe your strengths and weaknesses."
-        ],
-        "Computer Science": [
-            "Explain the difference between a process and a thread.",
-            "What is a RESTful API?",
-            "Describe how a hash table works."
-        ]
-    }
-    QUESTION_BANK_FILE.write_text(json.dumps(default_bank, indent=2), encoding="utf-8")
-
-# load question bank
-try:
-    with open(QUESTION_BANK_FILE, "r", encoding="utf-8") as f:
-        QUESTION_BANK = json.load(f)
-except Exception as e:
-    log.exception("Failed to load question bank; using small fallback in memory. Error: %s", e)
-    QUESTION_BANK = {
-        "General Aptitude": ["Why do you want this position?"]
-    }
-
-# DB initialization
-def init_db():
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                email TEXT,
-                subject TEXT,
-                started_at TEXT
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS questions (
-                session_id TEXT PRIMARY KEY,
-                questions_json TEXT
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS answers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT,
-                question TEXT,
-                answer TEXT,
-                ts TEXT
-            )
-        ''')
-        conn.commit()
-    except Exception:
-        log.exception("Error initializing DB")
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
-
-init_db()
+# Local question bank (question_bank.json + data/*.json, indexed and hot-reloaded; see question_bank.py).
+# Loaded on first use.
+from question_bank import get_bank as get_question_bank, FALLBACK_SUBJECT
 
 # optional imports: question generator and face detection
 try:
-    from question_generator import generate_questions_for_subject
+    from question_generator import question_pool
     log.info("Loaded question_generator module.")
 except Exception as e:
     log.info("question_generator not available (%s). Falling back to local bank.", e)
-    def generate_questions_for_subject(subject: str, n: int = 5):
-        return QUESTION_BANK.get(subject, QUESTION_BANK.get("General Aptitude", []))[:n]
+    question_pool = None
 
-try:
-    from face_detection import detect_face_from_base64
-    log.info("Loaded face_detection module.")
-except Exception as e:
-    log.info("face_detection not available (%s). Using no-op.", e)
-    def detect_face_from_base64(b64: str):
-        return {"faces_detected": 0, "status": "no-op"}
-
-# Optional OpenAI integration (for follow-up generation)
-OPENAI_KEY = os.environ.get("OPENAI_API_KEY")  # set this in your environment to enable LLM follow-ups
-openai = None
-if OPENAI_KEY:
+# face_detection (OpenCV + the detector model) is imported on first use or by warm_up(), not here
+FACE_DETECTION_AVAILABLE = importlib.util.find_spec("cv2") is not None
+_face_detection = None
+
+def load_face_detection():
+    """The face_detection module, or None (no-op analysis) if it cannot be imported."""
+    global _face_detection
+    if _face_detection is None:
+        try:
+            import face_detection
+            _face_detection = face_detection
+            log.info("Loaded face_detection module.")
+        except Exception as e:
+            log.info("face_detection not available (%s). Using no-op.", e)
+            _face_detection = False
+    return _face_detection or None
+
+# Detection engine: "pool" (multi-core worker pool) or "inline" (run on the request thread)
+DETECT_MODE = os.environ.get("DETECT_MODE", "pool").lower()
+# DETECT_TRACKING=1: per-session downscale / ROI / frame-skip detection (analysis reports the path taken)
+DETECT_TRACKING = os.environ.get("DETECT_TRACKING", "0").lower() in ("1", "true", "yes")
+get_detection_engine = None
+if DETECT_MODE == "pool" and FACE_DETECTION_AVAILABLE:
     try:
-        import openai as _openai
-        _openai.api_key = OPENAI_KEY
-        openai = _openai
-        log.info("OpenAI library loaded; follow-up question generation enabled.")
+        from detection_engine import get_engine as get_detection_engine, EngineBusy
+        log.info("Face detection will run in the worker pool.")
     except Exception as e:
-        log.exception("OpenAI import failed; follow-up will use fallback. Error: %s", e)
-        openai = None
-else:
-    log.info("OPENAI_API_KEY not found in environment; follow-up generation will use fallback heuristics.")
+        log.info("detection_engine not available (%s). Detecting inline.", e)
+        get_detection_engine = None
+if get_detection_engine is None:
+    class EngineBusy(Exception):
+        pass
+
+from proctor_pipeline import PROCTOR_INGEST, IngestBusy, IngestPipeline, ResultStore, sse_events
+from proctor_monitor import ProctorMonitor
+from capture_policy import CapturePolicy
+
+from followup_engine import engine as followup_engine
+
+# Snapshots are stored deduplicated in per-session shards under uploads/ (see snapshot_store.py)
+from snapshot_store import get_store as get_snapshot_store, SNAPSHOT_COMPACT_INTERVAL, SNAPSHOT_PACK_INTERVAL
+# ... and appended in the background to one MJPEG segment per session (see segments.py)
+import segments
 
-app = Flask(__name__, template_folder=str(TEMPLATES_DIR), static_folder=str(STATIC_DIR))
-app.config['UPLOAD_FOLDER'] = str(UPLOAD_DIR)
+# Optional LLM integration (follow-ups and question pools) through the shared client in llm_client.py
+try:
+    from llm_client import get_client as get_llm_client
+except Exception as e:
+    log.exception("LLM client unavailable; follow-up will use fallback. Error: %s", e)
+    get_llm_client = None
+
+# Routes are collected here and bound to each app built by create_app() (end of this file)
+ROUTES = []
+
+def route(rule, **options):
+    def decorator(fn):
+        ROUTES.append((rule, fn, options))
+        return fn
+    return decorator
+
+_services_started = False
+_services_lock = threading.Lock()
+
+def start_services():
+    """
+    Process-wide startup work: DB migrations and the background writers. Runs once, on the first
+    request (or from warm_up()); requests arriving meanwhile wait for it.
+    """
+    global _services_started
+    if _services_started:
+        return
+    with _services_lock:
+        if _services_started:
+            return
+        # DB initialization (schema, pooled connections and the write queue live in db.py)
+        try:
+            db.init_db()
+        except Exception:
+            log.exception("Error initializing DB")
+        if segments.SEGMENTS_ENABLED:
+            segments.get_assembler()
+            # otherwise every frame would be kept twice: as a loose file and in its segment
+            get_snapshot_store().start_pack_thread(SNAPSHOT_PACK_INTERVAL)
+        if SNAPSHOT_COMPACT_INTERVAL > 0:
+            get_snapshot_store().start_compaction_thread(SNAPSHOT_COMPACT_INTERVAL, pack=segments.SEGMENTS_ENABLED)
+        _services_started = True
+
+# WARM_UP=1: the production servers call warm_up() before taking traffic (serve.py sets it unless
+# --no-warm-up); otherwise everything initialises on first use
+WARM_UP = os.environ.get("WARM_UP", "0").lower() in ("1", "true", "yes")
+
+def _warm_detection():
+    import numpy as np
+    blank = np.zeros((120, 160), np.uint8)
+    if get_detection_engine is not None:
+        # starts the worker processes and has them load the detector
+        analysis = get_detection_engine().detect(blank)
+    elif load_face_detection() is not None:
+        analysis = load_face_detection().detect_faces(blank)
+    else:
+        return
+    if str(analysis.get("status", "")).startswith("error"):
+        # e.g. FACE_DETECTOR=yunet without its model: say so at startup, not only in each frame's status
+        raise RuntimeError(f"face detection unavailable: {analysis['status']}")
+
+def _warm_llm():
+    if get_llm_client and get_llm_client().enabled:
+        log.info("LLM client configured; follow-up question generation enabled.")
+        if question_pool is not None:
+            question_pool.prefill(get_question_bank().subjects())
+    else:
+        log.info("OPENAI_API_KEY not found in environment; follow-up generation will use fallback heuristics.")
+
+def warm_up(detection=True, llm=True):
+    """
+    Initialise now what would otherwise be set up by the first request that needs it: services and
+    DB, the question bank, the detector (worker pool included) and the LLM client with its
+    question pools. Returns {step: seconds}; a failing step is logged and skipped.
+    """
+    steps = [("services", start_services), ("question_bank", get_question_bank)]
+    if detection and FACE_DETECTION_AVAILABLE:
+        steps.append(("detection", _warm_detection))
+    if llm:
+        steps.append(("llm", _warm_llm))
+    timings = {}
+    for name, fn in steps:
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            log.exception("Warm-up step %s failed", name)
+        timings[name] = round(time.perf_counter() - t0, 4)
+    log.info("Warm-up finished: %s", ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in timings.items()))
+    return timings
 
 # Helper: get JSON body or form
 def get_request_json_flexible():
@@ -146,65 +194,47 @@ def get_request_json_flexible():
         data.setdefault(k, v)
     return data
 
-@app.route("/", methods=["GET", "POST"])
+@route("/", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         name = (request.form.get("name") or "").strip()
         email = (request.form.get("email") or "").strip()
         subject = (request.form.get("subject") or "").strip()
         if not name or not email or not subject:
-            return render_template("register.html", error="Please complete all fields.", subjects=QUESTION_BANK.keys())
+            return render_template("register.html", error="Please complete all fields.", subjects=get_question_bank().subjects())
         session_id = str(uuid.uuid4())
+        started_at = datetime.utcnow().isoformat()
+        # take a pre-generated LLM question set if one is ready; never wait on the model here
+        qlist = None
+        try:
+            if question_pool is not None:
+                qlist = question_pool.take(subject, n=5)
+        except Exception as e:
+            log.info("Question pool failed: %s -- falling back", e)
+        if not isinstance(qlist, list) or not qlist:
+            # non-repeating draw from the local bank (consecutive sessions get different questions)
+            bank = get_question_bank()
+            qlist = bank.sample(subject if bank.has_subject(subject) else FALLBACK_SUBJECT, 5)
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            cur.execute("INSERT INTO sessions (id,name,email,subject,started_at) VALUES (?,?,?,?,?)",
-                        (session_id, name, email, subject, datetime.utcnow().isoformat()))
-            conn.commit()
-
-            # generate questions (openai fallback to local)
-            try:
-                qlist = generate_questions_for_subject(subject, n=5)
-                if not isinstance(qlist, list) or not qlist:
-                    raise ValueError("Invalid question list from generator")
-            except Exception as e:
-                log.info("Question generation failed: %s -- falling back", e)
-                qlist = QUESTION_BANK.get(subject, QUESTION_BANK.get("General Aptitude", []))[:5]
-
-            cur.execute("INSERT OR REPLACE INTO questions (session_id,questions_json) VALUES (?,?)",
-                        (session_id, json.dumps(qlist)))
-            conn.commit()
+            db.create_session(session_id, name, email, subject, qlist, started_at=started_at)
         except Exception:
             log.exception("Failed to create session")
-        finally:
-            try:
-                conn.close()
-            except Exception:
-                pass
         return redirect(url_for("interview", session_id=session_id))
-    return render_template("register.html", subjects=QUESTION_BANK.keys())
+    return render_template("register.html", subjects=get_question_bank().subjects())
 
-@app.route("/interview/<session_id>")
+@route("/interview/<session_id>")
 def interview(session_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT name,subject FROM sessions WHERE id=?", (session_id,))
-        row = cur.fetchone()
+        row = db.get_session(session_id)
     except Exception:
         log.exception("DB error fetching session")
         row = None
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
     if not row:
         return "Session not found", 404
     name, subject = row
     return render_template("interview.html", session_id=session_id, name=name, subject=subject)
 
-@app.route("/get_question", methods=["POST"])
+@route("/get_question", methods=["POST"])
 def get_question():
     data = get_request_json_flexible() or {}
     session_id = data.get("session_id")
@@ -214,196 +244,643 @@ def get_question():
     except Exception:
         index = 0
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT questions_json FROM questions WHERE session_id=?", (session_id,))
-        row = cur.fetchone()
+        qlist = db.get_questions(session_id)
     except Exception:
         log.exception("DB error in get_question")
-        row = None
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
-    if not row:
+        qlist = None
+    if qlist is None:
         return jsonify({"error": "session not found"}), 404
-    try:
-        qlist = json.loads(row[0])
-    except Exception:
-        qlist = []
     if index < 0 or index >= len(qlist):
         return jsonify({"done": True})
     return jsonify({"done": False, "question": qlist[index], "index": index, "total": len(qlist)})
 
-@app.route("/submit_answer", methods=["POST"])
+@route("/get_questions", methods=["GET", "POST"])
+def get_questions():
+    """Whole question list in one round trip so the interview page can prefetch."""
+    data = get_request_json_flexible() or {}
+    session_id = data.get("session_id")
+    try:
+        qlist = db.get_questions(session_id)
+    except Exception:
+        log.exception("DB error in get_questions")
+        qlist = None
+    if qlist is None:
+        return jsonify({"error": "session not found"}), 404
+    return jsonify({"questions": qlist, "total": len(qlist)})
+
+@route("/api/cache_stats")
+def cache_stats():
+    return jsonify({"questions": db.question_cache.stats()})
+
+@route("/api/question_bank")
+def api_question_bank():
+    """Loaded question bank: version, subjects with difficulty/tag breakdown, source files."""
+    return jsonify(get_question_bank().stats())
+
+@route("/submit_answer", methods=["POST"])
 def submit_answer():
     data = get_request_json_flexible() or {}
     session_id = data.get("session_id")
     question = data.get("question", "")
     answer = data.get("answer", "")
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO answers (session_id,question,answer,ts) VALUES (?,?,?,?)",
-                    (session_id, question, answer, datetime.utcnow().isoformat()))
-        conn.commit()
+        # group-committed with other writers; returns once the row is durable
+        db.add_answer(session_id, question, answer)
     except Exception:
         log.exception("Failed to save answer")
         return jsonify({"ok": False, "error": "db_error"}), 500
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
     return jsonify({"ok": True})
 
-@app.route("/generate_followup", methods=["POST"])
+BULK_MAX_ANSWERS = int(os.environ.get("BULK_MAX_ANSWERS", 100))
+
+@route("/submit_answers", methods=["POST"])
+def submit_answers():
+    """
+    Several turns of one session in one request, stored in one transaction:
+    { session_id, answers: [{question, answer, kind ("answer" | "followup"), timings: {...}, client_id, ts}, ...],
+      followup: true (optional), history: [...] (optional) }
+    With followup=true the follow-up to the last answer is generated first, stored with it and returned,
+    which replaces the /submit_answer + /generate_followup pair. Items with an already stored
+    client_id are skipped, so clients can safely resend a batch after a network error.
+    Form posts carry `answers` (and `history`) as JSON strings.
+    Returns: { ok: true, accepted: n, duplicates: m, follow_up: "<text>" } or error; accepted counts
+    the answers actually stored, duplicates the ones skipped as already stored.
+    """
+    payload, status = submit_answers_result(get_request_json_flexible() or {})
+    return jsonify(payload), status
+
+def submit_answers_result(data):
+    """Body of /submit_answers as (payload, status)."""
+    session_id = data.get("session_id")
+    items = _json_field(data.get("answers"))
+    if not session_id or not isinstance(items, list) or not items:
+        return {"ok": False, "error": "missing session_id or answers"}, 400
+    if len(items) > BULK_MAX_ANSWERS:
+        return {"ok": False, "error": f"at most {BULK_MAX_ANSWERS} answers per request"}, 413
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not (item.get("answer") or item.get("question")):
+            return {"ok": False, "error": f"answers[{i}] needs a question or an answer"}, 400
+        if item.get("timings") is not None and not isinstance(item["timings"], dict):
+            return {"ok": False, "error": f"answers[{i}].timings must be an object"}, 400
+
+    payload = {"ok": True}
+    if _truthy(data.get("followup")):
+        last = items[-1]
+        history = _json_field(data.get("history")) or [f"Q: {t.get('question', '')}\nA: {t.get('answer', '')}" for t in items[:-1]]
+        followup, _ = followup_result({"session_id": session_id, "question": last.get("question"),
+                                       "answer": last.get("answer"), "history": history})
+        if followup.get("ok"):
+            payload["follow_up"] = items[-1]["follow_up"] = followup["follow_up"]
+    try:
+        inserted = db.add_answers(session_id, items)
+    except Exception:
+        log.exception("Failed to save answers")
+        return {"ok": False, "error": "db_error"}, 500
+    payload["accepted"] = inserted
+    payload["duplicates"] = len(items) - inserted
+    return payload, 200
+
+def _json_field(value):
+    """A list/dict field that form posts send as a JSON string."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+def _truthy(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+@route("/generate_followup", methods=["POST"])
 def generate_followup():
     """
     Generate a single, concise follow-up question based on the candidate's answer.
     Expects JSON: { session_id, question, answer, history(optional:list of strings) }
     Returns: { ok: true, follow_up: "<text>" } or error.
     """
-    data = get_request_json_flexible() or {}
+    payload, status = followup_result(get_request_json_flexible() or {})
+    return jsonify(payload), status
+
+def followup_result(data):
+    """Body of /generate_followup as (payload, status). Blocks while the LLM answers (asgi.py runs it off-loop)."""
     session_id = data.get("session_id")
     question = (data.get("question") or "").strip()
     answer = (data.get("answer") or "").strip()
     history = data.get("history") or []
 
     if not session_id or not answer:
-        return jsonify({"ok": False, "error": "missing session_id or answer"}), 400
-
-    # Build context for LLM / fallback
-    # Keep prompt concise and instruct model to return a single short follow-up question.
-    prompt_system = (
-        "You are an expert interviewer. Generate exactly one concise, relevant follow-up question "
-        "that asks for clarification, a deeper explanation, or an example based strictly on the candidate's answer. "
-        "Do not produce multiple questions. Keep it short (max 25 words) and professional."
-    )
-    user_content = f"Previous question: {question}\n\nCandidate answer: {answer}"
-    if isinstance(history, list) and history:
-        # include brief history if provided
-        hist_text = "\n\n".join(history[-3:])  # only last few entries
-        user_content += f"\n\nRecent history:\n{hist_text}"
-
-    follow_up_text = None
-
-    # Try OpenAI if configured
-    if openai:
-        try:
-            # Use the Chat Completions API if available
-            # Note: choose model according to your account; "gpt-4o-mini" is used here as an example.
-            response = openai.ChatCompletion.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": prompt_system},
-                    {"role": "user", "content": user_content}
-                ],
-                max_tokens=60,
-                temperature=0.2,
-                n=1,
-            )
-            # Extract text safely based on API response shape
-            follow_up_text = None
-            if response and "choices" in response and len(response["choices"]) > 0:
-                c = response["choices"][0]
-                # Some SDKs return message/content
-                if isinstance(c.get("message"), dict) and c["message"].get("content"):
-                    follow_up_text = c["message"]["content"].strip()
-                elif c.get("text"):
-                    follow_up_text = c.get("text").strip()
-            if follow_up_text:
-                # Clean newline characters
-                follow_up_text = follow_up_text.replace("\n", " ").strip()
-        except Exception as e:
-            log.exception("OpenAI follow-up generation failed, falling back. Error: %s", e)
-            follow_up_text = None
-
-    # Fallback heuristic generator if OpenAI not available or failed
-    if not follow_up_text:
-        try:
-            # Simple rule-based follow-up generator:
-            # - If answer contains 'because' or 'since', ask for example
-            # - If answer contains technical terms, ask for explanation
-            # - Otherwise, ask for clarification or example
-            a = answer.lower()
-            if any(word in a for word in ["because", "since", "therefore", "so that"]):
-                follow_up_text = "Can you give a concrete example to illustrate that?"
-            elif any(word in a for word in ["for example", "e.g.", "such as"]):
-                follow_up_text = "Can you explain the steps you took in that example?"
-            elif any(term in a for term in ["algorithm", "data", "model", "architecture", "thread", "process", "api", "hash"]):
-                follow_up_text = "Can you explain the technical details or steps involved?"
-            elif len(a.split()) < 10:
-                follow_up_text = "Could you expand on that with more detail or an example?"
-            else:
-                follow_up_text = "Can you provide more detail or an example to illustrate your point?"
-        except Exception as e:
-            log.exception("Fallback follow-up generator error: %s", e)
-            follow_up_text = "Can you elaborate on that?"
+        return {"ok": False, "error": "missing session_id or answer"}, 400
 
-    # Safety: make sure the follow-up is short and not too long
-    if follow_up_text and len(follow_up_text) > 200:
-        follow_up_text = follow_up_text[:197].rsplit(" ", 1)[0] + "..."
+    # LLM (if configured) with keyword-rule fallback, see followup_engine.py
+    llm = get_llm_client() if get_llm_client else None
+    follow_up_text = followup_engine.generate(question, answer, history, llm=llm)
 
     # Log the follow-up generation attempt
     log.info("Follow-up generated for session %s: %s", session_id, follow_up_text)
 
-    return jsonify({"ok": True, "follow_up": follow_up_text})
+    return {"ok": True, "follow_up": follow_up_text}, 200
 
 
-@app.route("/proctor", methods=["POST"])
-def proctor():
-    # accepts form-data snapshot_b64 (data URL) and session_id
-    session_id = request.form.get("session_id", "unknown")
-    img_b64 = request.form.get("snapshot_b64")
-    if not img_b64:
-        return jsonify({"error": "no image"}), 400
-    import re, base64
-    m = re.search(r"data:image/.+;base64,(.+)", img_b64)
-    if not m:
-        return jsonify({"error": "bad image data"}), 400
-    b64_raw = m.group(1)
+# Proctoring: results are published per session so reviewers can poll or stream them;
+# the monitor keeps running per-session statistics and turns streaks into alerts
+PROCTOR_MONITOR = ProctorMonitor()
+PROCTOR_RESULTS = ResultStore(listeners=[PROCTOR_MONITOR.observe])
+_ingest_pipeline = None
+_ingest_lock = threading.Lock()
+
+@PROCTOR_STAGE_SECONDS.timed(stage="b64_decode")
+def decode_snapshot_b64(value):
+    """
+    Decode a `data:image/...;base64,` URL (or bare base64) exactly once.
+    Only the short header is inspected instead of regex-scanning the whole payload.
+    Returns bytes, or None if the value is not a valid image data URL.
+    """
+    import binascii
+    if value.startswith("data:"):
+        comma = value.find(",", 0, 100)
+        if comma < 0 or not value[:comma].startswith("data:image/") or not value[:comma].endswith(";base64"):
+            return None
+        value = value[comma + 1:]
+    try:
+        return binascii.a2b_base64(value)
+    except (binascii.Error, ValueError):
+        return None
+
+def image_ext(data):
+    """Pick a file extension from the image magic bytes (defaults to jpg)."""
+    head = bytes(data[:12])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    return "jpg"
+
+@PROCTOR_STAGE_SECONDS.timed(stage="store_put")
+def save_snapshot(session_id, data, ext="jpg"):
+    """Store already decoded frame bytes in the snapshot store; returns the frame's unique name."""
+    return get_snapshot_store().put(session_id, data, ext)
+
+def analyze_snapshot(data, session_id=None, wait=False):
+    """
+    Run face detection on decoded frame bytes.
+    With wait=True (background ingest) a busy engine is retried instead of raising EngineBusy.
+    """
+    if get_detection_engine is None:
+        fd = load_face_detection()
+        if fd is None:
+            return {"faces_detected": 0, "status": "no-op"}
+        if DETECT_TRACKING and session_id:
+            return fd.pop_timings(fd.detect_faces_for_session(session_id, data))
+        return fd.pop_timings(fd.detect_faces(data))
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            return get_detection_engine().detect(data, session_id)
+        except EngineBusy:
+            if not wait or time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def record_analysis(session_id, filename, analysis):
+    """Persist one proctoring result (queued for the DB writer's next group commit)."""
+    try:
+        db.add_proctor_event(session_id, analysis, file_path=filename)
+    except Exception:
+        log.exception("Failed to queue proctor event")
+
+def _process_snapshot(session_id, data, ext="jpg"):
+    filename = save_snapshot(session_id, data, ext)
     try:
-        b = base64.b64decode(b64_raw)
-        filename = f"{session_id}_{int(time.time())}.jpg"
-        path = UPLOAD_DIR / filename
-        with open(path, "wb") as f:
-            f.write(b)
+        analysis = analyze_snapshot(data, session_id, wait=True)
+    except Exception as e:
+        log.exception("Face detection error")
+        analysis = {"error": str(e)}
+    record_analysis(session_id, filename, analysis)
+    return filename, analysis
+
+def get_ingest_pipeline():
+    global _ingest_pipeline
+    with _ingest_lock:
+        if _ingest_pipeline is None:
+            _ingest_pipeline = IngestPipeline(_process_snapshot, store=PROCTOR_RESULTS)
+            metrics.callback("proctor_ingest_queue_depth", "Frames waiting for a background ingest worker",
+                             _ingest_pipeline.queue_depth)
+        return _ingest_pipeline
+
+def detection_load():
+    """Fill (0..1) of the queue frames wait in before detection; inline detection has none."""
+    fills = [0.0]
+    if get_detection_engine is not None:
+        fills.append(get_detection_engine().queue_fill())
+    if _ingest_pipeline is not None:
+        fills.append(_ingest_pipeline.queue_fill())
+    return max(fills)
+
+# every /proctor response tells the client how often, how large and at what quality to send next
+CAPTURE_POLICY = CapturePolicy(detection_load, PROCTOR_MONITOR.active_count, PROCTOR_MONITOR.session)
+
+def capture_width(values):
+    """Width the client captured the frame at (it reports it next to the frame), or None."""
+    try:
+        return int(values.get("capture_width"))
+    except (TypeError, ValueError):
+        return None
+
+def _busy_response(payload):
+    resp = jsonify(dict(payload, error="busy", retry_after=1))
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
+def _handle_snapshot(session_id, data, mode, width=None):
+    """Shared tail of /proctor and /proctor/raw once the frame bytes are in hand."""
+    ext = image_ext(data)
+    CAPTURE_POLICY.observe_frame(len(data), width)
+    if mode == "async":
+        try:
+            ticket = get_ingest_pipeline().enqueue(session_id, data, ext)
+        except IngestBusy:
+            return _busy_response({"capture": CAPTURE_POLICY.for_session(session_id, busy=True)})
+        return jsonify({"ticket": ticket, "status": "queued", "capture": CAPTURE_POLICY.for_session(session_id),
+                        "result_url": url_for("proctor_result", ticket=ticket)}), 202
+
+    try:
+        filename = save_snapshot(session_id, data, ext)
     except Exception as e:
         log.exception("Failed to save snapshot")
         return jsonify({"error": f"save_failed: {e}"}), 500
 
     try:
-        analysis = detect_face_from_base64(b64_raw)
+        analysis = analyze_snapshot(data, session_id)
+    except EngineBusy:
+        # backpressure: frame is saved, analysis skipped; client should slow down
+        return _busy_response({"saved": str(filename), "capture": CAPTURE_POLICY.for_session(session_id, busy=True)})
     except Exception as e:
         log.exception("Face detection error")
         analysis = {"error": str(e)}
-    return jsonify({"saved": str(filename), "analysis": analysis})
+    record_analysis(session_id, filename, analysis)
+    PROCTOR_RESULTS.publish(None, session_id, filename, analysis)
+    return jsonify({"saved": str(filename), "analysis": analysis, "capture": CAPTURE_POLICY.for_session(session_id)})
 
-@app.route("/dashboard")
-def dashboard():
+@route("/proctor", methods=["POST"])
+def proctor():
+    # accepts form-data snapshot_b64 (data URL) and session_id
+    # mode=async (or PROCTOR_INGEST=async) only enqueues the frame and returns a ticket
+    session_id = request.form.get("session_id", "unknown")
+    img_b64 = request.form.get("snapshot_b64")
+    mode = (request.form.get("mode") or PROCTOR_INGEST).lower()
+    if not img_b64:
+        return jsonify({"error": "no image"}), 400
+    data = decode_snapshot_b64(img_b64)
+    if not data:
+        return jsonify({"error": "bad image data"}), 400
+    return _handle_snapshot(session_id, data, mode, capture_width(request.form))
+
+@route("/proctor/raw", methods=["POST"])
+def proctor_raw():
+    """
+    Binary snapshot upload: multipart file field `snapshot`, or a raw
+    image/jpeg, image/webp or application/octet-stream body.
+    session_id and mode come from form fields or the query string.
+    """
+    session_id = request.values.get("session_id", "unknown")
+    mode = (request.values.get("mode") or PROCTOR_INGEST).lower()
+    upload = request.files.get("snapshot")
+    if upload is not None:
+        data = upload.read()
+    else:
+        data = request.get_data(cache=False)
+    if not data:
+        return jsonify({"error": "no image"}), 400
+    return _handle_snapshot(session_id, data, mode, capture_width(request.values))
+
+@route("/proctor/policy")
+def proctor_policy():
+    """Capture policy for a session's first snapshot (later ones come with each /proctor response)."""
+    return jsonify({"capture": CAPTURE_POLICY.for_session(request.args.get("session_id"))})
+
+@route("/proctor/result/<ticket>")
+def proctor_result(ticket):
+    event = PROCTOR_RESULTS.get_ticket(ticket)
+    if not event:
+        return jsonify({"error": "unknown ticket"}), 404
+    return jsonify(event)
+
+@route("/proctor/results/<session_id>")
+def proctor_results(session_id):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT id,name,email,subject,started_at FROM sessions ORDER BY started_at DESC")
-        sessions = cur.fetchall()
-        cur.execute("SELECT session_id, question, answer, ts FROM answers ORDER BY ts DESC LIMIT 200")
-        answers = cur.fetchall()
+        since = int(request.args.get("since", 0))
     except Exception:
-        log.exception("DB error loading dashboard")
-        sessions, answers = [], []
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
-    return render_template("dashboard.html", sessions=sessions, answers=answers)
+        since = 0
+    events = PROCTOR_RESULTS.since(session_id, since)
+    last = events[-1]["seq"] if events else since
+    return jsonify({"session_id": session_id, "results": events, "last_seq": last})
+
+@route("/proctor/stream/<session_id>")
+def proctor_stream(session_id):
+    """Server-sent events: one `analysis` event per processed frame of this session."""
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args.get("since", 0))
+    except Exception:
+        since = 0
+    return Response(stream_with_context(sse_events(PROCTOR_RESULTS, session_id, since)),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-@app.route("/download/<filename>")
+def _int_arg(name, default=0):
+    try:
+        return int(request.args.get(name, default))
+    except Exception:
+        return default
+
+@route("/proctor/alerts")
+def proctor_alerts():
+    """Alerts newer than ?since=<seq>, for all sessions or ?session_id=."""
+    since = _int_arg("since")
+    alerts = PROCTOR_MONITOR.feed.since(request.args.get("session_id") or None, since)
+    return jsonify({"alerts": alerts, "last_seq": alerts[-1]["seq"] if alerts else max(since, 0)})
+
+@route("/proctor/alerts/stream")
+def proctor_alert_stream():
+    """Server-sent events for reviewers: one `alert` event per streak start/end, all sessions by default."""
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args.get("since", -1))
+    except Exception:
+        since = -1
+    if since < 0:
+        # a new reviewer starts with what happens from now on, not the whole buffer
+        since = PROCTOR_MONITOR.feed.last_seq
+    return Response(stream_with_context(sse_events(PROCTOR_MONITOR.feed, request.args.get("session_id") or None,
+                                                   since, event="alert")),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@route("/proctor/live")
+def proctor_live():
+    """
+    Running statistics of the sessions seen by this process, most recent first.
+    ?active=<seconds> only sessions with a frame since then, ?alerting=1 only sessions with alerts.
+    """
+    sessions = PROCTOR_MONITOR.sessions(active_within=_int_arg("active") or None,
+                                        alerting_only=request.args.get("alerting") in ("1", "true", "yes"),
+                                        limit=_int_arg("limit", 500) or None)
+    return jsonify({"sessions": sessions, "alert_seq": PROCTOR_MONITOR.feed.last_seq})
+
+@route("/proctor/live/<session_id>")
+def proctor_live_session(session_id):
+    stats = PROCTOR_MONITOR.session(session_id)
+    if stats is None:
+        return jsonify({"error": "no live statistics for this session"}), 404
+    return jsonify(stats)
+
+EXPORT_CHUNK_BYTES = int(os.environ.get("EXPORT_CHUNK_BYTES", 64 * 1024))
+
+def ndjson_transcripts(transcripts, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """NDJSON lines for db.iter_transcripts() rows, joined into chunks of about chunk_bytes."""
+    buf, size = [], 0
+    for (sid, name, email, subject, started_at, questions_json), turns in transcripts:
+        line = json.dumps({
+            "session_id": sid, "name": name, "email": email, "subject": subject, "started_at": started_at,
+            "questions": json.loads(questions_json) if questions_json else [],
+            "answers": [{"id": aid, "kind": kind, "question": q, "answer": a, "follow_up": follow_up,
+                         "timings": json.loads(timings) if timings else None, "ts": ts}
+                        for aid, q, a, kind, follow_up, timings, ts in turns],
+        }) + "\n"
+        buf.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+@route("/export/transcripts.ndjson")
+def export_transcripts():
+    """
+    Streaming export for grading: one JSON line per session with its questions and answers in order.
+    Filters: ?session_id= (repeatable), ?subject=, ?from=, ?to= (started_at dates), ?limit=.
+    ?after=<session id> resumes after the last line a consumer received (lines are ordered by session id).
+    """
+    transcripts = db.iter_transcripts(session_ids=request.args.getlist("session_id") or None,
+                                      subject=(request.args.get("subject") or "").strip() or None,
+                                      date_from=(request.args.get("from") or "").strip() or None,
+                                      date_to=(request.args.get("to") or "").strip() or None,
+                                      after=request.args.get("after") or None,
+                                      limit=_int_arg("limit") or None)
+    return Response(stream_with_context(ndjson_transcripts(transcripts)), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+DASHBOARD_PAGE_SIZE = int(os.environ.get("DASHBOARD_PAGE_SIZE", 50))
+
+def _session_page_from_args():
+    """Build a keyset page from ?subject=&from=&to=&cursor=&limit= query args."""
+    try:
+        limit = int(request.args.get("limit", DASHBOARD_PAGE_SIZE))
+    except Exception:
+        limit = DASHBOARD_PAGE_SIZE
+    return db.SessionPage(subject=(request.args.get("subject") or "").strip() or None,
+                          date_from=(request.args.get("from") or "").strip() or None,
+                          date_to=(request.args.get("to") or "").strip() or None,
+                          cursor=request.args.get("cursor") or None,
+                          limit=limit)
+
+@route("/dashboard")
+def dashboard():
+    # the page is read in one short query; the HTML is streamed to the client as it renders
+    page = _session_page_from_args()
+    answers = db.recent_answers(int(os.environ.get("DASHBOARD_RECENT_ANSWERS", 50)))
+    filters = {k: request.args.get(k, "") for k in ("subject", "from", "to")}
+    return Response(stream_template("dashboard.html", sessions=page, answers=answers, page=page,
+                                    filters=filters, subjects=get_question_bank().subjects()))
+
+@route("/dashboard/session/<session_id>")
+def dashboard_session(session_id):
+    row = db.get_session_row(session_id)
+    if not row:
+        return "Session not found", 404
+    total, alerts, errors = db.proctor_summary(session_id)
+    return Response(stream_template("session.html", session=row,
+                                    questions=db.get_questions(session_id) or [],
+                                    answers=db.iter_session_answers(session_id),
+                                    alerts=db.session_proctor_events(session_id, alerts_only=True, limit=200),
+                                    proctor_total=total, proctor_alerts=alerts, proctor_errors=errors))
+
+@route("/api/sessions")
+def api_sessions():
+    page = _session_page_from_args()
+    keys = ("id", "name", "email", "subject", "started_at")
+    sessions = [dict(zip(keys, row)) for row in page]
+    return jsonify({"sessions": sessions, "next_cursor": page.next_cursor})
+
+@route("/api/sessions/<session_id>")
+def api_session_detail(session_id):
+    row = db.get_session_row(session_id)
+    if not row:
+        return jsonify({"error": "session not found"}), 404
+    total, alerts, errors = db.proctor_summary(session_id)
+    events = []
+    for ts, faces, status, boxes_json, file_path in db.session_proctor_events(session_id, alerts_only=True, limit=200):
+        events.append({"ts": ts, "faces_detected": faces, "status": status,
+                       "boxes": json.loads(boxes_json or "[]"), "file": file_path})
+    return jsonify({
+        "session": dict(zip(("id", "name", "email", "subject", "started_at"), row)),
+        "questions": db.get_questions(session_id) or [],
+        "answers": [{"question": q, "answer": a, "ts": ts, "kind": kind, "follow_up": follow_up}
+                    for q, a, ts, kind, follow_up in db.session_answers(session_id)],
+        "proctoring": {"events": total, "alerts": alerts, "errors": errors, "recent_alerts": events,
+                       "live": PROCTOR_MONITOR.session(session_id)},
+    })
+
+@route("/download/<filename>")
 def download_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    # indexed frames are immutable: long-lived ETag/caching, Range requests answered with 206
+    entry = get_snapshot_store().lookup(filename)
+    if entry is None:
+        # files written before the snapshot store (flat uploads/ directory)
+        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    path, mimetype, etag, packed = entry
+    if path.is_file():
+        return send_file(path, mimetype=mimetype, as_attachment=not request.args.get("inline"),
+                         download_name=filename, conditional=True, etag=etag, max_age=86400)
+    if packed is None:
+        return "File not found", 404
+    # loose file was packed away: read the frame straight out of its session segment
+    try:
+        data = segments.read_frame(segments.SEGMENT_DIR / packed[0], packed[1], packed[2])
+    except FileNotFoundError:
+        return "File not found", 404
+    resp = Response(data, mimetype="image/jpeg")
+    if not request.args.get("inline"):
+        resp.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    resp.set_etag(etag)
+    resp.cache_control.max_age = 86400
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+@route("/api/snapshots/<session_id>")
+def api_snapshots(session_id):
+    try:
+        limit = min(int(request.args.get("limit", 200)), 2000)
+    except Exception:
+        limit = 200
+    frames = [{"name": name, "ts": ts, "url": url_for("download_file", filename=name)}
+              for name, ts in get_snapshot_store().session_snapshots(session_id, limit)]
+    return jsonify({"session_id": session_id, "snapshots": frames})
+
+@route("/segments/<session_id>")
+def session_segments(session_id):
+    """A session's MJPEG segments with their time span; each links to the file and its index."""
+    out = []
+    for seg in segments.list_segments(session_id):
+        seg["url"] = url_for("segment_file", session_id=session_id, seq=seg["seq"])
+        seg["index_url"] = url_for("segment_index", session_id=session_id, seq=seg["seq"])
+        out.append(seg)
+    return jsonify({"session_id": session_id, "segments": out,
+                    "stream_url": url_for("segment_stream", session_id=session_id)})
+
+@route("/segments/<session_id>/<int:seq>.mjpeg")
+def segment_file(session_id, seq):
+    # Range requests let players seek using the byte offsets from the index
+    path = segments.SEGMENT_DIR / segments.segment_rel(session_id, seq)
+    if not path.is_file():
+        return "Segment not found", 404
+    return send_file(path, mimetype="video/x-motion-jpeg", conditional=True,
+                     download_name=f"{segments.safe_session_id(session_id)}_{seq:06d}.mjpeg")
+
+@route("/segments/<session_id>/<int:seq>/index")
+def segment_index(session_id, seq):
+    path = segments.SEGMENT_DIR / segments.segment_rel(session_id, seq)
+    records = segments.read_index(path.with_suffix(".idx"))
+    if not records and not path.is_file():
+        return jsonify({"error": "segment not found"}), 404
+    return jsonify({"seq": seq, "frames": [{"ts": ts, "offset": off, "length": n} for ts, off, n in records]})
+
+@route("/segments/<session_id>/frame")
+def segment_frame(session_id):
+    """The frame shown at ?ts= (epoch seconds): the last one at or before it."""
+    try:
+        ts = float(request.args.get("ts", time.time()))
+    except Exception:
+        return jsonify({"error": "bad ts"}), 400
+    hit = segments.frame_at(session_id, ts)
+    if hit is None:
+        return "No frames", 404
+    resp = Response(hit[1], mimetype="image/jpeg")
+    resp.headers["X-Frame-Timestamp"] = repr(hit[0])
+    return resp
+
+@route("/segments/<session_id>/stream")
+def segment_stream(session_id):
+    """
+    Replay a session as multipart/x-mixed-replace (plays in an <img> tag).
+    ?from= / ?to= limit the time range, ?speed= scales the original pacing (0 = as fast as possible).
+    """
+    try:
+        start = float(request.args["from"]) if request.args.get("from") else None
+        end = float(request.args["to"]) if request.args.get("to") else None
+        speed = float(request.args.get("speed", 1))
+    except Exception:
+        return jsonify({"error": "bad from/to/speed"}), 400
+
+    def generate():
+        prev = None
+        for ts, frame in segments.iter_session_frames(session_id, start, end):
+            if speed > 0 and prev is not None:
+                time.sleep(min(max(ts - prev, 0) / speed, 2.0))
+            prev = ts
+            yield (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(frame)).encode() +
+                   b"\r\n\r\n" + frame + b"\r\n")
+    return Response(stream_with_context(generate()), mimetype="multipart/x-mixed-replace; boundary=frame",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@route("/api/snapshot_stats")
+def api_snapshot_stats():
+    stats = get_snapshot_store().usage()
+    if segments.SEGMENTS_ENABLED:
+        assembler = segments.get_assembler()
+        stats["segments"] = {"appended": assembler.appended, "dropped": assembler.dropped,
+                             "open": len(assembler.open_segments())}
+    return jsonify(stats)
+
+@route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of this process's counters and histograms (see metrics.py)."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE, headers={"Cache-Control": "no-cache"})
+
+def _before_request():
+    start_services()
+    g.request_started = time.perf_counter()
+    # PROFILE_REQUESTS=1 samples requests; ?profile=1 forces one (still only dumped when slow)
+    g.request_profile = metrics.profiler.start(force=request.args.get("profile") == "1")
+
+def _after_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method,
+                                             status=str(response.status_code))
+        metrics.profiler.finish(g.pop("request_profile", None), elapsed, f"{request.method}_{endpoint}")
+    return response
+
+def create_app(config=None):
+    """
+    Build a configured Flask app with every route registered. Cheap: background services start on the
+    first request, and detector / LLM / question bank on first use, unless warm_up() is called.
+    """
+    flask_app = Flask(__name__, template_folder=str(TEMPLATES_DIR), static_folder=str(STATIC_DIR))
+    flask_app.config['UPLOAD_FOLDER'] = str(UPLOAD_DIR)
+    flask_app.config.update(config or {})
+    for rule, view, options in ROUTES:
+        flask_app.add_url_rule(rule, view_func=view, **options)
+    flask_app.before_request(_before_request)
+    flask_app.after_request(_after_request)
+    return flask_app
+
+app = create_app()
 
 if __name__ == "__main__":
+    # development server only; see serve.py for the production WSGI/ASGI modes
     log.info("Starting Flask app on http://0.0.0.0:5000")
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,326 @@
+# asgi.py
+# ASGI entry point:  uvicorn asgi:application   (or python serve.py --mode asgi)
+#
+# The endpoints that spend most of their time waiting are served natively on the event loop:
+#   POST /proctor, /proctor/raw   frame stored on the I/O executor; face detection is awaited on the
+#                                 detection pool's future (inline mode: a CPU executor), so no
+#                                 thread sits blocked while it runs
+#   POST /generate_followup       LLM call runs on the LLM client's request executor (question pool
+#                                 refills use a separate one, so they never queue ahead of it)
+#   POST /submit_answers          the same when followup=true, else the I/O executor (one DB write)
+# Body parsing (JSON, form, multipart) and base64 decoding run on the CPU executor, not the loop.
+# Every other route is the Flask app from create_app(), run on a thread pool by WsgiBridge; its
+# response chunks (streamed templates, SSE) are forwarded as they are produced.
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wrappers import Request
+
+import app as backend
+import metrics
+
+log = logging.getLogger("backend.asgi")
+
+ASGI_IO_THREADS = int(os.environ.get("ASGI_IO_THREADS", 16))
+ASGI_CPU_THREADS = int(os.environ.get("ASGI_CPU_THREADS", os.cpu_count() or 2))
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", 32))
+ASGI_MAX_BODY = int(os.environ.get("ASGI_MAX_BODY", 16 * 1024 * 1024))
+
+try:
+    from detection_engine import DETECT_TIMEOUT
+except Exception:
+    DETECT_TIMEOUT = 5.0
+
+
+def _json(status, payload, headers=None):
+    body = json.dumps(payload).encode("utf-8")
+    hdrs = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    for k, v in (headers or {}).items():
+        hdrs.append((k.lower().encode("latin-1"), str(v).encode("latin-1")))
+    return status, hdrs, body
+
+
+def _busy(payload):
+    return _json(503, dict(payload, error="busy", retry_after=1), {"Retry-After": "1"})
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI http scope whose body has already been received."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]), "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0], "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0), "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body), "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+            continue
+        key = "HTTP_" + key
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+def _parsed_request(scope, body):
+    """
+    Wrap an already received body in a werkzeug Request so form/multipart parsing matches Flask, and
+    parse it now (werkzeug caches the result): called on an executor, handlers then only read it.
+    """
+    req = Request(_environ(scope, body))
+    if req.is_json:
+        req.get_json(silent=True)
+    else:
+        req.form
+    return req
+
+
+async def _read_body(receive, limit=ASGI_MAX_BODY):
+    """Whole request body, or None once it exceeds limit."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b"".join(chunks)
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+class WsgiBridge:
+    """
+    Serve a WSGI app from ASGI: the app runs on a thread pool and each response chunk is handed to
+    the event loop as soon as it is produced, so streamed pages and server-sent events keep streaming.
+    A client disconnect stops the iteration at the next chunk.
+    """
+    def __init__(self, wsgi_app, threads=ASGI_WSGI_THREADS):
+        self.app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        body = await _read_body(receive)
+        if body is None:
+            status, headers, payload = _json(413, {"error": "request too large"})
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": payload})
+            return
+        loop = asyncio.get_running_loop()
+        out = asyncio.Queue()
+        disconnected = threading.Event()
+
+        def put(item):
+            loop.call_soon_threadsafe(out.put_nowait, item)
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response["start"] = (int(status.split(" ", 1)[0]),
+                                     [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers])
+            try:
+                result = self.app(_environ(scope, body), start_response)
+                try:
+                    put(("start", response["start"]))
+                    for chunk in result:
+                        if disconnected.is_set():
+                            break
+                        if chunk:
+                            put(("body", chunk))
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            except Exception as e:
+                put(("error", e))
+            put(("end", None))
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        loop.run_in_executor(self.executor, run)
+        started = False
+        try:
+            while True:
+                kind, value = await out.get()
+                if kind == "start":
+                    await send({"type": "http.response.start", "status": value[0], "headers": value[1]})
+                    started = True
+                elif kind == "body":
+                    await send({"type": "http.response.body", "body": value, "more_body": True})
+                elif kind == "error":
+                    log.error("WSGI app error on %s", scope.get("path"), exc_info=value)
+                    if not started:
+                        status, headers, payload = _json(500, {"error": "internal error"})
+                        await send({"type": "http.response.start", "status": status, "headers": headers})
+                        await send({"type": "http.response.body", "body": payload})
+                        return
+                else:
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+        finally:
+            disconnected.set()
+            watcher.cancel()
+
+
+class Application:
+    def __init__(self, flask_app=None):
+        self.flask_app = flask_app or backend.app
+        self.wsgi = WsgiBridge(self.flask_app)
+        self.io = ThreadPoolExecutor(max_workers=ASGI_IO_THREADS, thread_name_prefix="asgi-io")
+        self.cpu = ThreadPoolExecutor(max_workers=ASGI_CPU_THREADS, thread_name_prefix="asgi-cpu")
+        self.native = {
+            "/proctor": self.proctor,
+            "/proctor/raw": self.proctor_raw,
+            "/generate_followup": self.generate_followup,
+            "/submit_answers": self.submit_answers,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        handler = self.native.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if handler is None:
+            return await self.wsgi(scope, receive, send)
+        if not backend._services_started:
+            # the Flask app does this in before_request; native handlers bypass it
+            await asyncio.get_running_loop().run_in_executor(self.io, backend.start_services)
+        started = time.perf_counter()
+        body = await _read_body(receive)
+        if body is None:
+            status, headers, payload = _json(413, {"error": "request too large"})
+        else:
+            try:
+                req = await asyncio.get_running_loop().run_in_executor(self.cpu, _parsed_request, scope, body)
+                status, headers, payload = await handler(req)
+            except Exception as e:
+                log.exception("ASGI handler error on %s", scope.get("path"))
+                status, headers, payload = _json(500, {"error": str(e)})
+        # same series as the Flask views (app._after_request), endpoint = view name
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=handler.__name__,
+                                             method="POST", status=str(status))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if backend.WARM_UP:
+                    await asyncio.get_running_loop().run_in_executor(self.io, backend.warm_up)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for executor in (self.io, self.cpu, self.wsgi.executor):
+                    executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # ---- native handlers (same request/response contract as the Flask views) ----
+
+    async def proctor(self, req):
+        session_id = req.form.get("session_id", "unknown")
+        img_b64 = req.form.get("snapshot_b64")
+        mode = (req.form.get("mode") or backend.PROCTOR_INGEST).lower()
+        if not img_b64:
+            return _json(400, {"error": "no image"})
+        data = await asyncio.get_running_loop().run_in_executor(self.cpu, backend.decode_snapshot_b64, img_b64)
+        if not data:
+            return _json(400, {"error": "bad image data"})
+        return await self._handle_snapshot(session_id, data, mode, backend.capture_width(req.form))
+
+    async def proctor_raw(self, req):
+        session_id = req.values.get("session_id", "unknown")
+        mode = (req.values.get("mode") or backend.PROCTOR_INGEST).lower()
+        upload = req.files.get("snapshot")
+        # a large multipart upload is spooled to a temporary file
+        read = upload.read if upload is not None else partial(req.get_data, cache=False)
+        data = await asyncio.get_running_loop().run_in_executor(self.io, read)
+        if not data:
+            return _json(400, {"error": "no image"})
+        return await self._handle_snapshot(session_id, data, mode, backend.capture_width(req.values))
+
+    async def _handle_snapshot(self, session_id, data, mode, width=None):
+        ext = backend.image_ext(data)
+        policy = backend.CAPTURE_POLICY
+        policy.observe_frame(len(data), width)
+        if mode == "async":
+            try:
+                ticket = backend.get_ingest_pipeline().enqueue(session_id, data, ext)
+            except backend.IngestBusy:
+                return _busy({"capture": policy.for_session(session_id, busy=True)})
+            return _json(202, {"ticket": ticket, "status": "queued", "capture": policy.for_session(session_id),
+                               "result_url": f"/proctor/result/{ticket}"})
+
+        loop = asyncio.get_running_loop()
+        try:
+            filename = await loop.run_in_executor(self.io, backend.save_snapshot, session_id, data, ext)
+        except Exception as e:
+            log.exception("Failed to save snapshot")
+            return _json(500, {"error": f"save_failed: {e}"})
+        try:
+            analysis = await self._detect(loop, data, session_id)
+        except backend.EngineBusy:
+            return _busy({"saved": str(filename), "capture": policy.for_session(session_id, busy=True)})
+        except Exception as e:
+            log.exception("Face detection error")
+            analysis = {"error": str(e)}
+        backend.record_analysis(session_id, filename, analysis)
+        backend.PROCTOR_RESULTS.publish(None, session_id, filename, analysis)
+        return _json(200, {"saved": str(filename), "analysis": analysis, "capture": policy.for_session(session_id)})
+
+    async def _detect(self, loop, data, session_id):
+        if backend.get_detection_engine is None:
+            return await loop.run_in_executor(self.cpu, backend.analyze_snapshot, data, session_id)
+        fut = backend.get_detection_engine().submit(data, session_id)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), DETECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {"faces_detected": 0, "status": "timeout"}
+
+    def _llm_executor(self):
+        llm = backend.get_llm_client() if backend.get_llm_client else None
+        return llm.executor if llm is not None and llm.enabled else self.io
+
+    async def generate_followup(self, req):
+        data = req.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = dict(req.values.items())
+        payload, status = await asyncio.get_running_loop().run_in_executor(
+            self._llm_executor(), backend.followup_result, data)
+        return _json(status, payload)
+
+    async def submit_answers(self, req):
+        # same inputs as the Flask route (get_request_json_flexible): JSON body, else form / query fields
+        data = req.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = dict(req.args.items())
+            data.update(req.form.items())
+        executor = self._llm_executor() if backend._truthy(data.get("followup")) else self.io
+        payload, status = await asyncio.get_running_loop().run_in_executor(
+            executor, backend.submit_answers_result, data)
+        return _json(status, payload)
+
+
+application = Application()
@@ -0,0 +1,161 @@
+# bench_detectors.py
+# Replays stored snapshots through each face detector backend and reports throughput,
+# latency percentiles, memory use and agreement with the Haar baseline.
+#
+#   python bench_detectors.py                         # every backend whose model is present, over uploads/
+#   python bench_detectors.py --backends haar,lbp --repeat 5 --json results.json
+#
+# A backend named in --backends whose model is missing is an error (exit status 2), not a skip:
+# run python fetch_models.py first.
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import face_detection
+
+BASE_DIR = Path(__file__).resolve().parent
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux /proc, falls back to peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return float(np.percentile(values, pct))
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def agreement(baseline, boxes):
+    """(same face count?, mean best-match IoU of the baseline boxes)."""
+    same = len(baseline) == len(boxes)
+    if not baseline:
+        return same, 1.0 if not boxes else 0.0
+    ious = [max((iou(b, o) for o in boxes), default=0.0) for b in baseline]
+    return same, sum(ious) / len(ious)
+
+
+def load_frames(folder, limit=None):
+    frames = []
+    for p in sorted(Path(folder).glob("*")):
+        if p.suffix.lower() not in (".jpg", ".jpeg", ".webp", ".png"):
+            continue
+        img = cv2.imdecode(np.fromfile(str(p), np.uint8), cv2.IMREAD_COLOR)
+        if img is not None:
+            frames.append((p.name, img))
+        if limit and len(frames) >= limit:
+            break
+    return frames
+
+
+def run_backend(name, frames, repeat):
+    mem_before = rss_mb()
+    t_load = time.perf_counter()
+    det = face_detection.load_detector(name)
+    load_ms = (time.perf_counter() - t_load) * 1000
+    grays = [cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for _, img in frames]
+    inputs = [img for _, img in frames] if det.needs_color else grays
+    det.detect(inputs[0])  # warm-up
+    latencies = []
+    results = []
+    t0 = time.perf_counter()
+    for r in range(repeat):
+        for i, img in enumerate(inputs):
+            s = time.perf_counter()
+            boxes = det.detect(img, min_size=(60, 60))
+            latencies.append((time.perf_counter() - s) * 1000)
+            if r == 0:
+                results.append(boxes)
+    total = time.perf_counter() - t0
+    return {
+        "backend": name,
+        "frames": len(latencies),
+        "fps": len(latencies) / total if total else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "load_ms": load_ms,
+        "mem_mb": rss_mb() - mem_before,
+        "boxes": results,
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark face detector backends on stored snapshots.")
+    ap.add_argument("--dir", default=str(BASE_DIR / "uploads"), help="folder of JPEG/WebP snapshots")
+    ap.add_argument("--backends", default=None,
+                    help="comma separated backend names (default: all, skipping those without a model)")
+    ap.add_argument("--repeat", type=int, default=3, help="passes over the frame set")
+    ap.add_argument("--limit", type=int, default=None, help="use at most N frames")
+    ap.add_argument("--json", dest="json_out", default=None, help="also write results to this file")
+    args = ap.parse_args(argv)
+
+    cv2.setNumThreads(1)  # per-core numbers, comparable with one detection worker
+    explicit = args.backends is not None
+    names = [n.strip() for n in args.backends.split(",") if n.strip()] if explicit else list(face_detection.DETECTORS)
+    if "haar" not in names:
+        names.insert(0, "haar")  # baseline for agreement
+    available = []
+    for name in names:
+        try:
+            face_detection.load_detector(name)
+            available.append(name)
+        except Exception as e:
+            reason = f"unknown backend (one of {', '.join(face_detection.DETECTORS)})" if isinstance(e, KeyError) else e
+            if explicit:
+                print(f"{name}: {reason}", file=sys.stderr)
+                return 2
+            print(f"{name:<10} skipped: {reason}")
+
+    frames = load_frames(args.dir, args.limit)
+    if not frames:
+        print(f"No snapshots found in {args.dir}")
+        return 1
+    print(f"{len(frames)} frames from {args.dir}, {args.repeat} passes\n")
+
+    reports = [run_backend(name, frames, args.repeat) for name in available]
+
+    baseline = next((r for r in reports if r["backend"] == "haar"), None)
+    header = f"{'backend':<10} {'fps':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'load ms':>8} {'mem MB':>7} {'count=':>7} {'IoU':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in reports:
+        pairs = [agreement(b, o) for b, o in zip(baseline["boxes"], r["boxes"])] if baseline else []
+        r["count_agreement"] = sum(1 for same, _ in pairs if same) / len(pairs) if pairs else 0.0
+        r["mean_iou"] = sum(v for _, v in pairs) / len(pairs) if pairs else 0.0
+        print(f"{r['backend']:<10} {r['fps']:>8.1f} {r['p50_ms']:>8.2f} {r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+              f"{r['load_ms']:>8.1f} {r['mem_mb']:>7.1f} {r['count_agreement']:>7.0%} {r['mean_iou']:>6.2f}")
+
+    if args.json_out:
+        out = [{k: v for k, v in r.items() if k != "boxes"} for r in reports]
+        Path(args.json_out).write_text(json.dumps(out, indent=2), encoding="utf-8")
+        print(f"\nWrote {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
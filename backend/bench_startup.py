@@ -0,0 +1,123 @@
+# bench_startup.py
+# Cold-start benchmark: every run is a fresh interpreter that imports app.py (under -X importtime),
+# serves its first request through the test client and, with --warm-up, runs app.warm_up().
+# Reports the median of each phase and the modules that cost the most import time.
+#
+#   python bench_startup.py                              # 5 runs
+#   python bench_startup.py --runs 10 --warm-up --json startup.json
+#   python bench_startup.py --max-import-ms 400          # exit 1 if the median import is slower (CI)
+#
+# Each run gets a throwaway DB / snapshot / segment directory, so the first request includes the
+# schema migrations a new deployment would run. The LLM is disabled so nothing leaves the machine.
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+HEAVY_MODULES = ("cv2", "numpy")
+
+CHILD = """
+import sys, json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+heavy = [m for m in %(heavy)r if m in sys.modules]
+client = app.app.test_client()
+client.post("/get_question", json={"session_id": "bench-startup", "index": 0})
+t2 = time.perf_counter()
+out = {"import_ms": (t1 - t0) * 1000, "first_request_ms": (t2 - t1) * 1000, "loaded_at_import": heavy}
+if %(warm)r:
+    out["warm_up_ms"] = {k: v * 1000 for k, v in app.warm_up(llm=False).items()}
+print("BENCH " + json.dumps(out))
+"""
+
+
+def parse_importtime(stderr):
+    """Self time per top-level package in ms, from `python -X importtime` output."""
+    per_pkg = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, self_us, _, name = [p.strip() for p in line.replace("import time:", "|", 1).split("|")]
+            per_pkg[name.split(".")[0]] = per_pkg.get(name.split(".")[0], 0.0) + int(self_us) / 1000.0
+        except ValueError:
+            continue
+    return per_pkg
+
+
+def run_once(warm, tmp):
+    env = dict(os.environ, DB_PATH=str(tmp / "bench.db"), SNAPSHOT_DIR=str(tmp / "uploads"),
+               SEGMENT_DIR=str(tmp / "segments"), LLM_CACHE_PATH=str(tmp / "llm_cache.db"),
+               OPENAI_API_KEY="", WARM_UP="0")
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD % {"heavy": HEAVY_MODULES, "warm": warm}],
+                          cwd=str(BASE_DIR), env=env, capture_output=True, text=True, timeout=300)
+    wall = (time.perf_counter() - t0) * 1000
+    line = next((l for l in proc.stdout.splitlines() if l.startswith("BENCH ")), None)
+    if proc.returncode != 0 or line is None:
+        raise RuntimeError(f"startup run failed (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    result = json.loads(line[6:])
+    result["process_ms"] = wall
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Measure app.py import time and time to first request.")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--warm-up", action="store_true", help="also time app.warm_up() (detector, pool, DB)")
+    ap.add_argument("--top", type=int, default=10, help="heaviest packages to list")
+    ap.add_argument("--max-import-ms", type=float, default=None, help="fail if the median import exceeds this")
+    ap.add_argument("--json", dest="json_out", default=None)
+    args = ap.parse_args(argv)
+
+    runs = []
+    for i in range(args.runs):
+        tmp = Path(tempfile.mkdtemp(prefix="bench-startup-"))
+        try:
+            runs.append(run_once(args.warm_up, tmp))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        r = runs[-1]
+        warm = sum(r.get("warm_up_ms", {}).values())
+        print(f"run {i + 1:>2}: import {r['import_ms']:7.1f} ms   first request {r['first_request_ms']:7.1f} ms"
+              + (f"   warm-up {warm:7.1f} ms" if args.warm_up else "") + f"   process {r['process_ms']:7.1f} ms")
+
+    med = lambda key: statistics.median(r[key] for r in runs)
+    report = {"runs": args.runs, "import_ms": round(med("import_ms"), 1),
+              "first_request_ms": round(med("first_request_ms"), 1), "process_ms": round(med("process_ms"), 1),
+              "loaded_at_import": sorted({m for r in runs for m in r["loaded_at_import"]})}
+    if args.warm_up:
+        steps = runs[0]["warm_up_ms"].keys()
+        report["warm_up_ms"] = {s: round(statistics.median(r["warm_up_ms"].get(s, 0) for r in runs), 1) for s in steps}
+    packages = {p for r in runs for p in r["imports"]}
+    heaviest = sorted(((round(statistics.median(r["imports"].get(p, 0.0) for r in runs), 1), p) for p in packages),
+                      reverse=True)[:args.top]
+    report["heaviest_imports_ms"] = {p: ms for ms, p in heaviest}
+
+    print(f"\nmedian: import {report['import_ms']} ms, first request {report['first_request_ms']} ms, "
+          f"process {report['process_ms']} ms")
+    if args.warm_up:
+        print("warm-up: " + ", ".join(f"{k} {v} ms" for k, v in report["warm_up_ms"].items()))
+    print("heaviest imports over the run (self time, ms): "
+          + ", ".join(f"{p} {ms}" for p, ms in report["heaviest_imports_ms"].items()))
+    print("loaded by `import app`: " + (", ".join(report["loaded_at_import"]) or "no OpenCV/numpy"))
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote {args.json_out}")
+    if args.max_import_ms is not None and report["import_ms"] > args.max_import_ms:
+        print(f"FAIL: median import {report['import_ms']} ms > {args.max_import_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
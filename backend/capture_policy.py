@@ -0,0 +1,135 @@
+# capture_policy.py
+# Server-side frame budget: every /proctor response carries a `capture` policy (interval, max width,
+# JPEG quality) that the interview page applies to its next snapshots. It is derived from
+#  - load: how full the detection / ingest queue is (fuller -> slower and smaller frames)
+#  - the aggregate budget: active sessions x frames/s and x bytes/frame must stay within
+#    CAPTURE_BUDGET_FPS and CAPTURE_BUDGET_KBPS for the whole process
+#  - the session's own stability (ProctorMonitor): a candidate who has sat still with one face for
+#    a while is sampled less often, one with a current alert streak more often and at full size
+#
+# Like the monitor this is per process; with several server processes give each its share of the budget.
+import os
+import time
+import threading
+
+import metrics
+
+CAPTURE_INTERVAL_MS = int(os.environ.get("CAPTURE_INTERVAL_MS", 5000))        # normal rate of a session
+CAPTURE_MIN_INTERVAL_MS = int(os.environ.get("CAPTURE_MIN_INTERVAL_MS", 2000))
+CAPTURE_MAX_INTERVAL_MS = int(os.environ.get("CAPTURE_MAX_INTERVAL_MS", 30000))
+CAPTURE_BUDGET_FPS = float(os.environ.get("CAPTURE_BUDGET_FPS", 10 * (os.cpu_count() or 1)))   # all sessions
+CAPTURE_BUDGET_KBPS = float(os.environ.get("CAPTURE_BUDGET_KBPS", 20000))     # inbound kilobits/s, all sessions
+CAPTURE_STABLE_FRAMES = int(os.environ.get("CAPTURE_STABLE_FRAMES", 10))      # one-face frames in a row = stable
+CAPTURE_ACTIVE_WINDOW = float(os.environ.get("CAPTURE_ACTIVE_WINDOW", 60))    # seconds a session counts as active
+# (max width px, JPEG quality) from the best down; load and bandwidth pressure step down this ladder
+CAPTURE_LEVELS = tuple(
+    (int(w), float(q)) for w, q in (lvl.split(":") for lvl in os.environ.get(
+        "CAPTURE_LEVELS", "640:0.8,480:0.7,320:0.6").split(",")))
+
+
+class CapturePolicy:
+    """
+    load_fn() -> 0..1 fill of the queue frames wait in; active_fn(window) -> number of active sessions;
+    session_fn(session_id) -> ProctorMonitor stats dict or None.
+    """
+    def __init__(self, load_fn, active_fn, session_fn, interval_ms=CAPTURE_INTERVAL_MS,
+                 min_interval_ms=CAPTURE_MIN_INTERVAL_MS, max_interval_ms=CAPTURE_MAX_INTERVAL_MS,
+                 budget_fps=CAPTURE_BUDGET_FPS, budget_kbps=CAPTURE_BUDGET_KBPS,
+                 stable_frames=CAPTURE_STABLE_FRAMES, levels=CAPTURE_LEVELS, active_window=CAPTURE_ACTIVE_WINDOW):
+        self.load_fn = load_fn
+        self.active_fn = active_fn
+        self.session_fn = session_fn
+        self.interval_ms = interval_ms
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.budget_fps = budget_fps
+        self.budget_kbps = budget_kbps
+        self.stable_frames = max(1, stable_frames)
+        self.levels = levels or ((640, 0.8),)
+        self.active_window = active_window
+        self._frame_bytes = {}           # level index -> EWMA of received frame size
+        self._active = (0.0, 1)          # (computed at, value): counting sessions is O(n), refresh once a second
+        self._lock = threading.Lock()
+        self.issued = metrics.counter("capture_policies_total", "Capture policies sent to clients, by reason",
+                                      ("reason",))
+        self.interval_hist = metrics.histogram("capture_interval_seconds", "Snapshot interval asked of clients",
+                                               buckets=(1, 2, 3, 5, 8, 10, 15, 20, 30, 60))
+
+    def observe_frame(self, nbytes, width=None):
+        """Record the size of a received frame (width: the max_width it was captured under, if known)."""
+        level = self._level_of(width)
+        with self._lock:
+            prev = self._frame_bytes.get(level)
+            self._frame_bytes[level] = nbytes if prev is None else prev * 0.9 + nbytes * 0.1
+
+    def _level_of(self, width):
+        for i, (w, _) in enumerate(self.levels):
+            if width is not None and width >= w:
+                return i
+        return len(self.levels) - 1 if width is not None else 0
+
+    def _bytes_at(self, level):
+        """Expected frame size at a level: measured, else scaled from a measured level by pixel count."""
+        known = self._frame_bytes
+        if level in known:
+            return known[level]
+        if not known:
+            return 40000.0 * (self.levels[level][0] / 640.0) ** 2
+        ref, size = next(iter(known.items()))
+        return size * (self.levels[level][0] / float(self.levels[ref][0])) ** 2
+
+    def active_sessions(self):
+        now = time.monotonic()
+        at, value = self._active
+        if now - at > 1.0:
+            value = max(1, int(self.active_fn(self.active_window) or 0))
+            self._active = (now, value)
+        return value
+
+    def for_session(self, session_id, busy=False):
+        """The policy dict for a session's next snapshots."""
+        load = 1.0 if busy else min(1.0, max(0.0, float(self.load_fn() or 0.0)))
+        active = self.active_sessions()
+        stats = self.session_fn(session_id) if session_id else None
+
+        reason = "normal"
+        interval = float(self.interval_ms)
+        alerting = bool(stats and (stats["no_face"]["current_streak"] or stats["multi_face"]["current_streak"]))
+        if alerting:
+            reason = "alert"
+            interval = self.min_interval_ms
+        elif stats and stats.get("ok_streak", 0) >= self.stable_frames:
+            reason = "stable"
+            # the longer nothing changes, the sparser the samples (up to 3x the normal interval)
+            interval *= min(3.0, 1.0 + stats["ok_streak"] / float(4 * self.stable_frames))
+
+        level = 0
+        if load > 0.5:
+            # half-full queue: frames already wait; slow down and shrink them in proportion
+            reason = "load"
+            interval *= 1.0 + 8.0 * (load - 0.5)
+            level = min(len(self.levels) - 1, int((load - 0.5) * 2 * len(self.levels)))
+
+        # aggregate budgets: with `active` sessions at this interval, frames/s and kbit/s must fit
+        min_for_fps = 1000.0 * active / self.budget_fps if self.budget_fps > 0 else 0.0
+        if self.budget_kbps > 0:
+            with self._lock:
+                while level < len(self.levels) - 1 and \
+                        1000.0 * active * self._bytes_at(level) * 8 / (self.budget_kbps * 1000) > self.max_interval_ms:
+                    level += 1
+                min_for_bw = 1000.0 * active * self._bytes_at(level) * 8 / (self.budget_kbps * 1000)
+        else:
+            min_for_bw = 0.0
+        budget_floor = max(min_for_fps, min_for_bw)
+        if budget_floor > interval and not alerting:
+            reason = "budget"
+        # alerts keep their fast rate unless the budget cannot take it at all
+        interval = max(interval, budget_floor if not alerting else min(budget_floor, self.interval_ms))
+        interval = int(min(self.max_interval_ms, max(self.min_interval_ms, interval)))
+        if alerting:
+            level = min(level, 1) if load > 0.8 else 0
+
+        width, quality = self.levels[level]
+        self.issued.inc(reason=reason)
+        self.interval_hist.observe(interval / 1000.0)
+        return {"interval_ms": interval, "max_width": width, "jpeg_quality": quality, "reason": reason}
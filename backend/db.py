@@ -0,0 +1,679 @@
+# db.py
+# SQLite data-access layer: pooled reader connections in WAL mode, a single writer thread
+# that group-commits queued writes, and a small repository API used by the routes.
+import os
+import json
+import time
+import queue
+import atexit
+import itertools
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from concurrent.futures import Future
+
+import metrics
+from cache import LRUCache
+
+log = logging.getLogger("backend.db")
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = Path(os.environ.get("DB_PATH", BASE_DIR / "data.db"))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))     # seconds to wait for a free reader
+DB_STREAM_PAGE = int(os.environ.get("DB_STREAM_PAGE", 500))        # rows per query when streaming a result
+DB_EXPORT_PAGE = int(os.environ.get("DB_EXPORT_PAGE", 50))         # sessions per query in the transcript export
+DB_WRITE_BATCH = int(os.environ.get("DB_WRITE_BATCH", 200))
+DB_WRITE_WAIT_MS = float(os.environ.get("DB_WRITE_WAIT_MS", 5))
+DB_WRITE_TIMEOUT = float(os.environ.get("DB_WRITE_TIMEOUT", 30))   # seconds a caller waits for its commit
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+QUESTION_CACHE_SIZE = int(os.environ.get("QUESTION_CACHE_SIZE", 10000))
+QUESTION_CACHE_TTL = float(os.environ.get("QUESTION_CACHE_TTL", 3600))
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",          # readers never block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",        # fsync at checkpoints only; safe with WAL
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",         # ~16 MB page cache per connection
+    "PRAGMA mmap_size=134217728",
+)
+
+
+def connect(path=None):
+    """Open a tuned connection. sqlite3 keeps up to cached_statements prepared statements per connection."""
+    conn = sqlite3.connect(str(path or DB_PATH), check_same_thread=False, isolation_level=None,
+                           cached_statements=256)
+    for p in PRAGMAS:
+        conn.execute(p)
+    return conn
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """No reader connection became free within DB_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of reader connections shared by all threads, with no thread affinity. Idle
+    connections are reused last-in first-out, so the most recently used (warm page cache) goes first.
+    Hold one only for a query: streaming readers fetch page by page (iter_keyset).
+    """
+    def __init__(self, path=None, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._sem = threading.BoundedSemaphore(max(1, size))
+        self._all = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        t0 = time.perf_counter()
+        # bounded wait: a leaked or long-held connection must fail requests, not hang them forever
+        if not self._sem.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"no free DB connection after {self.timeout:g}s")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect(self.path)
+                with self._lock:
+                    self._all.append(conn)
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - t0)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.put(conn)
+        finally:
+            self._sem.release()
+
+    def close(self):
+        with self._lock:
+            for c in self._all:
+                try:
+                    c.close()
+                except Exception:
+                    pass
+            self._all = []
+
+
+class WriteQueue:
+    """
+    All writes go through one connection owned by a background thread. Pending units of work are
+    collected for up to DB_WRITE_WAIT_MS (or DB_WRITE_BATCH units) and committed in one transaction,
+    each unit inside its own savepoint so one bad row does not fail the others.
+    A batch that cannot be committed at all (e.g. the DB cannot be opened) fails its futures and
+    the thread carries on with the next one; submit() restarts the thread should it ever die.
+    """
+    def __init__(self, path=None, batch_size=DB_WRITE_BATCH, wait_ms=DB_WRITE_WAIT_MS):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.wait = max(0.0, wait_ms / 1000.0)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._thread is not None:
+                    log.error("DB writer thread died; restarting it")
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, statements, changes=False) -> Future:
+        """
+        statements: list of (sql, params). The future resolves to the last statement's lastrowid,
+        or with changes=True to the number of rows the unit changed (0 for an ignored INSERT OR IGNORE).
+        """
+        fut = Future()
+        fut.submitted = time.perf_counter()
+        fut.changes = changes
+        if not self._thread.is_alive():
+            self._ensure_thread()
+        self._queue.put((statements, fut))
+        return fut
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=5.0):
+        self.submit([]).result(timeout=timeout)
+
+    def _loop(self):
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if conn is None:
+                    conn = connect(self.path)
+                self._commit(conn, batch)
+            except Exception as e:
+                log.exception("DB writer failed on a batch of %d writes", len(batch))
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                # reconnect for the next batch; back off a little if the DB itself is the problem
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                time.sleep(0.1)
+
+    def _commit(self, conn, batch):
+        results = []
+        t0 = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for statements, fut in batch:
+                conn.execute("SAVEPOINT unit")
+                try:
+                    rowid, changed = None, 0
+                    for sql, params in statements:
+                        cur = conn.execute(sql, params)
+                        rowid = cur.lastrowid
+                        changed += max(0, cur.rowcount)
+                    conn.execute("RELEASE unit")
+                    results.append((fut, changed if fut.changes else rowid, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO unit")
+                    conn.execute("RELEASE unit")
+                    results.append((fut, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            log.exception("Group commit of %d writes failed", len(batch))
+            try:
+                conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            results = [(fut, None, e) for _, fut in batch]
+        now = time.perf_counter()
+        DB_COMMIT_SECONDS.observe(now - t0)
+        DB_COMMIT_UNITS.observe(len(batch))
+        for fut, rowid, err in results:
+            DB_WRITE_SECONDS.observe(now - fut.submitted, outcome="error" if err is not None else "ok")
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(rowid)
+
+
+# ---- metrics (GET /metrics) ----
+DB_QUERY_SECONDS = metrics.histogram("db_query_seconds", "Repository call latency, including waited-for writes",
+                                     ("op",))
+DB_POOL_WAIT_SECONDS = metrics.histogram("db_pool_wait_seconds", "Time to check out a pooled reader connection")
+DB_WRITE_SECONDS = metrics.histogram("db_write_seconds", "Queued write unit: submit until committed",
+                                     ("outcome",))
+DB_COMMIT_SECONDS = metrics.histogram("db_commit_seconds", "Duration of one group commit transaction")
+DB_COMMIT_UNITS = metrics.histogram("db_commit_units", "Write units per group commit", buckets=metrics.SIZE_BUCKETS)
+
+def _timed(fn):
+    return DB_QUERY_SECONDS.timed(op=fn.__name__)(fn)
+
+
+_pool = None
+_writer = None
+_init_lock = threading.Lock()
+
+def pool() -> ConnectionPool:
+    global _pool
+    with _init_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+def writer() -> WriteQueue:
+    global _writer
+    with _init_lock:
+        if _writer is None:
+            _writer = WriteQueue(DB_PATH)
+            metrics.callback("db_write_queue_depth", "Write units waiting for the DB writer thread",
+                             _writer.queue_depth)
+        return _writer
+
+@atexit.register
+def _flush_on_exit():
+    if _writer is not None:
+        try:
+            _writer.flush(timeout=2)
+        except Exception:
+            pass
+
+
+# ---- schema migrations ----
+# Each entry is (version, description, statements). The applied version is kept in
+# PRAGMA user_version; append new migrations at the end, never edit applied ones.
+MIGRATIONS = [
+    (1, "base schema", [
+        """CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            email TEXT,
+            subject TEXT,
+            started_at TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS questions (
+            session_id TEXT PRIMARY KEY,
+            questions_json TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            question TEXT,
+            answer TEXT,
+            ts TEXT
+        )""",
+    ]),
+    (2, "session-scoped indexes and proctor_events", [
+        "CREATE INDEX IF NOT EXISTS idx_answers_session_ts ON answers(session_id, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_answers_ts ON answers(ts)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_started_at ON sessions(started_at)",
+        """CREATE TABLE IF NOT EXISTS proctor_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            faces_detected INTEGER,
+            status TEXT,
+            boxes_json TEXT,
+            file_path TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_proctor_events_session_ts ON proctor_events(session_id, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_proctor_events_ts ON proctor_events(ts)",
+        # reviewers mostly look for alerts; a partial index keeps that lookup small
+        "CREATE INDEX IF NOT EXISTS idx_proctor_events_alerts ON proctor_events(session_id, ts) WHERE status != 'ok'",
+    ]),
+    (3, "subject filter index for the dashboard", [
+        "CREATE INDEX IF NOT EXISTS idx_sessions_subject_started_at ON sessions(subject, started_at)",
+    ]),
+    (4, "snapshot store index", [
+        # one row per stored file (content-addressed within a session) ...
+        """CREATE TABLE IF NOT EXISTS snapshot_blobs (
+            session_id TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER,
+            created REAL,
+            PRIMARY KEY (session_id, hash)
+        ) WITHOUT ROWID""",
+        # ... and one per received frame; near-duplicate frames point at the same blob
+        """CREATE TABLE IF NOT EXISTS snapshots (
+            name TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            ts REAL NOT NULL,
+            hash TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_session_ts ON snapshots(session_id, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_ts ON snapshots(ts)",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_blob ON snapshots(session_id, hash)",
+    ]),
+    (5, "segment location of packed snapshot blobs", [
+        "ALTER TABLE snapshot_blobs ADD COLUMN segment TEXT",
+        "ALTER TABLE snapshot_blobs ADD COLUMN seg_offset INTEGER",
+        "ALTER TABLE snapshot_blobs ADD COLUMN seg_length INTEGER",
+    ]),
+    (6, "offline re-analysis runs", [
+        # one row per `reanalyze.py run`; cursor is the checkpoint a resumed run continues after
+        """CREATE TABLE IF NOT EXISTS reanalysis_runs (
+            run_id TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            params_json TEXT NOT NULL,
+            started REAL,
+            updated REAL,
+            finished REAL,
+            cursor TEXT,
+            frames INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0
+        )""",
+        # item is the blob path relative to the snapshot root (or to --dir)
+        """CREATE TABLE IF NOT EXISTS reanalysis_results (
+            run_id TEXT NOT NULL,
+            item TEXT NOT NULL,
+            session_id TEXT,
+            hash TEXT,
+            faces_detected INTEGER,
+            status TEXT,
+            boxes_json TEXT,
+            PRIMARY KEY (run_id, item)
+        ) WITHOUT ROWID""",
+        # --apply and compare look events up by their snapshot name
+        "CREATE INDEX IF NOT EXISTS idx_proctor_events_file ON proctor_events(file_path)",
+    ]),
+    (7, "answer kinds, follow-ups, client timings and idempotent bulk submission", [
+        "ALTER TABLE answers ADD COLUMN kind TEXT NOT NULL DEFAULT 'answer'",   # 'answer' or 'followup'
+        "ALTER TABLE answers ADD COLUMN follow_up TEXT",                        # follow-up asked after this answer
+        "ALTER TABLE answers ADD COLUMN timings_json TEXT",
+        "ALTER TABLE answers ADD COLUMN client_id TEXT",
+        # a retried batch must not store its answers twice
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_answers_client ON answers(session_id, client_id) "
+        "WHERE client_id IS NOT NULL",
+    ]),
+]
+
+
+def migrate(conn):
+    """Apply pending migrations in order, each in its own transaction. Returns the resulting version."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while we waited for the lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.execute("ROLLBACK")
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version={int(version)}")
+            conn.execute("COMMIT")
+            log.info("Applied DB migration %d: %s", version, description)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        current = version
+    return current
+
+
+def init_db():
+    conn = connect()
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+# ---- repository API ----
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+# per-session question lists, filled on register and on first read; invalidated on every write
+question_cache = LRUCache(QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL, name="questions")
+metrics.callback("question_cache_requests_total", "Question cache lookups by result",
+                 lambda: [(("hit",), question_cache.hits), (("miss",), question_cache.misses)], ("result",), "counter")
+
+@_timed
+def create_session(session_id, name, email, subject, questions, started_at=None):
+    """Insert the session and its question list in one unit of work; waits for the commit."""
+    question_cache.invalidate(session_id)
+    writer().submit([
+        ("INSERT INTO sessions (id,name,email,subject,started_at) VALUES (?,?,?,?,?)",
+         (session_id, name, email, subject, started_at or _now())),
+        ("INSERT OR REPLACE INTO questions (session_id,questions_json) VALUES (?,?)",
+         (session_id, json.dumps(questions))),
+    ]).result(timeout=DB_WRITE_TIMEOUT)
+    question_cache.set(session_id, list(questions))
+
+@_timed
+def get_session(session_id):
+    """Return (name, subject) or None."""
+    with pool().connection() as conn:
+        return conn.execute("SELECT name,subject FROM sessions WHERE id=?", (session_id,)).fetchone()
+
+@_timed
+def get_questions(session_id):
+    """Return the session's question list (served from question_cache when possible), or None."""
+    qlist = question_cache.get(session_id)
+    if qlist is not None:
+        return qlist
+    with pool().connection() as conn:
+        row = conn.execute("SELECT questions_json FROM questions WHERE session_id=?", (session_id,)).fetchone()
+    if not row:
+        return None
+    try:
+        qlist = json.loads(row[0])
+    except Exception:
+        qlist = []
+    question_cache.set(session_id, qlist)
+    return qlist
+
+@_timed
+def add_answer(session_id, question, answer, ts=None, wait=True):
+    """Queue an answer for group commit. With wait=True, block until it is durable (raises on failure)."""
+    fut = writer().submit([("INSERT INTO answers (session_id,question,answer,ts) VALUES (?,?,?,?)",
+                            (session_id, question, answer, ts or _now()))])
+    return fut.result(timeout=DB_WRITE_TIMEOUT) if wait else fut
+
+ANSWER_KINDS = ("answer", "followup")
+
+@_timed
+def add_answers(session_id, items, wait=True):
+    """
+    Store several turns of one session in a single unit of work (one transaction, all or nothing).
+    items: dicts with question, answer and optionally kind, follow_up, timings (dict), client_id, ts.
+    Items whose client_id was already stored for the session are skipped, so a retried batch is harmless.
+    Returns the number of answers actually inserted (a future of it with wait=False).
+    """
+    statements = []
+    for item in items:
+        kind = item.get("kind") or "answer"
+        timings = item.get("timings")
+        statements.append((
+            "INSERT OR IGNORE INTO answers (session_id,question,answer,ts,kind,follow_up,timings_json,client_id) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            (session_id, item.get("question") or "", item.get("answer") or "", item.get("ts") or _now(),
+             kind if kind in ANSWER_KINDS else "answer", item.get("follow_up"),
+             json.dumps(timings) if timings else None, item.get("client_id"))))
+    if not statements:
+        return 0
+    fut = writer().submit(statements, changes=True)
+    return fut.result(timeout=DB_WRITE_TIMEOUT) if wait else fut
+
+def iter_keyset(sql, params, order, key, page=None):
+    """
+    Stream a query in keyset pages without materialising the result set. A pooled connection is
+    held only while one page is fetched, never while the consumer (e.g. a streamed response to a
+    slow client) works through it. sql is a SELECT ending in a WHERE clause ("WHERE 1" if there is
+    no condition); order lists the columns it is sorted by, unique together, and key(row) returns
+    their values for a row. Rows written meanwhile show up if they sort after the current page.
+    """
+    page = max(1, page or DB_STREAM_PAGE)
+    columns = ", ".join(order)
+    after = None
+    while True:
+        q, p = sql, list(params)
+        if after is not None:
+            q += f" AND ({columns}) > ({', '.join('?' * len(order))})"
+            p.extend(after)
+        q += f" ORDER BY {columns} LIMIT {page}"
+        t = time.perf_counter()
+        with pool().connection() as conn:
+            rows = conn.execute(q, p).fetchall()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - t, op="iter_keyset")
+        yield from rows
+        if len(rows) < page:
+            return
+        after = list(key(rows[-1]))
+
+@_timed
+def recent_answers(limit=200):
+    with pool().connection() as conn:
+        return conn.execute("SELECT session_id, question, answer, ts FROM answers ORDER BY ts DESC LIMIT ?",
+                            (limit,)).fetchall()
+
+
+def _session_filter(session_ids=None, subject=None, date_from=None, date_to=None, after=None):
+    """Conditions (and params) over the sessions table, shared by the dashboard pages and the export."""
+    where, params = [], []
+    if session_ids:
+        where.append("id IN (%s)" % ",".join("?" * len(session_ids)))
+        params.extend(session_ids)
+    if subject:
+        where.append("subject = ?")
+        params.append(subject)
+    if date_from:
+        where.append("started_at >= ?")
+        params.append(date_from)
+    if date_to:
+        # inclusive end date: everything before the start of the next day
+        where.append("started_at < ?")
+        params.append(date_to + "\uffff")
+    if after:
+        where.append("id > ?")
+        params.append(after)
+    return where, params
+
+def _where(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+def iter_transcripts(session_ids=None, subject=None, date_from=None, date_to=None, after=None, limit=None,
+                     page=None):
+    """
+    Stream whole sessions (session row, question list, answers in order) ordered by session id,
+    without materialising the export: each query covers the next `page` sessions (DB_EXPORT_PAGE),
+    joined with their answers and grouped here, and the pooled connection is returned before any of
+    them is yielded, so a slow client never holds a reader.
+    `after` resumes an export after the last session id it delivered.
+    """
+    page = max(1, page or DB_EXPORT_PAGE)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        n = page if remaining is None else min(page, remaining)
+        where, params = _session_filter(session_ids, subject, date_from, date_to, after)
+        # the filter goes in an IN (...) list so SQLite walks sessions by primary key and each
+        # session's answers by idx_answers_session_ts: rows come out ordered, with no sort
+        sql = ("SELECT s.id, s.name, s.email, s.subject, s.started_at, q.questions_json, "
+               "a.id, a.question, a.answer, a.kind, a.follow_up, a.timings_json, a.ts "
+               "FROM sessions s LEFT JOIN questions q ON q.session_id = s.id "
+               "LEFT JOIN answers a ON a.session_id = s.id "
+               "WHERE s.id IN (SELECT id FROM sessions" + _where(where) + " ORDER BY id LIMIT %d) "
+               "ORDER BY s.id, a.ts, a.id" % n)
+        t = time.perf_counter()
+        with pool().connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - t, op="iter_transcripts")
+        count = 0
+        for _, group in itertools.groupby(rows, key=lambda r: r[0]):
+            group = list(group)
+            count += 1
+            after = group[0][0]
+            yield group[0][:6], [r[6:] for r in group if r[6] is not None]
+        if count < n:
+            return
+        if remaining is not None:
+            remaining -= count
+
+
+class SessionPage:
+    """
+    One keyset page of sessions, newest first, ordered by (started_at, rowid).
+    Iterating streams the rows; next_cursor is known once iteration has finished,
+    so templates can render the "next" link after the table.
+    """
+    def __init__(self, subject=None, date_from=None, date_to=None, cursor=None, limit=50):
+        self.subject = subject
+        self.date_from = date_from
+        self.date_to = date_to
+        self.cursor = cursor
+        self.limit = max(1, min(int(limit), 500))
+        self.next_cursor = None
+        self._consumed = False
+
+    def _query(self):
+        where, params = _session_filter(subject=self.subject, date_from=self.date_from, date_to=self.date_to)
+        after = decode_cursor(self.cursor)
+        if after:
+            where.append("(started_at < ? OR (started_at = ? AND rowid < ?))")
+            params.extend([after[0], after[0], after[1]])
+        sql = "SELECT rowid,id,name,email,subject,started_at FROM sessions" + _where(where)
+        sql += " ORDER BY started_at DESC, rowid DESC LIMIT ?"
+        params.append(self.limit + 1)
+        return sql, params
+
+    def __iter__(self):
+        if self._consumed:
+            raise RuntimeError("SessionPage can only be iterated once")
+        self._consumed = True
+        sql, params = self._query()
+        # at most limit + 1 rows: fetched at once, so the connection is back before rendering starts
+        with pool().connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        last = None
+        for n, row in enumerate(rows):
+            if n == self.limit:
+                self.next_cursor = encode_cursor(last[5], last[0])
+                break
+            last = row
+            yield row[1:]
+
+
+def encode_cursor(started_at, rowid):
+    return f"{started_at or ''}~{rowid}"
+
+def decode_cursor(cursor):
+    if not cursor or "~" not in cursor:
+        return None
+    started_at, _, rowid = cursor.rpartition("~")
+    try:
+        return started_at, int(rowid)
+    except ValueError:
+        return None
+
+@_timed
+def get_session_row(session_id):
+    """Return (id, name, email, subject, started_at) or None."""
+    with pool().connection() as conn:
+        return conn.execute("SELECT id,name,email,subject,started_at FROM sessions WHERE id=?",
+                            (session_id,)).fetchone()
+
+@_timed
+def proctor_summary(session_id):
+    """
+    Return (total_events, alert_events, error_events) for a session. Like proctor_monitor, only
+    status 'alert' is an alert; a frame that could not be analysed (decode_failed, timeout,
+    error: ..., no status) is an error, not an alert.
+    """
+    with pool().connection() as conn:
+        total, alerts, ok = conn.execute(
+            "SELECT COUNT(*), COUNT(CASE WHEN status='alert' THEN 1 END), COUNT(CASE WHEN status='ok' THEN 1 END) "
+            "FROM proctor_events WHERE session_id=?", (session_id,)).fetchone()
+    return total, alerts, total - alerts - ok
+
+@_timed
+def add_proctor_event(session_id, analysis, file_path=None, ts=None, wait=False):
+    """Queue one analysed snapshot for group commit (fire-and-forget by default)."""
+    analysis = analysis or {}
+    fut = writer().submit([(
+        "INSERT INTO proctor_events (session_id,ts,faces_detected,status,boxes_json,file_path) VALUES (?,?,?,?,?,?)",
+        (session_id, ts or _now(), analysis.get("faces_detected"), analysis.get("status"),
+         json.dumps(analysis.get("boxes") or []), file_path))])
+    return fut.result(timeout=DB_WRITE_TIMEOUT) if wait else fut
+
+@_timed
+def session_answers(session_id):
+    """(question, answer, ts, kind, follow_up) rows of one session, oldest first."""
+    with pool().connection() as conn:
+        return conn.execute("SELECT question, answer, ts, kind, follow_up FROM answers WHERE session_id=? "
+                            "ORDER BY ts, id", (session_id,)).fetchall()
+
+def iter_session_answers(session_id):
+    """session_answers() streamed page by page (the dashboard renders them as they arrive)."""
+    rows = iter_keyset("SELECT question, answer, ts, kind, follow_up, id FROM answers WHERE session_id=?",
+                       (session_id,), ("ts", "id"), key=lambda r: (r[2], r[5]))
+    return (r[:5] for r in rows)
+
+@_timed
+def session_proctor_events(session_id, alerts_only=False, limit=500):
+    """Proctoring events of one session, newest first."""
+    sql = "SELECT ts, faces_detected, status, boxes_json, file_path FROM proctor_events WHERE session_id=?"
+    if alerts_only:
+        sql += " AND status != 'ok'"
+    sql += " ORDER BY ts DESC LIMIT ?"
+    with pool().connection() as conn:
+        return conn.execute(sql, (session_id, limit)).fetchall()
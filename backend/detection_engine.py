@@ -0,0 +1,262 @@
+# detection_engine.py
+# Multi-core face detection: a bounded submission queue feeding a process pool.
+# Each worker process owns its own CascadeClassifier; frames from different
+# sessions are grouped into small batches so one IPC round trip covers several frames.
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from metrics import PROCTOR_STAGE_SECONDS, callback
+
+log = logging.getLogger("backend.detection")
+
+DETECT_WORKERS = int(os.environ.get("DETECT_WORKERS", os.cpu_count() or 1))
+DETECT_QUEUE_SIZE = int(os.environ.get("DETECT_QUEUE_SIZE", 256))
+DETECT_BATCH_SIZE = int(os.environ.get("DETECT_BATCH_SIZE", 8))
+DETECT_BATCH_WAIT_MS = float(os.environ.get("DETECT_BATCH_WAIT_MS", 5))
+DETECT_TIMEOUT = float(os.environ.get("DETECT_TIMEOUT", 10))
+# workers must not be forked from the server: it already runs the DB writer, ingest and HTTP threads,
+# and a child forked while one of them holds a lock can deadlock on it
+DETECT_START_METHOD = os.environ.get("DETECT_START_METHOD", "spawn")
+# per-session tracking (downscale + ROI + frame skip), see face_detection.detect_faces_tracked
+DETECT_TRACKING = os.environ.get("DETECT_TRACKING", "0").lower() in ("1", "true", "yes")
+
+
+class EngineBusy(Exception):
+    """Raised when the submission queue is full; callers should ask the client to retry later."""
+
+
+def _init_worker():
+    # one OpenCV thread per process: parallelism comes from the pool, not from cv2
+    import cv2
+    cv2.setNumThreads(1)
+    import face_detection
+    try:
+        face_detection.get_detector()   # load this worker's detector backend before the first batch
+    except Exception as e:
+        # raising here would break the pool; every frame reports the error in its status instead
+        log.error("Face detector unavailable: %s", e)
+
+
+def _run_batch(items):
+    """
+    Worker side of one micro-batch. items: list of (frame, session_id, state); session_id is None
+    for untracked frames. Returns (analysis, new_state) pairs in the same order.
+    """
+    from face_detection import detect_faces, detect_faces_tracked
+    results = []
+    latest = {}
+    for frame, session_id, state in items:
+        if session_id is None:
+            results.append((detect_faces(frame), None))
+            continue
+        # two frames of one session in the same batch: chain the state instead of reusing the old one
+        analysis, new_state = detect_faces_tracked(frame, latest.get(session_id, state))
+        latest[session_id] = new_state
+        results.append((analysis, new_state))
+    return results
+
+
+class DetectionEngine:
+    def __init__(self, workers=DETECT_WORKERS, queue_size=DETECT_QUEUE_SIZE,
+                 batch_size=DETECT_BATCH_SIZE, batch_wait_ms=DETECT_BATCH_WAIT_MS, tracking=DETECT_TRACKING):
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = max(0.0, batch_wait_ms / 1000.0)
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        # cap batches handed to the pool so the bounded queue is the only backlog
+        self._inflight = threading.BoundedSemaphore(self.workers * 2)
+        self._pool = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self.tracking = tracking
+        # face_detection (OpenCV) is only imported once an engine is built, not when this module is
+        from face_detection import TrackStore
+        self._tracks = TrackStore() if tracking else None
+        # tracking reads a session's state at dispatch and stores the new one on completion, so a
+        # session has at most one batch in the pool; its later frames are held until that batch is done
+        self._busy_sessions = set()
+        self._held = deque()
+        self._track_lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._pool = self._new_pool()
+            self._thread = threading.Thread(target=self._dispatch_loop, name="detect-dispatch", daemon=True)
+            self._thread.start()
+            log.info("Detection engine started: %d workers, queue=%d, batch=%d, tracking=%s",
+                     self.workers, self._queue.maxsize, self.batch_size, self.tracking)
+        return self
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   mp_context=multiprocessing.get_context(DETECT_START_METHOD))
+
+    def _replace_pool(self, broken):
+        """Swap in a fresh pool after a worker died (e.g. OOM-killed); no-op if already replaced."""
+        with self._lock:
+            if self._pool is not broken or self._stopped.is_set():
+                return self._pool
+            log.error("Detection worker pool is broken; starting a new one")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            return self._pool
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def queue_fill(self):
+        """Queue depth as a fraction of its capacity (0..1)."""
+        return self._queue.qsize() / float(self._queue.maxsize)
+
+    def submit(self, frame: bytes, session_id=None) -> Future:
+        """
+        Queue one encoded frame for detection. Raises EngineBusy when the queue is full.
+        With tracking enabled, frames carrying a session_id use that session's tracking state.
+        """
+        fut = Future()
+        fut.submitted = time.perf_counter()
+        if not self.tracking:
+            session_id = None
+        try:
+            self._queue.put_nowait((frame, session_id, fut))
+        except queue.Full:
+            raise EngineBusy("detection queue full")
+        return fut
+
+    def detect(self, frame: bytes, session_id=None, timeout: float = DETECT_TIMEOUT):
+        """Blocking convenience wrapper: submit and wait for the analysis dict."""
+        fut = self.submit(frame, session_id)
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            fut.cancel()
+            return {"faces_detected": 0, "status": "timeout"}
+
+    def _next_batch(self):
+        batch, sessions = self._release_held()
+        new = []
+        try:
+            new.append(self._queue.get_nowait() if batch else self._queue.get(timeout=0.5))
+        except queue.Empty:
+            pass
+        if batch or new:
+            # give other sessions a few ms to join this batch
+            while len(batch) + len(new) < self.batch_size:
+                try:
+                    new.append(self._queue.get(timeout=self.batch_wait))
+                except queue.Empty:
+                    break
+        # None is the wake-up a completed batch sends while frames are held
+        new = [item for item in new if item is not None and item[2].set_running_or_notify_cancel()]
+        if self._tracks is None:
+            return new
+        with self._track_lock:
+            for item in new:
+                sid = item[1]
+                if sid is not None and sid in self._busy_sessions and sid not in sessions:
+                    self._held.append(item)
+                    continue
+                batch.append(item)
+                if sid is not None:
+                    sessions.add(sid)
+            self._busy_sessions |= sessions
+        return batch
+
+    def _release_held(self):
+        """Held frames of sessions whose batch has completed (in arrival order), and those sessions."""
+        if not self._held:
+            return [], set()
+        with self._track_lock:
+            ready = [item for item in self._held if item[1] not in self._busy_sessions]
+            self._held = deque(item for item in self._held if item[1] in self._busy_sessions)
+        return ready, {item[1] for item in ready}
+
+    def _finish_sessions(self, batch):
+        if self._tracks is None:
+            return
+        with self._track_lock:
+            self._busy_sessions.difference_update(sid for _, sid, _ in batch)
+            wake = bool(self._held)
+        if wake:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass    # the dispatcher has frames to read anyway
+
+    def _dispatch_loop(self):
+        while not self._stopped.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self._inflight.acquire()
+            items = [(frame, sid, self._tracks.get(sid) if sid is not None else None)
+                     for frame, sid, _ in batch]
+            pool = self._pool
+            try:
+                try:
+                    pool_fut = pool.submit(_run_batch, items)
+                except BrokenProcessPool:
+                    pool = self._replace_pool(pool)
+                    pool_fut = pool.submit(_run_batch, items)
+            except Exception as e:
+                self._inflight.release()
+                self._finish_sessions(batch)
+                log.exception("Failed to dispatch detection batch")
+                for _, _, f in batch:
+                    f.set_exception(e)
+                continue
+            pool_fut.add_done_callback(lambda pf, b=batch, p=pool: self._complete(pf, b, p))
+
+    def _complete(self, pool_fut, batch, pool=None):
+        from face_detection import pop_timings
+        self._inflight.release()
+        try:
+            results = pool_fut.result()
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool) and pool is not None:
+                # this batch is lost, but later frames go to a working pool
+                self._replace_pool(pool)
+            log.exception("Detection batch failed")
+            self._finish_sessions(batch)
+            for _, _, f in batch:
+                f.set_exception(e)
+            return
+        for (_, sid, _), (_, state) in zip(batch, results):
+            if sid is not None:
+                self._tracks.put(sid, state)
+        # only now may the sessions' held frames go out: they start from these states
+        self._finish_sessions(batch)
+        now = time.perf_counter()
+        for (_, sid, f), (analysis, state) in zip(batch, results):
+            # queue wait + IPC + detection, as seen by the request
+            PROCTOR_STAGE_SECONDS.observe(now - f.submitted, stage="detect_roundtrip")
+            f.set_result(pop_timings(analysis))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> DetectionEngine:
+    """Return the process-wide engine, starting it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DetectionEngine().start()
+            callback("detection_queue_depth", "Frames waiting for a detection worker", _engine.queue_depth)
+        return _engine
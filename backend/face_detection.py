@@ -1,27 +1,355 @@
 # face_detection.py
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
 import cv2
 import base64
 import numpy as np
 
+from metrics import PROCTOR_STAGE_SECONDS
+
+log = logging.getLogger("backend.face_detection")
+
+MODELS_DIR = Path(__file__).resolve().parent / "models"
 cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-face_cascade = cv2.CascadeClassifier(cascade_path)
 
-def detect_face_from_base64(b64str: str):
+# cascade tuning; unset FACE_MIN_NEIGHBORS keeps each backend's own default
+FACE_SCALE_FACTOR = float(os.environ.get("FACE_SCALE_FACTOR", 1.1))
+FACE_MIN_NEIGHBORS = int(os.environ["FACE_MIN_NEIGHBORS"]) if os.environ.get("FACE_MIN_NEIGHBORS") else None
+FACE_MIN_SIZE = int(os.environ.get("FACE_MIN_SIZE", 60))   # smallest face side in pixels of the full frame
+
+# ---- detector backends ----
+# All backends run on CPU and share one method: detect(img, min_size) -> list of (x, y, w, h).
+# Cascades work on grayscale; backends with needs_color=True want a BGR image.
+
+class HaarDetector:
+    name = "haar"
+    needs_color = False
+    default_min_neighbors = 5
+
+    def __init__(self, path=cascade_path, scale_factor=None, min_neighbors=None):
+        self.cascade = cv2.CascadeClassifier(str(path))
+        if self.cascade.empty():
+            raise RuntimeError(f"could not load cascade {path}")
+        self.scale_factor = scale_factor or FACE_SCALE_FACTOR
+        if min_neighbors is None:
+            min_neighbors = FACE_MIN_NEIGHBORS if FACE_MIN_NEIGHBORS is not None else self.default_min_neighbors
+        self.min_neighbors = min_neighbors
+
+    def detect(self, img, min_size=(60, 60)):
+        faces = self.cascade.detectMultiScale(img, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors, minSize=min_size)
+        return [tuple(int(v) for v in f) for f in faces]
+
+
+class HaarAlt2Detector(HaarDetector):
+    name = "haar_alt2"
+
+    def __init__(self, **params):
+        super().__init__(cv2.data.haarcascades + "haarcascade_frontalface_alt2.xml", **params)
+
+
+def _model_file(path, backend):
+    if not Path(path).is_file():
+        raise RuntimeError(f"{backend} model not found at {path} (run: python fetch_models.py {backend})")
+    return path
+
+
+class LbpDetector(HaarDetector):
+    """LBP cascade: integer features, usually 2-3x faster than Haar at some cost in recall."""
+    name = "lbp"
+    default_min_neighbors = 4
+
+    def __init__(self, model_path=None, **params):
+        path = model_path or os.environ.get("FACE_LBP_CASCADE") or MODELS_DIR / "lbpcascade_frontalface_improved.xml"
+        super().__init__(_model_file(path, self.name), **params)
+
+
+class YuNetDetector:
     """
-    Accepts raw base64 string (no data: prefix).
+    OpenCV's YuNet CNN face detector (cv2.FaceDetectorYN, executed by cv2.dnn on CPU).
+    Needs the ONNX model face_detection_yunet_2023mar.onnx from the OpenCV model zoo (fetch_models.py).
+    """
+    name = "yunet"
+    needs_color = True
+
+    def __init__(self, score_threshold=0.6, model_path=None, **params):
+        # cascade parameters (scale_factor, min_neighbors) do not apply to the CNN
+        path = model_path or os.environ.get("FACE_YUNET_MODEL") or MODELS_DIR / "face_detection_yunet_2023mar.onnx"
+        self.model = cv2.FaceDetectorYN.create(str(_model_file(path, self.name)), "", (320, 320), score_threshold, 0.3, 50)
+        self.model.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.model.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # setInputSize + detect must not interleave between request threads
+        self._lock = threading.Lock()
+
+    def detect(self, img, min_size=(60, 60)):
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        h, w = img.shape[:2]
+        with self._lock:
+            self.model.setInputSize((w, h))
+            _, faces = self.model.detect(img)
+        if faces is None:
+            return []
+        out = []
+        for f in faces:
+            x, y, fw, fh = (int(v) for v in f[:4])
+            if fw >= min_size[0] and fh >= min_size[1]:
+                out.append((max(0, x), max(0, y), fw, fh))
+        return out
+
+
+DETECTORS = {
+    "haar": HaarDetector,
+    "haar_alt2": HaarAlt2Detector,
+    "lbp": LbpDetector,
+    "yunet": YuNetDetector,
+}
+FACE_DETECTOR = os.environ.get("FACE_DETECTOR", "haar").lower()
+
+def load_detector(name, **params):
+    """
+    Instantiate a backend by name (params: scale_factor, min_neighbors for the cascades);
+    raises KeyError / RuntimeError if it is unknown or its model is missing.
+    """
+    return DETECTORS[name](**params)
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    """
+    The configured backend, loaded on first use (model files are only read by processes that detect).
+    Raises like load_detector: a chosen backend whose model is missing must not silently become haar.
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                try:
+                    _detector = load_detector(FACE_DETECTOR)
+                except KeyError:
+                    raise RuntimeError(f"unknown FACE_DETECTOR {FACE_DETECTOR!r} "
+                                       f"(one of {', '.join(DETECTORS)})") from None
+    return _detector
+
+def configure(name=None, min_size=None, **params):
+    """
+    Replace this process's detector with explicitly tuned parameters (offline re-analysis runs
+    this in each pool worker). Raises like load_detector instead of falling back to haar.
+    """
+    global _detector, FACE_MIN_SIZE
+    detector = load_detector(name or FACE_DETECTOR, **params)
+    with _detector_lock:
+        _detector = detector
+        if min_size:
+            FACE_MIN_SIZE = int(min_size)
+    return detector
+
+# Each analysis carries "timings" ({stage: seconds}) measured where the work ran (possibly a pool
+# worker process); pop_timings() moves them into the parent's /metrics histograms.
+def _lap(timings, stage, t0):
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + (now - t0)
+    return now
+
+def pop_timings(analysis):
+    """Record and remove the stage timings of one analysis (keeps API responses unchanged)."""
+    timings = analysis.pop("timings", None) if isinstance(analysis, dict) else None
+    for stage, seconds in (timings or {}).items():
+        PROCTOR_STAGE_SECONDS.observe(seconds, stage=stage)
+    return analysis
+
+def detect_faces(data):
+    """
+    Accepts encoded image bytes (JPEG/WebP/PNG, any buffer such as bytes or memoryview)
+    or an already decoded ndarray (BGR or grayscale).
     Returns dict: faces_detected, boxes, status (ok/alert)
     """
+    timings = {}
     try:
-        b = base64.b64decode(b64str)
-        arr = np.frombuffer(b, np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+        detector = get_detector()
+        t = time.perf_counter()
+        if isinstance(data, np.ndarray) and data.ndim >= 2:
+            img = data
+        else:
+            # np.frombuffer wraps the caller's buffer without copying it
+            arr = np.frombuffer(data, np.uint8)
+            img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+            t = _lap(timings, "imdecode", t)
         if img is None:
-            return {"faces_detected": 0, "status": "decode_failed"}
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(60,60))
+            return {"faces_detected": 0, "status": "decode_failed", "timings": timings}
+        if not detector.needs_color and img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            t = _lap(timings, "cvtcolor", t)
+        faces = detector.detect(img, min_size=(FACE_MIN_SIZE, FACE_MIN_SIZE))
+        _lap(timings, "detect", t)
         boxes = [{"x": int(x), "y": int(y), "w": int(w), "h": int(h)} for (x,y,w,h) in faces]
         status = "ok" if len(faces) == 1 else "alert"
         h, w = img.shape[:2]
-        return {"faces_detected": len(faces), "boxes": boxes, "status": status, "image_w": w, "image_h": h}
+        return {"faces_detected": len(faces), "boxes": boxes, "status": status, "image_w": w, "image_h": h,
+                "timings": timings}
     except Exception as e:
         return {"faces_detected": 0, "status": f"error: {e}"}
+
+def detect_face_from_base64(b64str: str):
+    """
+    Accepts raw base64 string (no data: prefix).
+    Kept for older callers; prefer detect_faces() with already decoded bytes.
+    """
+    try:
+        b = base64.b64decode(b64str)
+    except Exception as e:
+        return {"faces_detected": 0, "status": f"error: {e}"}
+    return detect_faces(b)
+
+# ---- adaptive per-session tracking ----
+# Consecutive snapshots of a seated candidate barely change, so instead of a full-resolution
+# cascade pass on every frame we: decode at reduced size, skip detection entirely when a tiny
+# thumbnail shows (almost) no change, and otherwise search a region around the last face first.
+TRACK_WORK_WIDTH = int(os.environ.get("DETECT_WORK_WIDTH", 320))
+TRACK_DIFF_THRESHOLD = float(os.environ.get("DETECT_DIFF_THRESHOLD", 4.0))
+TRACK_ROI_MARGIN = float(os.environ.get("DETECT_ROI_MARGIN", 0.5))
+TRACK_FULL_EVERY = int(os.environ.get("DETECT_FULL_EVERY", 10))
+TRACK_MAX_SESSIONS = int(os.environ.get("DETECT_TRACK_SESSIONS", 5000))
+_THUMB_SIZE = (32, 24)
+_REDUCED_FLAGS = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                  4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+def _decode_gray(data, prev_size, work_width, timings=None):
+    """
+    Decode straight to grayscale; if the previous frame size is known, let libjpeg
+    decode at 1/2, 1/4 or 1/8 scale so the full-resolution image is never built.
+    A reduced decode whose size does not match the previous frame's means the client
+    changed resolution: the frame is decoded again at full size to learn the new one.
+    Returns (gray, full_w, full_h).
+    """
+    t = time.perf_counter()
+    timings = {} if timings is None else timings
+    if isinstance(data, np.ndarray) and data.ndim >= 2:
+        gray = data if data.ndim == 2 else cv2.cvtColor(data, cv2.COLOR_BGR2GRAY)
+        _lap(timings, "cvtcolor", t)
+        return gray, gray.shape[1], gray.shape[0]
+    arr = np.frombuffer(data, np.uint8)
+    prev_w, prev_h = prev_size or (None, None)
+    factor = 1
+    if prev_w and prev_h:
+        while factor < 8 and prev_w // (factor * 2) >= work_width:
+            factor *= 2
+    gray = cv2.imdecode(arr, _REDUCED_FLAGS[factor])
+    if gray is not None and factor > 1:
+        # libjpeg rounds reduced sizes up
+        if gray.shape[:2] == (-(-prev_h // factor), -(-prev_w // factor)):
+            _lap(timings, "imdecode", t)
+            return gray, prev_w, prev_h
+        gray = cv2.imdecode(arr, cv2.IMREAD_GRAYSCALE)
+    _lap(timings, "imdecode", t)
+    if gray is None:
+        return None, 0, 0
+    return gray, gray.shape[1], gray.shape[0]
+
+def detect_faces_tracked(data, state=None, work_width=TRACK_WORK_WIDTH, diff_threshold=TRACK_DIFF_THRESHOLD,
+                         roi_margin=TRACK_ROI_MARGIN, full_every=TRACK_FULL_EVERY):
+    """
+    Tracking variant of detect_faces for one session.
+    state is the dict returned by the previous call for the same session (or None).
+    Returns (analysis, new_state); analysis carries `path` (skip / roi / full),
+    `diff` (thumbnail mean abs difference) and `elapsed_ms` so savings can be measured.
+    """
+    t0 = time.perf_counter()
+    state = state or {}
+    timings = {}
+    try:
+        detector = get_detector()
+        gray, full_w, full_h = _decode_gray(data, (state.get("image_w"), state.get("image_h")), work_width, timings)
+        if gray is None:
+            return {"faces_detected": 0, "status": "decode_failed", "path": "full", "timings": timings}, state
+        if (full_w, full_h) != (state.get("image_w"), state.get("image_h")):
+            # new session or new resolution: the old thumbnail and boxes do not describe this frame
+            state = {}
+        t = time.perf_counter()
+        scale = min(1.0, work_width / float(gray.shape[1]))
+        small = gray if scale >= 1.0 else cv2.resize(gray, (int(gray.shape[1] * scale), int(gray.shape[0] * scale)),
+                                                     interpolation=cv2.INTER_AREA)
+        to_full = full_w / float(small.shape[1])
+        thumb = cv2.resize(small, _THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        prev_thumb = state.get("thumb")
+        since_full = state.get("since_full", full_every)
+        diff = float(cv2.absdiff(thumb, prev_thumb).mean()) if prev_thumb is not None else None
+        t = _lap(timings, "resize", t)
+
+        prev_boxes = state.get("boxes") or []
+        path = "full"
+        faces = None
+        if diff is not None and diff < diff_threshold and since_full < full_every:
+            path = "skip"
+            boxes = prev_boxes
+        else:
+            min_side = max(24, int(FACE_MIN_SIZE / to_full))
+            if len(prev_boxes) == 1 and since_full < full_every:
+                b = prev_boxes[0]
+                mx, my = b["w"] * roi_margin, b["h"] * roi_margin
+                x0 = max(0, int((b["x"] - mx) / to_full))
+                y0 = max(0, int((b["y"] - my) / to_full))
+                x1 = min(small.shape[1], int((b["x"] + b["w"] + mx) / to_full))
+                y1 = min(small.shape[0], int((b["y"] + b["h"] + my) / to_full))
+                if x1 - x0 >= min_side and y1 - y0 >= min_side:
+                    found = detector.detect(small[y0:y1, x0:x1], min_size=(min_side, min_side))
+                    # only trust the ROI when it still holds exactly one face
+                    if len(found) == 1:
+                        faces = [(x + x0, y + y0, w, h) for (x, y, w, h) in found]
+                        path = "roi"
+            if faces is None:
+                faces = detector.detect(small, min_size=(min_side, min_side))
+            _lap(timings, "detect", t)
+            boxes = [{"x": int(x * to_full), "y": int(y * to_full), "w": int(w * to_full), "h": int(h * to_full)}
+                     for (x, y, w, h) in faces]
+
+        new_state = {"thumb": thumb, "boxes": boxes, "image_w": full_w, "image_h": full_h,
+                     "since_full": 0 if path == "full" else since_full + 1}
+        if path == "skip":
+            # keep comparing against the last analysed frame so slow drift still triggers detection
+            new_state["thumb"] = prev_thumb
+        status = "ok" if len(boxes) == 1 else "alert"
+        analysis = {"faces_detected": len(boxes), "boxes": boxes, "status": status,
+                    "image_w": full_w, "image_h": full_h, "path": path,
+                    "diff": None if diff is None else round(diff, 2),
+                    "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2), "timings": timings}
+        return analysis, new_state
+    except Exception as e:
+        return {"faces_detected": 0, "status": f"error: {e}", "path": "full"}, {}
+
+
+class TrackStore:
+    """Bounded per-session store of tracking state (least recently used sessions are dropped)."""
+    def __init__(self, max_sessions=TRACK_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            return self._states.get(session_id)
+
+    def put(self, session_id, state):
+        with self._lock:
+            self._states[session_id] = state
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+
+    def drop(self, session_id):
+        with self._lock:
+            self._states.pop(session_id, None)
+
+
+_tracks = TrackStore()
+
+def detect_faces_for_session(session_id, data):
+    """In-process tracking detection: looks up and stores the session's state itself."""
+    analysis, state = detect_faces_tracked(data, _tracks.get(session_id))
+    _tracks.put(session_id, state)
+    return analysis
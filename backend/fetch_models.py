@@ -0,0 +1,63 @@
+# fetch_models.py
+# Downloads the model files of the detector backends that OpenCV does not bundle into models/.
+# cv2.data only ships the Haar cascades; `lbp` and `yunet` need this step (or FACE_LBP_CASCADE /
+# FACE_YUNET_MODEL pointing at a copy).
+#
+#   python fetch_models.py              # every missing model
+#   python fetch_models.py yunet --force
+import sys
+import argparse
+import urllib.request
+
+import face_detection
+
+MODELS = {
+    "lbp": ("lbpcascade_frontalface_improved.xml",
+            "https://raw.githubusercontent.com/opencv/opencv/4.x/data/lbpcascades/lbpcascade_frontalface_improved.xml"),
+    "yunet": ("face_detection_yunet_2023mar.onnx",
+              "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/"
+              "face_detection_yunet_2023mar.onnx"),
+}
+
+
+def fetch(name, force=False, timeout=60):
+    """Download one backend's model into MODELS_DIR and check that the backend loads it. Returns its path."""
+    filename, url = MODELS[name]
+    path = face_detection.MODELS_DIR / filename
+    if path.exists() and not force:
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    with urllib.request.urlopen(url, timeout=timeout) as resp, open(tmp, "wb") as f:
+        while True:
+            chunk = resp.read(1 << 16)
+            if not chunk:
+                break
+            f.write(chunk)
+    try:
+        face_detection.DETECTORS[name](model_path=tmp)
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"downloaded {name} model from {url} does not load: {e}") from e
+    tmp.replace(path)
+    return path
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Download face detector models into models/.")
+    ap.add_argument("backends", nargs="*", choices=sorted(MODELS), help="default: all")
+    ap.add_argument("--force", action="store_true", help="download again even if the file exists")
+    args = ap.parse_args(argv)
+
+    failed = 0
+    for name in args.backends or sorted(MODELS):
+        try:
+            print(f"{name:<6} {fetch(name, args.force)}")
+        except Exception as e:
+            failed += 1
+            print(f"{name:<6} failed: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
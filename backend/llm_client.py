@@ -0,0 +1,277 @@
+# llm_client.py
+# Shared client for OpenAI-compatible chat completions:
+#  - one pool of keep-alive HTTP connections for the whole process
+#  - per-request timeouts
+#  - persistent prompt-keyed response cache (SQLite) with an in-memory LRU in front, with eviction
+#  - coalescing of identical in-flight requests
+#  - a small thread pool for callers that want a Future instead of blocking, and a separate one for
+#    background work (question pool refills) so that it never queues ahead of request-path calls
+#
+# Point OPENAI_BASE_URL at llm_stub_server.py to run everything locally.
+import os
+import json
+import time
+import queue
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+from cache import LRUCache
+
+log = logging.getLogger("backend.llm")
+
+BASE_DIR = Path(__file__).resolve().parent
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 15))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 8))
+LLM_WORKERS = int(os.environ.get("LLM_WORKERS", 4))
+LLM_BACKGROUND_WORKERS = int(os.environ.get("LLM_BACKGROUND_WORKERS", 2))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", str(BASE_DIR / "llm_cache.db"))
+LLM_CACHE_MAX = int(os.environ.get("LLM_CACHE_MAX", 5000))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+
+
+LLM_REQUEST_SECONDS = metrics.histogram("llm_request_seconds", "HTTP round trips to the model endpoint",
+                                        ("outcome",))
+LLM_CACHE_REQUESTS = metrics.counter("llm_cache_requests_total",
+                                     "chat() calls by how they were answered: cache hit, shared in-flight call or miss",
+                                     ("result",))
+
+
+class LLMError(Exception):
+    """Raised for transport errors, timeouts and non-2xx responses."""
+
+
+class HTTPPool:
+    """Keep-alive connections to one base URL, reused across threads (LIFO so warm sockets go first)."""
+    def __init__(self, base_url, size=LLM_POOL_SIZE, timeout=LLM_TIMEOUT):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max(1, size))
+
+    def _new_conn(self, timeout):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout)
+
+    def _checkout(self, timeout):
+        try:
+            conn = self._idle.get_nowait()
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            conn.timeout = timeout
+            return conn, True
+        except queue.Empty:
+            return self._new_conn(timeout), False
+
+    def _checkin(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def post_json(self, path, payload, headers=None, timeout=None):
+        timeout = timeout or self.timeout
+        body = json.dumps(payload).encode("utf-8")
+        hdrs = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        hdrs.update(headers or {})
+        for attempt in range(2):
+            conn, reused = self._checkout(timeout)
+            try:
+                conn.request("POST", self.prefix + path, body=body, headers=hdrs)
+                resp = conn.getresponse()
+                data = resp.read()
+            except socket.timeout as e:
+                conn.close()
+                raise LLMError(f"timeout after {timeout}s") from e
+            except (http.client.HTTPException, ConnectionError, OSError) as e:
+                conn.close()
+                # a pooled socket the server already closed: retry once on a fresh connection
+                if reused and attempt == 0:
+                    continue
+                raise LLMError(f"connection error: {e}") from e
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+            if resp.status >= 400:
+                raise LLMError(f"HTTP {resp.status}: {data[:200]!r}")
+            try:
+                return json.loads(data)
+            except ValueError as e:
+                raise LLMError("invalid JSON from model endpoint") from e
+        raise LLMError("unreachable")
+
+
+class ResponseCache:
+    """
+    Prompt-keyed cache persisted in SQLite, fronted by an in-memory LRU.
+    Entries expire after ttl seconds; beyond max_entries the least recently used rows are evicted.
+    """
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX, ttl=LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = LRUCache(min(max_entries, 1024), ttl, name="llm")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT, "
+                               "created REAL, last_used REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+        except Exception:
+            log.exception("LLM response cache unavailable at %s; using memory only", path)
+            self._conn = None
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or self._conn is None:
+            return value
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if not row:
+                return None
+            if self.ttl and row[1] < now - self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key=?", (key,))
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_used=? WHERE key=?", (now, key))
+        self.memory.set(key, row[0])
+        return row[0]
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self._conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache (key,value,created,last_used) VALUES (?,?,?,?)",
+                               (key, value, now, now))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+        self._conn.execute("DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used DESC "
+                           "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+
+def prompt_key(model, messages, max_tokens, temperature):
+    raw = json.dumps([model, messages, max_tokens, temperature], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _extract_content(resp):
+    try:
+        choice = resp["choices"][0]
+    except (KeyError, IndexError, TypeError):
+        return ""
+    msg = choice.get("message")
+    if isinstance(msg, dict) and msg.get("content"):
+        return msg["content"]
+    return choice.get("text") or ""
+
+
+class LLMClient:
+    def __init__(self, api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, model=OPENAI_MODEL,
+                 timeout=LLM_TIMEOUT, cache=None):
+        self.api_key = api_key
+        self.model = model
+        self.http = HTTPPool(base_url, timeout=timeout)
+        self.cache = cache if cache is not None else ResponseCache()
+        self.executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+        self.background = ThreadPoolExecutor(max_workers=max(1, LLM_BACKGROUND_WORKERS),
+                                             thread_name_prefix="llm-bg")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.api_key)
+
+    def chat(self, messages, max_tokens=60, temperature=0.2, model=None, use_cache=True, timeout=None):
+        """
+        Return the assistant message text. Identical cached prompts are answered locally and
+        identical concurrent prompts share one HTTP call. Raises LLMError on failure.
+        """
+        if not self.enabled:
+            raise LLMError("LLM not configured (set OPENAI_API_KEY)")
+        model = model or self.model
+        if not use_cache:
+            return self._call(model, messages, max_tokens, temperature, timeout)
+        key = prompt_key(model, messages, max_tokens, temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            LLM_CACHE_REQUESTS.inc(result="hit")
+            return cached
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+        if not owner:
+            LLM_CACHE_REQUESTS.inc(result="coalesced")
+            try:
+                return fut.result(timeout=(timeout or self.http.timeout) + 1)
+            except FutureTimeout as e:
+                # callers fall back on LLMError; a waiter must not surface a different exception
+                raise LLMError("timed out waiting for an identical in-flight LLM call") from e
+        LLM_CACHE_REQUESTS.inc(result="miss")
+        try:
+            content = self._call(model, messages, max_tokens, temperature, timeout)
+            if content:
+                self.cache.set(key, content)
+            fut.set_result(content)
+            return content
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def submit_chat(self, *args, **kwargs) -> Future:
+        """Non-blocking chat(): runs on the client's worker threads."""
+        return self.executor.submit(self.chat, *args, **kwargs)
+
+    def _call(self, model, messages, max_tokens, temperature, timeout):
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens,
+                   "temperature": temperature, "n": 1}
+        t0 = time.perf_counter()
+        outcome = "error"
+        try:
+            resp = self.http.post_json("/chat/completions", payload,
+                                       headers={"Authorization": f"Bearer {self.api_key}"}, timeout=timeout)
+            outcome = "ok"
+        finally:
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - t0, outcome=outcome)
+        return _extract_content(resp).strip()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> LLMClient:
+    """Process-wide shared client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
@@ -0,0 +1,92 @@
+# llm_stub_server.py
+# Minimal OpenAI-compatible /v1/chat/completions server for local development and load tests.
+#
+#   python llm_stub_server.py --port 8089 --delay 0.5
+#   OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python app.py
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS = {"requests": 0}
+_stats_lock = threading.Lock()
+
+
+def fake_completion(messages):
+    prompt = " ".join(m.get("content", "") for m in messages if isinstance(m, dict))
+    m = re.search(r"Generate (\d+) interview questions for the subject: (.+?)\.", prompt)
+    if m:
+        n, subject = int(m.group(1)), m.group(2)
+        stamp = int(time.time() * 1000) % 100000
+        return "\n".join(f"{i}. ({subject} #{stamp}) Question {i} about {subject}?" for i in range(1, n + 1))
+    return "Can you walk me through a concrete example of that?"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so the client's connection pool is exercised
+    delay = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            payload = {}
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": "not found"}})
+        with _stats_lock:
+            STATS["requests"] += 1
+        if self.delay:
+            time.sleep(self.delay)
+        content = fake_completion(payload.get("messages") or [])
+        self._send(200, {
+            "id": "stub-1", "object": "chat.completion", "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        })
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send(200, STATS)
+        self._send(404, {"error": {"message": "not found"}})
+
+    def _send(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8089, delay=0.0):
+    """Start the stub in a background thread; returns the server (call .shutdown() to stop)."""
+    handler = type("StubHandler", (Handler,), {"delay": delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="OpenAI-compatible stub for local runs.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--delay", type=float, default=0.0, help="seconds to sleep per completion")
+    args = ap.parse_args(argv)
+    server = serve(args.host, args.port, args.delay)
+    print(f"LLM stub listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+# loadtest.py
+# Closed-loop load test: N client threads replay a realistic request mix against a running server
+# and report requests/second and latency percentiles per endpoint.
+#
+#   python loadtest.py --spawn wsgi --duration 20 --concurrency 32      # starts LLM stub + server
+#   python loadtest.py --spawn asgi --mix get_question=5,submit_answer=3,proctor=2,generate_followup=1
+#   python loadtest.py --url http://127.0.0.1:5000 --json results.json  # against a server you started
+#
+# --spawn runs everything locally against stubs: llm_stub_server.py for the model, and a throwaway
+# DB / snapshot / segment directory under a temp folder, so the real data.db and uploads/ are untouched.
+import os
+import sys
+import json
+import signal
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+import http.client
+from pathlib import Path
+from urllib.parse import urlsplit, urlencode
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_MIX = "get_question=5,submit_answer=3,proctor=2"
+SUBJECTS = ["General Aptitude", "Computer Science"]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def load_frames(limit=20):
+    frames = [p.read_bytes() for p in sorted((BASE_DIR / "uploads").rglob("*.jpg"))[:limit]]
+    if frames:
+        return frames
+    try:
+        import cv2
+        import numpy as np
+        img = np.full((480, 640, 3), 128, np.uint8)
+        cv2.circle(img, (320, 240), 90, (200, 180, 160), -1)
+        return [cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()]
+    except Exception:
+        sys.exit("no snapshots in uploads/ and OpenCV unavailable to synthesise one")
+
+
+class Client:
+    """One keep-alive connection per load thread (reconnects on failure)."""
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                resp = self.conn.getresponse()
+                data = resp.read()
+                if resp.will_close:
+                    self.conn.close()
+                    self.conn = None
+                return resp.status, resp.getheader("Location"), data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        raise RuntimeError("unreachable")
+
+
+def register_sessions(base_url, n):
+    client = Client(base_url)
+    sessions = []
+    for i in range(n):
+        form = urlencode({"name": f"load{i}", "email": f"load{i}@example.com", "subject": SUBJECTS[i % len(SUBJECTS)]})
+        status, location, _ = client.request("POST", "/", form, {"Content-Type": "application/x-www-form-urlencoded"})
+        if status in (301, 302, 303) and location:
+            sessions.append(location.rstrip("/").rsplit("/", 1)[-1])
+    return sessions
+
+
+def make_calls(sessions, frames):
+    """Request builders for each endpoint in the mix: (method, path, body, headers)."""
+    def get_question():
+        return "POST", "/get_question", json.dumps({"session_id": random.choice(sessions),
+                                                    "index": random.randint(0, 4)}), {"Content-Type": "application/json"}
+
+    def submit_answer():
+        return "POST", "/submit_answer", json.dumps({
+            "session_id": random.choice(sessions), "question": "Describe how a hash table works.",
+            "answer": "Keys are hashed into buckets; collisions are chained, so lookups stay O(1) on average."}), \
+            {"Content-Type": "application/json"}
+
+    def proctor():
+        return "POST", "/proctor/raw?session_id=" + random.choice(sessions), random.choice(frames), \
+            {"Content-Type": "image/jpeg"}
+
+    def generate_followup():
+        return "POST", "/generate_followup", json.dumps({
+            "session_id": random.choice(sessions), "question": "What is a RESTful API?",
+            "answer": "An API over HTTP that models resources, because statelessness makes it easy to scale."}), \
+            {"Content-Type": "application/json"}
+
+    return {"get_question": get_question, "submit_answer": submit_answer, "proctor": proctor,
+            "generate_followup": generate_followup}
+
+
+def run(base_url, mix, duration, concurrency, sessions, frames):
+    calls = make_calls(sessions, frames)
+    names = [n for n, w in mix for _ in range(w)]
+    results = {n: {"lat": [], "errors": 0, "busy": 0} for n, _ in mix}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker():
+        client = Client(base_url)
+        local = {n: ([], [0], [0]) for n, _ in mix}
+        while time.monotonic() < stop_at:
+            name = random.choice(names)
+            method, path, body, headers = calls[name]()
+            t0 = time.perf_counter()
+            try:
+                status, _, _ = client.request(method, path, body, headers)
+            except Exception:
+                status = None
+            ms = (time.perf_counter() - t0) * 1000
+            lat, errors, busy = local[name]
+            if status == 503:
+                busy[0] += 1
+            elif status is None or status >= 400:
+                errors[0] += 1
+            else:
+                lat.append(ms)
+        with lock:
+            for name, (lat, errors, busy) in local.items():
+                results[name]["lat"].extend(lat)
+                results[name]["errors"] += errors[0]
+                results[name]["busy"] += busy[0]
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    report = {"elapsed_s": round(elapsed, 2), "concurrency": concurrency, "endpoints": {}}
+    total_ok = 0
+    all_lat = []
+    for name, r in results.items():
+        lat = sorted(r["lat"])
+        total_ok += len(lat)
+        all_lat.extend(lat)
+        report["endpoints"][name] = {"ok": len(lat), "errors": r["errors"], "busy_503": r["busy"],
+                                     "rps": round(len(lat) / elapsed, 1),
+                                     "p50_ms": round(percentile(lat, 50), 2), "p90_ms": round(percentile(lat, 90), 2),
+                                     "p99_ms": round(percentile(lat, 99), 2)}
+    all_lat.sort()
+    report["total"] = {"ok": total_ok, "rps": round(total_ok / elapsed, 1),
+                       "p50_ms": round(percentile(all_lat, 50), 2), "p99_ms": round(percentile(all_lat, 99), 2)}
+    return report
+
+
+def print_report(report):
+    header = f"{'endpoint':<18} {'ok':>7} {'err':>5} {'503':>5} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, r in report["endpoints"].items():
+        print(f"{name:<18} {r['ok']:>7} {r['errors']:>5} {r['busy_503']:>5} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    t = report["total"]
+    print(f"{'total':<18} {t['ok']:>7} {'':>5} {'':>5} {t['rps']:>8.1f} {t['p50_ms']:>8.2f} {'':>8} {t['p99_ms']:>8.2f}")
+
+
+def wait_for(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            Client(url, timeout=2).request("GET", "/api/cache_stats")
+            return True
+        except Exception:
+            time.sleep(0.25)
+    return False
+
+
+def spawn_stack(mode, port, llm_port, llm_delay, tmp):
+    """Start the LLM stub and the server (serve.py) with throwaway storage; returns the processes."""
+    procs = [subprocess.Popen([sys.executable, str(BASE_DIR / "llm_stub_server.py"), "--port", str(llm_port),
+                               "--delay", str(llm_delay)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)]
+    env = dict(os.environ,
+               OPENAI_API_KEY="stub", OPENAI_BASE_URL=f"http://127.0.0.1:{llm_port}/v1",
+               DB_PATH=str(tmp / "load.db"), SNAPSHOT_DIR=str(tmp / "uploads"), SEGMENT_DIR=str(tmp / "segments"),
+               LLM_CACHE_PATH=str(tmp / "llm_cache.db"))
+    log_file = open(tmp / "server.log", "wb")
+    procs.append(subprocess.Popen([sys.executable, str(BASE_DIR / "serve.py"), "--mode", mode, "--host", "127.0.0.1",
+                                   "--port", str(port)], env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                                  start_new_session=True))
+    return procs
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load test /get_question, /submit_answer and /proctor.")
+    ap.add_argument("--url", default=None, help="server to test (default: spawn one)")
+    ap.add_argument("--spawn", choices=("wsgi", "asgi"), default="wsgi", help="serving mode when no --url is given")
+    ap.add_argument("--port", type=int, default=5099)
+    ap.add_argument("--llm-port", type=int, default=8099)
+    ap.add_argument("--llm-delay", type=float, default=0.2, help="stub model latency (seconds)")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight list")
+    ap.add_argument("--duration", type=float, default=15)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--json", dest="json_out", default=None)
+    args = ap.parse_args(argv)
+
+    mix = []
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), int(weight or 1)))
+    unknown = [n for n, _ in mix if n not in ("get_question", "submit_answer", "proctor", "generate_followup")]
+    if unknown:
+        ap.error(f"unknown endpoint(s) in --mix: {', '.join(unknown)}")
+
+    procs, tmp = [], None
+    base_url = args.url
+    try:
+        if base_url is None:
+            tmp = Path(tempfile.mkdtemp(prefix="loadtest-"))
+            procs = spawn_stack(args.spawn, args.port, args.llm_port, args.llm_delay, tmp)
+            base_url = f"http://127.0.0.1:{args.port}"
+            if not wait_for(base_url):
+                print(f"server did not come up; see {tmp / 'server.log'}")
+                tmp = None
+                return 1
+        sessions = register_sessions(base_url, args.sessions)
+        if not sessions:
+            print("could not register any session")
+            return 1
+        frames = load_frames()
+        print(f"{base_url}: {len(sessions)} sessions, {args.concurrency} clients, {args.duration:.0f}s, mix {args.mix}\n")
+        report = run(base_url, mix, args.duration, args.concurrency, sessions, frames)
+        report["mode"] = args.spawn if args.url is None else "external"
+        print_report(report)
+        if args.json_out:
+            Path(args.json_out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+            print(f"\nWrote {args.json_out}")
+        return 0
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+            try:
+                os.killpg(p.pid, signal.SIGKILL)   # anything the server forked (detection workers)
+            except (OSError, AttributeError):
+                pass
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
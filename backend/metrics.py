@@ -0,0 +1,291 @@
+# metrics.py
+# In-process counters and latency histograms, rendered in the Prometheus text format at GET /metrics,
+# plus an optional cProfile dump of sampled slow requests.
+#
+# Metrics are per process (like the detection pool and the DB writer, see serve.py). Detection runs in
+# pool worker processes, so the workers return their stage timings inside the analysis and the parent
+# records them (see face_detection.pop_timings).
+import os
+import time
+import random
+import bisect
+import logging
+import threading
+from pathlib import Path
+from functools import wraps
+from contextlib import contextmanager
+
+log = logging.getLogger("backend.metrics")
+
+BASE_DIR = Path(__file__).resolve().parent
+METRICS_ENABLED = os.environ.get("METRICS", "1").lower() not in ("0", "false", "no")
+# upper bounds in seconds; +Inf is implicit
+DEFAULT_BUCKETS = tuple(float(b) for b in os.environ.get(
+    "METRICS_BUCKETS", "0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# per-request profiling: PROFILE_REQUESTS=1 profiles a PROFILE_SAMPLE_RATE fraction of requests and
+# keeps the dump when the request took at least PROFILE_SLOW_MS
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.05))
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 500))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", BASE_DIR / "profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 200))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_str(self.labels, key)} {_fmt(v)}" for key, v in items]
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect plus a few additions under a lock."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(n, "") for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def timed(self, **labels):
+        """Decorator form of time()."""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - t0, **labels)
+            return wrapper
+        return decorator
+
+    def snapshot(self, **labels):
+        """(count, sum) of one series."""
+        s = self._series.get(tuple(labels.get(n, "") for n in self.labels))
+        return (s[2], s[1]) if s else (0, 0.0)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = 'le="%s"' % _fmt(float(bound))
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {n}")
+        return lines
+
+
+class Callback:
+    """
+    Value read at scrape time (queue depths, cache counters kept elsewhere).
+    fn returns a number, or a list of (label values tuple, number).
+    """
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            log.debug("metric callback %s failed", self.name, exc_info=True)
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, (list, tuple)):
+            value = [((), value)]
+        return [f"{self.name}{_label_str(self.labels, key)} {_fmt(v)}" for key, v in value]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def callback(self, name, help, fn, labels=(), kind="gauge"):
+        """Register (or replace) a scrape-time value."""
+        with self._lock:
+            metric = self._metrics[name] = Callback(name, help, fn, labels, kind)
+            return metric
+
+    def render(self):
+        """The whole registry in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        out = []
+        for m in metrics:
+            lines = m.render()
+            if not lines:
+                continue
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+callback = REGISTRY.callback
+render = REGISTRY.render
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_started = time.time()
+callback("process_start_time_seconds", "Start time of the process since the epoch", lambda: _started)
+
+HTTP_REQUEST_SECONDS = histogram("http_request_duration_seconds",
+                                 "Request latency until the response is returned (streamed bodies excluded)",
+                                 ("endpoint", "method", "status"))
+PROCTOR_STAGE_SECONDS = histogram("proctor_stage_seconds",
+                                  "Time spent in each stage of snapshot ingest and face detection", ("stage",))
+LLM_CALL_SECONDS = histogram("llm_call_seconds", "LLM calls made for a feature, cache hits included",
+                             ("caller", "outcome"))
+
+
+class RequestProfiler:
+    """
+    cProfile for a random sample of requests. The profile is written to PROFILE_DIR (a .prof file for
+    pstats/snakeviz plus a .txt with the top functions) only when the request turned out to be slow.
+    """
+    def __init__(self, enabled=PROFILE_REQUESTS, sample_rate=PROFILE_SAMPLE_RATE, slow_ms=PROFILE_SLOW_MS,
+                 directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.directory = Path(directory)
+        self.keep = keep
+        self.dumped = counter("profiles_written_total", "Slow request profiles written to PROFILE_DIR")
+
+    def start(self, force=False):
+        """A running profiler for this request, or None when it is not sampled."""
+        if not self.enabled or not (force or random.random() < self.sample_rate):
+            return None
+        import cProfile
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # another profiler is already active in this interpreter
+            return None
+        return prof
+
+    def finish(self, prof, elapsed, label):
+        if prof is None:
+            return None
+        prof.disable()
+        if elapsed * 1000 < self.slow_ms:
+            return None
+        import io
+        import pstats
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stem = f"{time.strftime('%Y%m%d-%H%M%S')}_{int(elapsed * 1000)}ms_{label}"
+            stem = "".join(c if c.isalnum() or c in "-_." else "_" for c in stem)[:120]
+            path = self.directory / (stem + ".prof")
+            prof.dump_stats(str(path))
+            text = io.StringIO()
+            pstats.Stats(prof, stream=text).sort_stats("cumulative").print_stats(40)
+            path.with_suffix(".txt").write_text(text.getvalue(), encoding="utf-8")
+            self.dumped.inc()
+            self._prune()
+            log.info("Slow request %s (%.0f ms) profiled to %s", label, elapsed * 1000, path)
+            return path
+        except Exception:
+            log.exception("Failed to write request profile")
+            return None
+
+    def _prune(self):
+        dumps = sorted(self.directory.glob("*.prof"))
+        for old in dumps[:max(0, len(dumps) - self.keep)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".txt").unlink(missing_ok=True)
+
+
+profiler = RequestProfiler()
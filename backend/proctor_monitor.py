@@ -0,0 +1,265 @@
+# proctor_monitor.py
+# Live proctoring statistics: every published analysis (sync /proctor, async ingest, ASGI) is folded
+# into a fixed-size per-session record as it arrives, so the dashboard and reviewers read running
+# totals instead of re-scanning proctor_events or stored snapshots.
+#
+# Streak transitions become alerts in one bounded feed that reviewers follow over SSE:
+#   no_face           NO_FACE_ALERT_FRAMES consecutive frames without a face
+#   multi_face        MULTI_FACE_ALERT_FRAMES consecutive frames with more than one face
+#   detection_errors  DETECTION_ERROR_ALERT_FRAMES consecutive frames that could not be analysed
+# each sent once with state "start" and once with state "end" (plus the streak length) when it clears.
+#
+# Like ResultStore this lives in the process; after a restart the totals start from zero. A session
+# with no frame for PROCTOR_SESSION_TTL seconds is over and its record is dropped.
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+import metrics
+
+log = logging.getLogger("backend.proctor")
+
+NO_FACE_ALERT_FRAMES = int(os.environ.get("NO_FACE_ALERT_FRAMES", 3))
+MULTI_FACE_ALERT_FRAMES = int(os.environ.get("MULTI_FACE_ALERT_FRAMES", 1))
+DETECTION_ERROR_ALERT_FRAMES = int(os.environ.get("DETECTION_ERROR_ALERT_FRAMES", 5))
+ALERT_BUFFER = int(os.environ.get("PROCTOR_ALERT_BUFFER", 2000))
+MAX_SESSIONS = int(os.environ.get("PROCTOR_MAX_SESSIONS", 5000))
+SESSION_TTL = float(os.environ.get("PROCTOR_SESSION_TTL", 6 * 3600))
+
+# analysis statuses that carry a face count; anything else (decode_failed, timeout, error: ...) is an error
+_ANALYSED = ("ok", "alert")
+
+
+class SessionStats:
+    """Running totals for one session; constant size however long the interview runs."""
+    __slots__ = ("session_id", "frames", "ok", "ok_run", "no_face", "multi_face", "errors", "alerts",
+                 "no_face_run", "longest_no_face", "no_face_episodes",
+                 "multi_face_run", "longest_multi_face", "multi_face_episodes", "max_faces",
+                 "error_run", "first_ts", "last_ts", "last_alert_ts", "last_status", "last_faces")
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.frames = self.ok = self.ok_run = self.no_face = self.multi_face = self.errors = self.alerts = 0
+        self.no_face_run = self.longest_no_face = self.no_face_episodes = 0
+        self.multi_face_run = self.longest_multi_face = self.multi_face_episodes = self.max_faces = 0
+        self.error_run = 0
+        self.first_ts = self.last_ts = self.last_alert_ts = None
+        self.last_status = None
+        self.last_faces = None
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id, "frames": self.frames, "ok": self.ok, "ok_streak": self.ok_run,
+            "alerts": self.alerts,
+            "no_face": {"frames": self.no_face, "episodes": self.no_face_episodes,
+                        "current_streak": self.no_face_run, "longest_streak": self.longest_no_face},
+            "multi_face": {"frames": self.multi_face, "episodes": self.multi_face_episodes,
+                           "current_streak": self.multi_face_run, "longest_streak": self.longest_multi_face,
+                           "max_faces": self.max_faces},
+            "errors": {"frames": self.errors, "current_streak": self.error_run},
+            "first_ts": self.first_ts, "last_ts": self.last_ts, "last_alert_ts": self.last_alert_ts,
+            "last_status": self.last_status, "last_faces": self.last_faces,
+        }
+
+
+class AlertFeed:
+    """
+    Bounded, seq-numbered alert log shared by all sessions. Readers poll with since(seq) or block in
+    wait_since(); same contract as ResultStore, so proctor_pipeline.sse_events can stream it.
+    """
+    def __init__(self, size=ALERT_BUFFER):
+        self._alerts = deque(maxlen=max(1, size))
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def push(self, alert):
+        with self._cond:
+            self._seq += 1
+            alert["seq"] = self._seq
+            self._alerts.append(alert)
+            self._cond.notify_all()
+            return alert
+
+    def _newer(self, session_id, seq):
+        # the deque is in seq order: walk back from the newest until seq is reached
+        out = []
+        for a in reversed(self._alerts):
+            if a["seq"] <= seq:
+                break
+            if session_id is None or a["session_id"] == session_id:
+                out.append(a)
+        out.reverse()
+        return out
+
+    def since(self, session_id=None, seq=0):
+        with self._cond:
+            return self._newer(session_id, seq)
+
+    def wait_since(self, session_id=None, seq=0, timeout=15.0):
+        """Block until there are alerts newer than seq (for one session, or all when None)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                alerts = self._newer(session_id, seq)
+                remaining = deadline - time.monotonic()
+                if alerts or remaining <= 0:
+                    return alerts
+                self._cond.wait(remaining)
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+
+class ProctorMonitor:
+    """
+    Folds analysis events into SessionStats and raises alerts on streak transitions.
+    observe() is O(1) and is called for every published result (ResultStore listener).
+    """
+    def __init__(self, feed=None, max_sessions=MAX_SESSIONS, no_face_frames=NO_FACE_ALERT_FRAMES,
+                 multi_face_frames=MULTI_FACE_ALERT_FRAMES, error_frames=DETECTION_ERROR_ALERT_FRAMES,
+                 session_ttl=SESSION_TTL):
+        self.feed = feed or AlertFeed()
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.no_face_frames = max(1, no_face_frames)
+        self.multi_face_frames = max(1, multi_face_frames)
+        self.error_frames = max(1, error_frames)
+        self._sessions = OrderedDict()   # session_id -> SessionStats, least recently seen first
+        self._lock = threading.Lock()
+        self.alert_count = metrics.counter("proctor_alerts_total", "Proctoring alerts raised, by kind",
+                                           ("kind",))
+        metrics.callback("proctor_monitor_sessions", "Sessions with live proctoring statistics",
+                         lambda: len(self._sessions))
+
+    def observe(self, event):
+        """Fold one ResultStore event ({session_id, analysis, saved, ts, ...}) into its session."""
+        session_id = event.get("session_id")
+        analysis = event.get("analysis") or {}
+        ts = event.get("ts") or time.time()
+        if not session_id:
+            return []
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None:
+                s = self._sessions[session_id] = SessionStats(session_id)
+                s.first_ts = ts
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            raised = self._fold(s, analysis, ts, event.get("saved"))
+            self._evict_idle(ts)
+            s.alerts += sum(1 for a in raised if a["state"] == "start")
+            if raised:
+                s.last_alert_ts = ts
+        for a in raised:
+            self.feed.push(a)
+            if a["state"] == "start":
+                self.alert_count.inc(kind=a["kind"])
+        return raised
+
+    def _fold(self, s, analysis, ts, saved):
+        status = str(analysis.get("status") or ("error" if "error" in analysis else "unknown"))
+        faces = analysis.get("faces_detected") or 0
+        s.frames += 1
+        s.last_ts = ts
+        s.last_status = status
+        raised = []
+
+        def alert(kind, state, streak):
+            raised.append({"session_id": s.session_id, "kind": kind, "state": state, "streak": streak,
+                           "ts": ts, "faces_detected": faces, "status": status, "saved": saved})
+
+        if status not in _ANALYSED:
+            # no face count to go on: streaks of the other kinds are left as they are
+            s.errors += 1
+            s.error_run += 1
+            if s.error_run == self.error_frames:
+                alert("detection_errors", "start", s.error_run)
+            return raised
+        if s.error_run >= self.error_frames:
+            alert("detection_errors", "end", s.error_run)
+        s.error_run = 0
+        s.last_faces = faces
+        s.max_faces = max(s.max_faces, faces)
+
+        if faces == 0:
+            s.no_face += 1
+            s.no_face_run += 1
+            s.longest_no_face = max(s.longest_no_face, s.no_face_run)
+            if s.no_face_run == self.no_face_frames:
+                s.no_face_episodes += 1
+                alert("no_face", "start", s.no_face_run)
+        else:
+            if s.no_face_run >= self.no_face_frames:
+                alert("no_face", "end", s.no_face_run)
+            s.no_face_run = 0
+
+        if faces > 1:
+            s.multi_face += 1
+            s.multi_face_run += 1
+            s.longest_multi_face = max(s.longest_multi_face, s.multi_face_run)
+            if s.multi_face_run == self.multi_face_frames:
+                s.multi_face_episodes += 1
+                alert("multi_face", "start", s.multi_face_run)
+        else:
+            if s.multi_face_run >= self.multi_face_frames:
+                alert("multi_face", "end", s.multi_face_run)
+            s.multi_face_run = 0
+
+        if faces == 1:
+            s.ok += 1
+            s.ok_run += 1
+        else:
+            s.ok_run = 0
+        return raised
+
+    def session(self, session_id):
+        with self._lock:
+            s = self._sessions.get(session_id)
+            return s.to_dict() if s else None
+
+    def sessions(self, active_within=None, alerting_only=False, limit=None):
+        """
+        Stats of tracked sessions, most recently seen first. active_within (seconds) skips sessions
+        with no frame since then; alerting_only keeps sessions that have raised at least one alert.
+        """
+        cutoff = time.time() - active_within if active_within else None
+        out = []
+        with self._lock:
+            # no frames arrive once every interview is over; sweep here too
+            self._evict_idle(time.time())
+            for s in reversed(self._sessions.values()):
+                if cutoff is not None and (s.last_ts or 0) < cutoff:
+                    break   # ordered by last frame, so everything after is older
+                if alerting_only and not s.alerts:
+                    continue
+                out.append(s.to_dict())
+                if limit and len(out) >= limit:
+                    break
+        return out
+
+    def active_count(self, within):
+        """Sessions with a frame in the last `within` seconds."""
+        cutoff = time.time() - within
+        n = 0
+        with self._lock:
+            for s in reversed(self._sessions.values()):
+                if (s.last_ts or 0) < cutoff:
+                    break
+                n += 1
+        return n
+
+    def _evict_idle(self, now):
+        # least recently seen first, so this stops at the first session still active (amortised O(1))
+        if not self.session_ttl or self.session_ttl <= 0:
+            return
+        cutoff = now - self.session_ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if (oldest.last_ts or 0) >= cutoff:
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,197 @@
+# proctor_pipeline.py
+# Asynchronous proctoring: /proctor enqueues the frame and returns a ticket right away,
+# background workers save + analyze it, and results are kept per session for polling / SSE.
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+
+log = logging.getLogger("backend.proctor")
+
+PROCTOR_INGEST = os.environ.get("PROCTOR_INGEST", "sync").lower()  # "sync" or "async"
+INGEST_QUEUE_SIZE = int(os.environ.get("PROCTOR_INGEST_QUEUE", 512))
+INGEST_THREADS = int(os.environ.get("PROCTOR_INGEST_THREADS", 4))
+RESULTS_PER_SESSION = int(os.environ.get("PROCTOR_RESULTS_PER_SESSION", 100))
+MAX_SESSIONS = int(os.environ.get("PROCTOR_MAX_SESSIONS", 5000))
+MAX_TICKETS = int(os.environ.get("PROCTOR_MAX_TICKETS", 50000))
+# an SSE response holds a server thread; end it after this long and let EventSource reconnect
+SSE_MAX_DURATION = float(os.environ.get("SSE_MAX_DURATION", 300))
+
+
+class IngestBusy(Exception):
+    """Raised when the ingest queue is full."""
+
+
+class ResultStore:
+    """
+    Bounded in-memory store of analysis results.
+    Each session keeps its last RESULTS_PER_SESSION results with a monotonically increasing seq,
+    so clients can poll with ?since=<seq> or follow the SSE stream.
+    Waiters are woken per session: a publish only wakes the readers of its own session.
+    Listeners (e.g. ProctorMonitor.observe) get every published event, in seq order, after the
+    store lock is released; publish() returns once its event has been delivered.
+    """
+    def __init__(self, per_session=RESULTS_PER_SESSION, max_sessions=MAX_SESSIONS, max_tickets=MAX_TICKETS,
+                 listeners=()):
+        self.per_session = per_session
+        self.max_sessions = max_sessions
+        self.max_tickets = max_tickets
+        self.listeners = list(listeners)
+        self._sessions = OrderedDict()   # session_id -> deque of events
+        self._tickets = OrderedDict()    # ticket -> event (or pending marker)
+        self._waiters = {}               # session_id -> [Condition on _lock, number of waiting readers]
+        self._outbox = deque()           # published events not yet given to the listeners, in seq order
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._deliver_lock = threading.Lock()
+
+    def add_pending(self, ticket, session_id):
+        with self._lock:
+            self._tickets[ticket] = {"ticket": ticket, "session_id": session_id, "status": "pending"}
+            while len(self._tickets) > self.max_tickets:
+                self._tickets.popitem(last=False)
+
+    def discard(self, ticket):
+        """Drop a pending ticket whose frame was never queued."""
+        with self._lock:
+            t = self._tickets.get(ticket)
+            if t is not None and t.get("status") == "pending":
+                del self._tickets[ticket]
+
+    def publish(self, ticket, session_id, saved, analysis):
+        with self._lock:
+            self._seq += 1
+            event = {"seq": self._seq, "ticket": ticket, "session_id": session_id, "status": "done",
+                     "saved": saved, "analysis": analysis, "ts": time.time()}
+            events = self._sessions.get(session_id)
+            if events is None:
+                events = self._sessions[session_id] = deque(maxlen=self.per_session)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            events.append(event)
+            if ticket in self._tickets:
+                self._tickets[ticket] = event
+            waiter = self._waiters.get(session_id)
+            if waiter is not None:
+                waiter[0].notify_all()
+            if self.listeners:
+                self._outbox.append(event)
+        if self.listeners:
+            self._deliver()
+        return event
+
+    def _deliver(self):
+        # one thread at a time drains the outbox, so listeners see events in seq order; a publisher
+        # waiting here finds its event either still queued or already delivered by the previous holder
+        with self._deliver_lock:
+            while self._outbox:
+                event = self._outbox.popleft()
+                for listener in self.listeners:
+                    try:
+                        listener(event)
+                    except Exception:
+                        log.exception("Result listener failed for session %s", event["session_id"])
+
+    def get_ticket(self, ticket):
+        with self._lock:
+            return self._tickets.get(ticket)
+
+    def since(self, session_id, seq=0):
+        with self._lock:
+            return [e for e in self._sessions.get(session_id, ()) if e["seq"] > seq]
+
+    def wait_since(self, session_id, seq=0, timeout=15.0):
+        """Block until the session has events newer than seq (or timeout); return them."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            waiter = self._waiters.get(session_id)
+            if waiter is None:
+                waiter = self._waiters[session_id] = [threading.Condition(self._lock), 0]
+            waiter[1] += 1
+            try:
+                while True:
+                    events = [e for e in self._sessions.get(session_id, ()) if e["seq"] > seq]
+                    remaining = deadline - time.monotonic()
+                    if events or remaining <= 0:
+                        return events
+                    waiter[0].wait(remaining)
+            finally:
+                waiter[1] -= 1
+                if not waiter[1]:
+                    del self._waiters[session_id]
+
+
+class IngestPipeline:
+    """
+    Bounded queue + worker threads. process_fn(session_id, data, ext) -> (saved_filename, analysis)
+    does the actual save / detect work on the decoded frame bytes; it runs off the request thread.
+    """
+    def __init__(self, process_fn, store=None, threads=INGEST_THREADS, queue_size=INGEST_QUEUE_SIZE):
+        self.process_fn = process_fn
+        self.store = store or ResultStore()
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._threads = []
+        for i in range(max(1, int(threads))):
+            t = threading.Thread(target=self._worker, name=f"proctor-ingest-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def queue_fill(self):
+        return self._queue.qsize() / float(self._queue.maxsize)
+
+    def enqueue(self, session_id, data, ext="jpg"):
+        """Accept a frame and return its ticket. Raises IngestBusy when the queue is full."""
+        ticket = uuid.uuid4().hex
+        # pending first: a worker may publish the result before put_nowait returns
+        self.store.add_pending(ticket, session_id)
+        try:
+            self._queue.put_nowait((ticket, session_id, data, ext))
+        except queue.Full:
+            self.store.discard(ticket)
+            raise IngestBusy("ingest queue full")
+        return ticket
+
+    def _worker(self):
+        while True:
+            ticket, session_id, data, ext = self._queue.get()
+            try:
+                saved, analysis = self.process_fn(session_id, data, ext)
+            except Exception as e:
+                log.exception("Background proctoring failed for session %s", session_id)
+                saved, analysis = None, {"error": str(e)}
+            self.store.publish(ticket, session_id, saved, analysis)
+
+
+def sse_events(store, session_id, since=0, timeout=15.0, max_duration=SSE_MAX_DURATION, event="analysis"):
+    """
+    Generator of server-sent-event lines for one session (or every session when the store accepts
+    session_id=None, like proctor_monitor.AlertFeed).
+    Sends a keep-alive comment whenever no new result arrives within `timeout` seconds, and ends
+    after max_duration seconds; the browser reconnects with Last-Event-ID and continues from there.
+    """
+    started = time.monotonic()
+    last = since
+    # the id line sets the client's Last-Event-ID even if nothing arrives before the stream ends
+    yield f"retry: 3000\nid: {last}\n\n"
+    while True:
+        wait = timeout
+        if max_duration is not None:
+            wait = min(timeout, max_duration - (time.monotonic() - started))
+            if wait <= 0:
+                return
+        events = store.wait_since(session_id, last, timeout=wait)
+        if not events:
+            yield ": keep-alive\n\n"
+            continue
+        for e in events:
+            last = e["seq"]
+            yield f"id: {e['seq']}\nevent: {event}\ndata: {json.dumps(e)}\n\n"
@@ -0,0 +1,408 @@
+# question_bank.py
+# Local question bank: every JSON source (question_bank.json, data/*.json, QUESTION_BANK_SOURCES)
+# merged into one in-memory index by subject, difficulty and tag.
+#  - reloads when a source changes: only changed files are re-parsed, the new index is built aside
+#    and swapped in with one assignment, so readers never see a half-loaded bank
+#  - sample() draws without repeats from a lazily shuffled deck per subject/filter, so consecutive
+#    sessions get different questions and a draw costs O(n) in the questions drawn, not the bank size
+#
+# Accepted source layouts (all may carry difficulty "easy" / "medium" / "hard" (or 1-3) and tags):
+#   {"Subject": ["question", ...]}
+#   {"Subject": [{"text": "...", "difficulty": "hard", "tags": ["sql"]}, ...]}
+#   [{"subject": "Subject", "question": "...", "difficulty": 2, "tags": [...]}, ...]
+#
+#   python question_bank.py stats
+#   python question_bank.py sample "Computer Science" -n 5 --difficulty easy
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+import metrics
+
+log = logging.getLogger("backend.question_bank")
+
+BASE_DIR = Path(__file__).resolve().parent
+QUESTION_BANK_FILE = BASE_DIR / "question_bank.json"
+# files or directories (every *.json inside), separated by os.pathsep
+QUESTION_BANK_SOURCES = [Path(p) for p in os.environ.get(
+    "QUESTION_BANK_SOURCES", os.pathsep.join([str(QUESTION_BANK_FILE), str(BASE_DIR / "data")])).split(os.pathsep) if p]
+QUESTION_BANK_RELOAD_INTERVAL = float(os.environ.get("QUESTION_BANK_RELOAD_INTERVAL", 2))   # seconds; 0 = never
+DIFFICULTIES = ("easy", "medium", "hard")
+_DIFFICULTY_ALIASES = {"1": "easy", "2": "medium", "3": "hard", "beginner": "easy", "intermediate": "medium",
+                       "advanced": "hard", "difficult": "hard"}
+
+DEFAULT_QUESTION_BANK = {
+    "General Aptitude": [
+        "Tell me about a time you solved a difficult problem.",
+        "Why do you want this position?",
+        "Describe your strengths and weaknesses."
+    ],
+    "Computer Science": [
+        "Explain the difference between a process and a thread.",
+        "What is a RESTful API?",
+        "Describe how a hash table works."
+    ]
+}
+FALLBACK_SUBJECT = "General Aptitude"
+
+Question = namedtuple("Question", "text subject difficulty tags source")
+
+
+def normalize_difficulty(value):
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    value = _DIFFICULTY_ALIASES.get(value, value)
+    return value if value in DIFFICULTIES else None
+
+
+def _record(subject, item, source):
+    if isinstance(item, str):
+        text, difficulty, tags = item, None, ()
+    elif isinstance(item, dict):
+        text = str(item.get("text") or item.get("question") or "")
+        difficulty = normalize_difficulty(item.get("difficulty") or item.get("level"))
+        tags = item.get("tags") or ()
+        if isinstance(tags, str):
+            tags = [tags]
+        if tags:
+            tags = tuple(sorted({str(t).strip().lower() for t in tags} - {""}))
+        subject = item.get("subject") or subject
+    else:
+        return None
+    text = " ".join(text.split())
+    if not text or not subject:
+        return None
+    return Question(text, subject, difficulty, tags, source)
+
+
+def parse_source(path):
+    """Questions of one JSON file, in file order. Raises ValueError / OSError on unreadable files."""
+    clean = {}   # subject names as written -> whitespace-normalised
+    source = path.name
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict) and isinstance(data.get("subjects"), dict):
+        data = data["subjects"]
+    out = []
+    if isinstance(data, dict):
+        for subject, items in data.items():
+            subject = " ".join(str(subject).split())
+            for item in items if isinstance(items, list) else ():
+                q = _record(subject, item, source)
+                if q is not None:
+                    out.append(q)
+    elif isinstance(data, list):
+        for item in data:
+            q = _record(None, item, source) if isinstance(item, dict) else None
+            if q is not None:
+                name = q.subject
+                if name not in clean:
+                    clean[name] = " ".join(str(name).split())
+                out.append(q._replace(subject=clean[name]) if clean[name] != name else q)
+    else:
+        raise ValueError("expected an object of subjects or a list of question records")
+    return out
+
+
+class BankIndex:
+    """Merged view of all sources. Never changed once built (a reload builds a new one)."""
+    def __init__(self, parsed, version):
+        self.version = version
+        self.questions = []
+        self.subjects = OrderedDict()    # subject key (casefolded) -> display name of its first occurrence
+        by_subject, by_difficulty, by_tag = {}, {}, {}
+        seen = {}
+        keys = {}    # display name -> subject key
+        for qs in parsed:
+            for q in qs:
+                key = keys.get(q.subject)
+                if key is None:
+                    key = keys[q.subject] = q.subject.casefold()
+                dedup = (key, q.text.casefold())
+                if dedup in seen:
+                    # the same question in several sources: keep the first, merge what the others add
+                    i = seen[dedup]
+                    prev = self.questions[i]
+                    tags = tuple(sorted(set(prev.tags) | set(q.tags)))
+                    if tags != prev.tags or (prev.difficulty is None and q.difficulty):
+                        self.questions[i] = prev._replace(tags=tags, difficulty=prev.difficulty or q.difficulty)
+                    continue
+                seen[dedup] = len(self.questions)
+                name = self.subjects.setdefault(key, q.subject)
+                self.questions.append(q if name == q.subject else q._replace(subject=name))
+        for i, q in enumerate(self.questions):
+            key = keys[q.subject]
+            by_subject.setdefault(key, []).append(i)
+            by_difficulty.setdefault((key, q.difficulty), []).append(i)
+            for tag in q.tags:
+                by_tag.setdefault((key, tag), []).append(i)
+        self.by_subject = {k: tuple(v) for k, v in by_subject.items()}
+        self.by_difficulty = {k: tuple(v) for k, v in by_difficulty.items()}
+        self.by_tag = {k: tuple(v) for k, v in by_tag.items()}
+        self._filtered = {}   # memo of tag-filtered candidate lists
+
+    def __len__(self):
+        return len(self.questions)
+
+    def candidates(self, subject, difficulty=None, tags=()):
+        """Question ids of a subject matching the difficulty and carrying every tag (a tuple)."""
+        key = subject.casefold()
+        if difficulty:
+            ids = self.by_difficulty.get((key, difficulty), ())
+        else:
+            ids = self.by_subject.get(key, ())
+        if not tags:
+            return ids
+        memo = (key, difficulty, tags)
+        if memo in self._filtered:
+            return self._filtered[memo]
+        for tag in tags:
+            tagged = self.by_tag.get((key, tag), ())
+            if len(tagged) < len(ids):
+                ids, tagged = tagged, ids
+            wanted = set(tagged)
+            ids = tuple(i for i in ids if i in wanted)
+        if len(self._filtered) >= 1024:
+            self._filtered.clear()
+        self._filtered[memo] = ids
+        return ids
+
+
+class _Deck:
+    """
+    A shuffled order over `size` items produced one draw at a time (lazy Fisher-Yates: only the
+    swapped positions are stored), restarting with a fresh order once every item has been drawn.
+    """
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.pos = 0
+        self.swaps = {}
+
+    def draw(self, k):
+        k = min(k, self.size)
+        out, seen = [], set()
+        while len(out) < k:
+            if self.pos >= self.size:
+                self.pos, self.swaps = 0, {}
+            i = self.pos
+            j = self.rng.randrange(i, self.size)
+            picked = self.swaps.get(j, j)
+            self.swaps[j] = self.swaps.get(i, i)
+            self.swaps.pop(i, None)
+            self.pos += 1
+            # after a restart the new order may repeat something already in this draw
+            if picked not in seen:
+                seen.add(picked)
+                out.append(picked)
+        return out
+
+
+class QuestionBank:
+    def __init__(self, sources=QUESTION_BANK_SOURCES, max_decks=1024, seed=None):
+        self.sources = [Path(s) for s in sources]
+        self.max_decks = max_decks
+        self._files = {}        # path -> ((mtime_ns, size), parsed questions)
+        self._failed = {}       # path -> (mtime_ns, size) of a version that did not parse
+        self._index = BankIndex([], 0)
+        self._decks = OrderedDict()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()          # decks
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self.reloads = metrics.counter("question_bank_reloads_total", "Question bank (re)loads by result",
+                                       ("result",))
+
+    @property
+    def index(self):
+        return self._index
+
+    def _source_files(self):
+        files = []
+        for src in self.sources:
+            if src.is_dir():
+                files.extend(sorted(src.glob("*.json")))
+            elif src.is_file():
+                files.append(src)
+        return files
+
+    def reload(self, force=False):
+        """
+        Re-read changed sources and swap in a new index. A source that fails to parse keeps its last
+        good contents. Returns True when the index was replaced.
+        """
+        with self._reload_lock:
+            files = self._source_files()
+            changed = False
+            parsed = []
+            seen_paths = set()
+            for path in files:
+                seen_paths.add(path)
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                stamp = (st.st_mtime_ns, st.st_size)
+                cached = self._files.get(path)
+                if (cached is None or cached[0] != stamp or force) and self._failed.get(path) != stamp:
+                    try:
+                        questions = parse_source(path)
+                        self._files[path] = (stamp, questions)
+                        self._failed.pop(path, None)
+                        changed = True
+                        log.info("Question bank source %s: %d questions", path, len(questions))
+                    except Exception as e:
+                        # e.g. caught mid-write; retried once the file changes again
+                        self._failed[path] = stamp
+                        self.reloads.inc(result="error")
+                        log.warning("Question bank source %s unreadable (%s); keeping its previous contents", path, e)
+                if path not in self._files:
+                    continue
+                parsed.append(self._files[path][1])
+            for gone in set(self._files) - seen_paths:
+                del self._files[gone]
+                changed = True
+                log.info("Question bank source %s removed", gone)
+            if not changed and self._index.version:
+                return False
+            index = BankIndex(parsed, self._index.version + 1)
+            self._index = index
+            with self._lock:
+                self._decks.clear()
+            self.reloads.inc(result="ok")
+            log.info("Question bank v%d: %d questions in %d subjects from %d files",
+                     index.version, len(index), len(index.subjects), len(parsed))
+            return True
+
+    def subjects(self):
+        """Display names of all subjects, in source order."""
+        return list(self._index.subjects.values())
+
+    def has_subject(self, subject):
+        return bool(subject) and subject.casefold() in self._index.subjects
+
+    def questions(self, subject, difficulty=None, tags=()):
+        index = self._index
+        return [index.questions[i].text for i in index.candidates(subject, normalize_difficulty(difficulty),
+                                                                   tuple(sorted(tags)))]
+
+    def sample(self, subject, n=5, difficulty=None, tags=(), ordered=True):
+        """
+        n distinct question texts for subject (fewer if the subject has fewer), continuing that
+        subject's shuffled deck so successive calls do not repeat until the deck is exhausted.
+        ordered=True returns them easy -> hard (unrated count as medium), like the LLM sets.
+        """
+        index = self._index
+        difficulty = normalize_difficulty(difficulty)
+        tags = tuple(sorted({t.strip().lower() for t in tags or () if t.strip()}))
+        ids = index.candidates(subject, difficulty, tags)
+        if not ids or n <= 0:
+            return []
+        key = (index.version, subject.casefold(), difficulty, tags)
+        with self._lock:
+            deck = self._decks.get(key)
+            if deck is None:
+                deck = self._decks[key] = _Deck(len(ids), self._rng)
+                while len(self._decks) > self.max_decks:
+                    self._decks.popitem(last=False)
+            else:
+                self._decks.move_to_end(key)
+            picks = [index.questions[ids[p]] for p in deck.draw(n)]
+        if ordered:
+            rank = {d: r for r, d in enumerate(DIFFICULTIES)}
+            picks.sort(key=lambda q: rank.get(q.difficulty, 1))
+        return [q.text for q in picks]
+
+    def stats(self):
+        index = self._index
+        subjects = {}
+        for key, name in index.subjects.items():
+            by_level = {d or "unrated": len(index.by_difficulty.get((key, d), ())) for d in DIFFICULTIES + (None,)}
+            subjects[name] = {"questions": len(index.by_subject.get(key, ())),
+                              "difficulty": {d: c for d, c in by_level.items() if c},
+                              "tags": sorted(t for (k, t) in index.by_tag if k == key)}
+        return {"version": index.version, "questions": len(index), "subjects": subjects,
+                "sources": [str(p) for p in self._files]}
+
+    def start_watcher(self, interval=QUESTION_BANK_RELOAD_INTERVAL):
+        """Poll the sources' mtimes every `interval` seconds and reload on change (daemon thread)."""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception:
+                    log.exception("Question bank reload failed")
+
+        self._watcher = threading.Thread(target=loop, name="question-bank-watch", daemon=True)
+        self._watcher.start()
+
+
+def ensure_default_bank(path=QUESTION_BANK_FILE):
+    if not path.exists() or path.stat().st_size == 0:
+        log.warning("question_bank.json missing or empty; creating default bank at %s", path)
+        path.write_text(json.dumps(DEFAULT_QUESTION_BANK, indent=2), encoding="utf-8")
+
+
+_bank = None
+_bank_lock = threading.Lock()
+
+def get_bank() -> QuestionBank:
+    """Process-wide bank: loaded on first use, then kept current by the watcher thread."""
+    global _bank
+    with _bank_lock:
+        if _bank is None:
+            bank = QuestionBank()
+            try:
+                if QUESTION_BANK_FILE in bank.sources:
+                    ensure_default_bank()
+                bank.reload()
+            except Exception:
+                log.exception("Failed to load question bank")
+            if not len(bank.index):
+                log.warning("Question bank is empty; using small fallback in memory.")
+                bank._index = BankIndex([[Question("Why do you want this position?", FALLBACK_SUBJECT,
+                                                   None, (), "fallback")]], bank.index.version + 1)
+            bank.start_watcher()
+            metrics.callback("question_bank_questions", "Questions in the loaded bank", lambda: len(bank.index))
+            _bank = bank
+        return _bank
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Inspect the merged question bank.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="subjects, difficulty levels and tags of every loaded source")
+    s = sub.add_parser("sample", help="draw questions the way registration does")
+    s.add_argument("subject")
+    s.add_argument("-n", type=int, default=5)
+    s.add_argument("--difficulty", default=None)
+    s.add_argument("--tag", action="append", default=[])
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    bank = QuestionBank()
+    bank.reload()
+    if args.cmd == "stats":
+        print(json.dumps(bank.stats(), indent=2))
+    else:
+        if not bank.has_subject(args.subject):
+            print(f"unknown subject {args.subject!r}; have: {', '.join(bank.subjects())}", file=sys.stderr)
+            return 1
+        for q in bank.sample(args.subject, args.n, args.difficulty, args.tag):
+            print(q)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,20 @@
 # question_generator.py
 import os
 import re
-try:
-    import openai
-except Exception:
-    openai = None
+import time
+import logging
+import threading
+from collections import deque
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+from llm_client import get_client, LLMError
+from followup_engine import engine as followup_engine
+from question_bank import get_bank
+from metrics import LLM_CALL_SECONDS
+
+log = logging.getLogger("backend.question_generator")
+
+QUESTION_POOL_TARGET = int(os.environ.get("QUESTION_POOL_TARGET", 5))   # ready question sets per subject
+QUESTION_TIMEOUT = float(os.environ.get("QUESTION_TIMEOUT", 30))
 
 def _parse_questions_from_text(text):
     lines = [l.strip() for l in text.splitlines() if l.strip()]
@@ -16,37 +24,33 @@ def _parse_questions_from_text(text):
         qs.append(q)
     return qs
 
-def generate_questions_for_subject(subject: str, n: int = 5):
+def generate_questions_for_subject(subject: str, n: int = 5, use_cache: bool = True, fallback: bool = True):
     """
-    Use OpenAI to generate n subject-specific questions.
-    Raises RuntimeError if OpenAI is not configured.
+    Use the LLM to generate n subject-specific questions.
+    If the LLM is not configured or the call fails, draw n questions from the local bank instead
+    (non-repeating across calls); with fallback=False, raise RuntimeError.
     """
-    if OPENAI_API_KEY is None or openai is None:
-        raise RuntimeError("OpenAI not configured or 'openai' library missing.")
-    openai.api_key = OPENAI_API_KEY
+    client = get_client()
+    if not client.enabled:
+        if fallback:
+            return get_bank().sample(subject, n)
+        raise RuntimeError("OpenAI not configured (OPENAI_API_KEY missing).")
     prompt = f"Generate {n} interview questions for the subject: {subject}. Provide a numbered list, concise questions, gradually increasing difficulty."
-    resp = openai.ChatCompletion.create(
-        model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-        messages=[
+    t0 = time.perf_counter()
+    try:
+        content = client.chat([
             {"role": "system", "content": "You are an expert technical interviewer."},
             {"role": "user", "content": prompt}
-        ],
-        max_tokens=400,
-        temperature=0.25,
-        n=1
-    )
-    # extract content safely
-    content = ""
-    if isinstance(resp, dict):
-        content = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-    else:
-        try:
-            content = resp.choices[0].message.content
-        except Exception:
-            content = str(resp)
+        ], max_tokens=400, temperature=0.25, use_cache=use_cache, timeout=QUESTION_TIMEOUT)
+    except LLMError as e:
+        LLM_CALL_SECONDS.observe(time.perf_counter() - t0, caller="questions", outcome="error")
+        if fallback:
+            log.info("Question generation for %r failed (%s); using the local bank", subject, e)
+            return get_bank().sample(subject, n)
+        raise RuntimeError(f"question generation failed: {e}") from e
+    LLM_CALL_SECONDS.observe(time.perf_counter() - t0, caller="questions", outcome="ok")
     qs = _parse_questions_from_text(content)
     if len(qs) < n:
-        import re
         sents = re.split(r'(?<=[\.\?\!])\s+', content)
         for s in sents:
             s = s.strip()
@@ -57,55 +61,78 @@ def generate_questions_for_subject(subject: str, n: int = 5):
 def generate_counter_question(previous_question: str, candidate_answer: str, history=None, max_tokens=60):
     """
     Generate a single concise follow-up question based on candidate_answer.
-    Returns string follow-up question. Uses OpenAI if configured, otherwise a heuristic fallback.
+    Returns string follow-up question. Uses the LLM if configured, otherwise the keyword rules
+    (both live in followup_engine so /generate_followup and this helper always agree).
+    """
+    return followup_engine.generate(previous_question, candidate_answer, history or [], llm=get_client(),
+                                    max_tokens=max_tokens)
+
+
+def _pool_key(subject):
+    # the bank matches subjects case-insensitively; "Python" and "python" share one pool entry
+    return (subject or "").strip().casefold()
+
+
+class QuestionPool:
     """
-    if history is None:
-        history = []
-
-    # Build prompt
-    prompt_system = (
-        "You are an expert interviewer. Generate exactly one concise, relevant follow-up question "
-        "that asks for clarification, a deeper explanation, or a concrete example based only on the candidate's answer. "
-        "Keep it short (<= 25 words) and professional."
-    )
-    user_content = f"Previous question: {previous_question}\n\nCandidate answer: {candidate_answer}"
-    if history:
-        user_content += "\n\nRecent history:\n" + "\n".join(history[-3:])
-
-    # Try OpenAI
-    if OPENAI_API_KEY and openai is not None:
+    Pre-generated question sets per subject, refilled in the background, so that
+    registration takes a ready set (or falls back to the bank) and never waits on the model.
+    Only subjects of the question bank are pooled: the subject comes from the registration form,
+    and arbitrary strings must not queue LLM generations or grow the pool.
+    """
+    def __init__(self, target=QUESTION_POOL_TARGET, n=5):
+        self.target = target
+        self.n = n
+        self._sets = {}        # subject -> deque of question lists
+        self._refilling = set()
+        self._lock = threading.Lock()
+
+    def take(self, subject, n=5):
+        """Pop a ready question set for subject (or None) and schedule a refill."""
+        subject = _pool_key(subject)
+        with self._lock:
+            sets = self._sets.get(subject)
+            qlist = sets.popleft() if sets else None
+        self.refill(subject)
+        return qlist[:n] if qlist else None
+
+    def size(self, subject):
+        with self._lock:
+            return len(self._sets.get(_pool_key(subject)) or ())
+
+    def refill(self, subject):
+        """
+        Top the subject up to `target` sets on the LLM client's background threads (at most one refill
+        per subject), leaving its request-path workers free for follow-ups.
+        """
+        subject = _pool_key(subject)
+        client = get_client()
+        if not client.enabled or not get_bank().has_subject(subject):
+            return
+        with self._lock:
+            if subject in self._refilling or len(self._sets.get(subject) or ()) >= self.target:
+                return
+            self._refilling.add(subject)
+        client.background.submit(self._refill, subject)
+
+    def prefill(self, subjects):
+        for s in subjects:
+            self.refill(s)
+
+    def _refill(self, subject):
         try:
-            openai.api_key = OPENAI_API_KEY
-            resp = openai.ChatCompletion.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": prompt_system},
-                    {"role": "user", "content": user_content}
-                ],
-                max_tokens=max_tokens,
-                temperature=0.2,
-                n=1
-            )
-            # parse resp
-            content = ""
-            if isinstance(resp, dict):
-                content = resp.get("choices", [{}])[0].get("message", {}).get("content", "")
-            else:
-                content = getattr(resp.choices[0].message, "content", str(resp))
-            if content:
-                return content.strip().replace("\n", " ")
-        except Exception:
-            # fall through to heuristic fallback
-            pass
-
-    # Heuristic fallback
-    a = (candidate_answer or "").lower()
-    if any(word in a for word in ["because", "since", "so that", "therefore"]):
-        return "Can you give a concrete example to illustrate that?"
-    if any(word in a for word in ["for example", "e.g.", "such as"]):
-        return "Can you explain the steps you took in that example?"
-    if any(term in a for term in ["algorithm", "data", "model", "architecture", "thread", "process", "api", "hash"]):
-        return "Can you explain the technical steps or rationale in more detail?"
-    if len(a.split()) < 10:
-        return "Could you expand on that with more detail or an example?"
-    return "Can you provide more detail or a specific example to illustrate your point?"
+            while self.size(subject) < self.target:
+                # bypass the response cache: every pooled set should be a fresh generation
+                qs = generate_questions_for_subject(subject, self.n, use_cache=False, fallback=False)
+                if not qs:
+                    break
+                with self._lock:
+                    self._sets.setdefault(subject, deque()).append(qs)
+        except Exception as e:
+            log.info("Question pool refill for %r failed: %s", subject, e)
+        finally:
+            with self._lock:
+                self._refilling.discard(subject)
+
+
+question_pool = QuestionPool()
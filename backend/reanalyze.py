@@ -0,0 +1,494 @@
+# reanalyze.py
+# Offline re-analysis of stored snapshots, e.g. after tuning the detector (FACE_SCALE_FACTOR,
+# FACE_MIN_NEIGHBORS, FACE_MIN_SIZE in face_detection.py).
+#  - frames come from the snapshot index (each stored blob once, loose file or packed segment) or
+#    from a plain directory tree such as an old flat uploads/ folder
+#  - a reader thread loads batches ahead into a bounded queue while a process pool decodes and detects
+#  - results are written by the DB writer in bulk, one transaction per --commit-every frames, together
+#    with the run's checkpoint, so an interrupted run resumes exactly where its last commit ended
+#  - progress lines report frames/s, MB/s, the prefetch fill level and an ETA
+#
+#   python reanalyze.py run --min-neighbors 4 --scale-factor 1.05       # every indexed frame
+#   python reanalyze.py run --session ABC123 --since 2026-01-01 --apply  # also update proctor_events
+#   python reanalyze.py run --dir /srv/old-uploads --workers 8
+#   python reanalyze.py resume 20261016-101500-3fa2                      # after Ctrl-C or a crash
+#   python reanalyze.py runs
+#   python reanalyze.py compare 20261016-101500-3fa2                     # stored vs re-analysed face counts
+import os
+import sys
+import json
+import time
+import queue
+import secrets
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import db
+import segments
+from detection_engine import DETECT_START_METHOD
+from snapshot_store import SNAPSHOT_DIR, parse_legacy_name
+
+log = logging.getLogger("backend.reanalyze")
+
+REANALYZE_BATCH = int(os.environ.get("REANALYZE_BATCH", 16))            # frames per pool task
+REANALYZE_COMMIT_EVERY = int(os.environ.get("REANALYZE_COMMIT_EVERY", 1000))
+PAGE_SIZE = 1000                                                          # index rows per keyset query
+
+
+# ---- sources: ordered (key, item, session_id, hash, loader) tuples after a checkpoint key ----
+
+def iter_index(cursor=None, sessions=None, since=None, until=None, root=SNAPSHOT_DIR):
+    """Every stored blob once, in (session_id, hash) order; near-duplicate frames share their blob's result."""
+    where, args = [], []
+    if sessions:
+        where.append("session_id IN (%s)" % ",".join("?" * len(sessions)))
+        args.extend(sessions)
+    if since is not None:
+        where.append("created >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("created < ?")
+        args.append(until)
+    last = tuple(json.loads(cursor)) if cursor else None
+    while True:
+        clauses = where + (["(session_id, hash) > (?, ?)"] if last else [])
+        sql = ("SELECT session_id, hash, path, segment, seg_offset, seg_length FROM snapshot_blobs"
+               + (" WHERE " + " AND ".join(clauses) if clauses else "") + " ORDER BY session_id, hash LIMIT ?")
+        with db.pool().connection() as conn:
+            rows = conn.execute(sql, args + list(last or ()) + [PAGE_SIZE]).fetchall()
+        for sid, blob_hash, rel, segment, offset, length in rows:
+            packed = (segments.SEGMENT_DIR / segment, offset, length) if segment else None
+            yield json.dumps([sid, blob_hash]), rel, sid, blob_hash, (root / rel, packed)
+        if len(rows) < PAGE_SIZE:
+            return
+        last = rows[-1][:2]
+
+
+def count_index(sessions=None, since=None, until=None):
+    where, args = [], []
+    if sessions:
+        where.append("session_id IN (%s)" % ",".join("?" * len(sessions)))
+        args.extend(sessions)
+    if since is not None:
+        where.append("created >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("created < ?")
+        args.append(until)
+    with db.pool().connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM snapshot_blobs" + (" WHERE " + " AND ".join(where) if where else ""),
+                            args).fetchone()[0]
+
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".webp", ".png"}
+
+def _walk(path, rel, after):
+    # files and directories interleaved by name, so the visiting order is the order of the path tuples
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        parts = rel + (entry.name,)
+        if entry.is_dir():
+            # a subtree that sorts before the checkpoint's prefix holds nothing left to do
+            if parts >= after[:len(parts)]:
+                yield from _walk(entry.path, parts, after)
+        elif parts > after and Path(entry.name).suffix.lower() in IMAGE_SUFFIXES:
+            yield parts
+
+
+def iter_dir(root, cursor=None):
+    """Image files under root in sorted path order, starting after the checkpoint path."""
+    root = Path(root)
+    for parts in _walk(root, (), tuple(cursor.split("/")) if cursor else ()):
+        name = parts[-1]
+        rel = "/".join(parts)
+        legacy = parse_legacy_name(name)
+        if legacy:
+            sid, blob_hash = legacy[0], None
+        elif len(parts) == 3 and len(parts[0]) == 2:
+            sid, blob_hash = parts[1], Path(name).stem      # snapshot store layout <shard>/<session>/<hash>
+        else:
+            sid, blob_hash = None, None
+        yield rel, rel, sid, blob_hash, (root / rel, None)
+
+
+def load_frame(location):
+    path, packed = location
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        if packed is None:
+            raise
+    return segments.read_frame(*packed)
+
+
+# ---- worker processes ----
+
+def _init_worker(params):
+    import cv2
+    cv2.setNumThreads(1)   # parallelism comes from the pool
+    import face_detection
+    face_detection.configure(params.get("detector"), params.get("min_size"),
+                             **{k: params[k] for k in ("scale_factor", "min_neighbors") if params.get(k) is not None})
+
+
+def _analyze_batch(frames):
+    """(faces_detected, status, boxes) per encoded frame; None frames (unreadable) are reported as such."""
+    from face_detection import detect_faces
+    out = []
+    for data in frames:
+        if data is None:
+            out.append((0, "read_failed", []))
+            continue
+        a = detect_faces(data)
+        out.append((a.get("faces_detected") or 0, a.get("status"), a.get("boxes") or []))
+    return out
+
+
+class _InlinePool:
+    """--workers 0: same interface, run in this process (debugging, single-core hosts)."""
+    def __init__(self, params):
+        _init_worker(params)
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        fut = Future()
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+# ---- the run ----
+
+class Progress:
+    def __init__(self, total=None, every=10.0, done=0):
+        self.total = total
+        self.every = every
+        self.started = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self.errors = 0
+        self.resumed_from = done
+        self._last = (self.started, 0)
+
+    def add(self, frames, nbytes, errors):
+        self.frames += frames
+        self.bytes += nbytes
+        self.errors += errors
+
+    def maybe_report(self, prefetched, in_flight, force=False):
+        now = time.monotonic()
+        if not force and now - self._last[0] < self.every:
+            return
+        window = max(1e-6, now - self._last[0])
+        recent = (self.frames - self._last[1]) / window
+        elapsed = max(1e-6, now - self.started)
+        line = (f"{self.resumed_from + self.frames} frames  {recent:7.1f} fps now  {self.frames / elapsed:7.1f} fps avg"
+                f"  {self.bytes / elapsed / 1e6:6.1f} MB/s  prefetch {prefetched}  in flight {in_flight}"
+                f"  errors {self.errors}")
+        if self.total:
+            left = self.total - self.resumed_from - self.frames
+            rate = self.frames / elapsed
+            line += f"  {100.0 * (self.total - left) / self.total:5.1f}%"
+            if rate > 0 and left > 0:
+                eta = int(left / rate)
+                line += f"  eta {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+        log.info(line)
+        self._last = (now, self.frames)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {"frames": self.frames, "errors": self.errors, "seconds": round(elapsed, 1),
+                "frames_per_second": round(self.frames / elapsed, 1) if elapsed else None,
+                "megabytes_read": round(self.bytes / 1e6, 1)}
+
+
+def _reader(items, batch_size, out, stop):
+    """Load frames batch by batch into `out` (bounded, so at most maxsize batches sit in memory)."""
+    try:
+        batch = []
+        for item in items:
+            if stop.is_set():
+                return
+            key, name, sid, blob_hash, location = item
+            try:
+                data = load_frame(location)
+            except Exception as e:
+                log.warning("Cannot read %s: %s", name, e)
+                data = None
+            batch.append((key, name, sid, blob_hash, data))
+            if len(batch) >= batch_size:
+                out.put(batch)
+                batch = []
+        if batch:
+            out.put(batch)
+    except Exception:
+        log.exception("Frame reader failed")
+    finally:
+        out.put(None)
+
+
+def _result_statements(run_id, metas, results, apply):
+    statements = []
+    for (key, name, sid, blob_hash), (faces, status, boxes) in zip(metas, results):
+        boxes_json = json.dumps(boxes)
+        statements.append(("INSERT OR REPLACE INTO reanalysis_results "
+                           "(run_id,item,session_id,hash,faces_detected,status,boxes_json) VALUES (?,?,?,?,?,?,?)",
+                           (run_id, name, sid, blob_hash, faces, status, boxes_json)))
+        if not apply or status == "read_failed":
+            continue
+        if sid and blob_hash:
+            statements.append(("UPDATE proctor_events SET faces_detected=?, status=?, boxes_json=? WHERE file_path IN "
+                               "(SELECT name FROM snapshots WHERE session_id=? AND hash=?)",
+                               (faces, status, boxes_json, sid, blob_hash)))
+        else:
+            statements.append(("UPDATE proctor_events SET faces_detected=?, status=?, boxes_json=? WHERE file_path=?",
+                               (faces, status, boxes_json, name.rsplit("/", 1)[-1])))
+    return statements
+
+
+def execute(run_id, params, cursor=None, done=0, workers=None, batch_size=REANALYZE_BATCH,
+            prefetch=None, commit_every=REANALYZE_COMMIT_EVERY, report_every=10.0):
+    """Process a run from its checkpoint to the end (or until interrupted). Returns the summary dict."""
+    workers = (os.cpu_count() or 1) if workers is None else max(0, workers)
+    prefetch = prefetch or max(2, 2 * max(1, workers))
+    if params.get("dir"):
+        items, total = iter_dir(params["dir"], cursor), None
+    else:
+        filters = dict(sessions=params.get("sessions"), since=params.get("since"), until=params.get("until"))
+        items, total = iter_index(cursor, **filters), count_index(**filters)
+    if params.get("limit"):
+        total = min(total, params["limit"]) if total is not None else params["limit"]
+        items = _take(items, max(0, params["limit"] - done))
+
+    loaded = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    reader = threading.Thread(target=_reader, args=(items, max(1, batch_size), loaded, stop),
+                              name="reanalyze-reader", daemon=True)
+    # not fork: the DB writer and reader threads are already running in this process
+    pool = (ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(params,),
+                                mp_context=multiprocessing.get_context(DETECT_START_METHOD)) if workers
+            else _InlinePool(params))
+    progress = Progress(total, report_every, done)
+    statuses = {}
+    in_flight = {}           # future -> (seq, metas, nbytes)
+    # seq -> (last key, statements, statuses, nbytes) of a finished batch, held back until every
+    # earlier batch is done too: rows are only committed together with a checkpoint that covers them,
+    # so a resumed run neither re-inserts nor double-counts frames finished out of order
+    finished = {}
+    next_seq = submitted = 0
+    checkpoint = cursor
+    pending, pending_frames, pending_errors = [], 0, 0
+    commit = None            # the previous commit; at most one is outstanding
+
+    def flush():
+        nonlocal pending, pending_frames, pending_errors, commit
+        if commit is not None:
+            commit.result()
+        pending.append(("UPDATE reanalysis_runs SET cursor=?, frames=frames+?, errors=errors+?, updated=? "
+                        "WHERE run_id=?", (checkpoint, pending_frames, pending_errors, time.time(), run_id)))
+        commit = db.writer().submit(pending)
+        pending, pending_frames, pending_errors = [], 0, 0
+
+    interrupted = False
+    reader.start()
+    try:
+        exhausted = False
+        while not exhausted or in_flight:
+            # keep every worker busy plus one batch queued per worker
+            while not exhausted and len(in_flight) < 2 * max(1, workers):
+                batch = loaded.get()
+                if batch is None:
+                    exhausted = True
+                    break
+                metas = [b[:4] for b in batch]
+                nbytes = sum(len(b[4]) for b in batch if b[4] is not None)
+                in_flight[pool.submit(_analyze_batch, [b[4] for b in batch])] = (submitted, metas, nbytes)
+                submitted += 1
+            if not in_flight:
+                continue
+            done_futs, _ = wait(list(in_flight), timeout=report_every, return_when=FIRST_COMPLETED)
+            for fut in done_futs:
+                seq, metas, nbytes = in_flight.pop(fut)
+                try:
+                    results = fut.result()
+                except Exception as e:
+                    log.error("Batch %d failed (%s); recording it as errors", seq, e)
+                    results = [(0, f"error: {e}", [])] * len(metas)
+                finished[seq] = (metas[-1][0], _result_statements(run_id, metas, results, params.get("apply")),
+                                 [status for _, status, _ in results], nbytes)
+            # the checkpoint only moves past batches whose predecessors are all done
+            while next_seq in finished:
+                checkpoint, statements, batch_statuses, nbytes = finished.pop(next_seq)
+                errors = 0
+                for status in batch_statuses:
+                    statuses[status] = statuses.get(status, 0) + 1
+                    errors += status not in ("ok", "alert")
+                pending.extend(statements)
+                pending_frames += len(batch_statuses)
+                pending_errors += errors
+                progress.add(len(batch_statuses), nbytes, errors)
+                next_seq += 1
+            if pending_frames >= commit_every:
+                flush()
+            progress.maybe_report(loaded.qsize(), len(in_flight))
+    except KeyboardInterrupt:
+        interrupted = True
+        log.warning("Interrupted; saving the checkpoint (resume with: python reanalyze.py resume %s)", run_id)
+    finally:
+        stop.set()
+        pool.shutdown(wait=not interrupted, cancel_futures=True)
+        # drain so a reader blocked on a full queue can see stop
+        while reader.is_alive():
+            try:
+                loaded.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    flush()
+    if not interrupted:
+        db.writer().submit([("UPDATE reanalysis_runs SET finished=? WHERE run_id=?", (time.time(), run_id))])
+    db.writer().flush(timeout=60)
+    progress.maybe_report(0, 0, force=True)
+    return dict(progress.summary(), run_id=run_id, statuses=statuses, interrupted=interrupted)
+
+
+def _take(items, n):
+    for i, item in enumerate(items):
+        if i >= n:
+            return
+        yield item
+
+
+def _parse_time(value):
+    """Epoch seconds or an ISO date/datetime (UTC)."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def new_run(params):
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(2)}"
+    source = f"dir:{params['dir']}" if params.get("dir") else "index"
+    db.writer().submit([("INSERT INTO reanalysis_runs (run_id,source,params_json,started,updated) VALUES (?,?,?,?,?)",
+                         (run_id, source, json.dumps(params), time.time(), time.time()))]).result()
+    return run_id
+
+
+def load_run(run_id):
+    with db.pool().connection() as conn:
+        row = conn.execute("SELECT params_json, cursor, frames, finished FROM reanalysis_runs WHERE run_id=?",
+                           (run_id,)).fetchone()
+    if not row:
+        raise SystemExit(f"unknown run {run_id}")
+    return json.loads(row[0]), row[1], row[2], row[3]
+
+
+def compare(run_id):
+    """Face counts stored in proctor_events vs this run, per (old, new) pair, for the frames of indexed blobs."""
+    db.writer().flush()
+    with db.pool().connection() as conn:
+        rows = conn.execute(
+            "SELECT pe.faces_detected, r.faces_detected, COUNT(*) FROM reanalysis_results r "
+            "JOIN snapshots s ON s.session_id = r.session_id AND s.hash = r.hash "
+            "JOIN proctor_events pe ON pe.file_path = s.name "
+            "WHERE r.run_id=? GROUP BY 1, 2 ORDER BY 3 DESC", (run_id,)).fetchall()
+        sessions = conn.execute(
+            "SELECT r.session_id, COUNT(*) FROM reanalysis_results r "
+            "JOIN snapshots s ON s.session_id = r.session_id AND s.hash = r.hash "
+            "JOIN proctor_events pe ON pe.file_path = s.name "
+            "WHERE r.run_id=? AND pe.faces_detected IS NOT r.faces_detected "
+            "GROUP BY 1 ORDER BY 2 DESC LIMIT 20", (run_id,)).fetchall()
+    frames = sum(n for _, _, n in rows)
+    changed = sum(n for old, new, n in rows if old != new)
+    params = load_run(run_id)[0]
+    return {"run_id": run_id, "applied": bool(params.get("apply")),   # applied runs compare with themselves
+            "frames_compared": frames, "frames_changed": changed,
+            "became_ok": sum(n for old, new, n in rows if old != 1 and new == 1),
+            "became_alert": sum(n for old, new, n in rows if old == 1 and new != 1),
+            "face_counts": [{"stored": old, "reanalysed": new, "frames": n} for old, new, n in rows],
+            "most_changed_sessions": dict(sessions)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Re-run face detection over stored snapshots.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def throughput_args(p):
+        p.add_argument("--workers", type=int, default=None, help="detection processes (default: CPU count, 0 = inline)")
+        p.add_argument("--batch-size", type=int, default=REANALYZE_BATCH, help="frames per pool task")
+        p.add_argument("--prefetch", type=int, default=None, help="loaded batches kept ahead of the pool")
+        p.add_argument("--commit-every", type=int, default=REANALYZE_COMMIT_EVERY, help="frames per DB transaction")
+        p.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+
+    r = sub.add_parser("run", help="start a new run")
+    r.add_argument("--session", action="append", default=[], help="only these sessions (repeatable)")
+    r.add_argument("--since", default=None, help="frames stored at/after this time (ISO date or epoch)")
+    r.add_argument("--until", default=None, help="frames stored before this time")
+    r.add_argument("--dir", default=None, help="scan image files under this directory instead of the index")
+    r.add_argument("--limit", type=int, default=None, help="stop after this many frames")
+    r.add_argument("--detector", default=None, help="backend name (default: FACE_DETECTOR)")
+    r.add_argument("--scale-factor", type=float, default=None)
+    r.add_argument("--min-neighbors", type=int, default=None)
+    r.add_argument("--min-size", type=int, default=None, help="smallest face side in pixels")
+    r.add_argument("--apply", action="store_true", help="also overwrite the matching proctor_events rows")
+    throughput_args(r)
+    s = sub.add_parser("resume", help="continue an interrupted run from its checkpoint")
+    s.add_argument("run_id")
+    throughput_args(s)
+    sub.add_parser("runs", help="list runs and their progress")
+    c = sub.add_parser("compare", help="stored vs re-analysed face counts of a run")
+    c.add_argument("run_id")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    db.init_db()
+    if args.cmd == "runs":
+        with db.pool().connection() as conn:
+            for row in conn.execute("SELECT run_id, source, frames, errors, started, finished, params_json "
+                                    "FROM reanalysis_runs ORDER BY started"):
+                state = "finished" if row[5] else "resumable"
+                print(f"{row[0]}  {row[1]:<12} {row[2]:>9} frames {row[3]:>6} errors  {state:<9}  {row[6]}")
+        return 0
+    if args.cmd == "compare":
+        print(json.dumps(compare(args.run_id), indent=2))
+        return 0
+
+    if args.cmd == "run":
+        params = {"detector": args.detector, "scale_factor": args.scale_factor, "min_neighbors": args.min_neighbors,
+                  "min_size": args.min_size, "sessions": args.session or None, "since": _parse_time(args.since),
+                  "until": _parse_time(args.until), "dir": str(Path(args.dir).resolve()) if args.dir else None,
+                  "limit": args.limit, "apply": args.apply}
+        _init_worker(params)   # fail here, not in every worker, on a bad detector name or model
+        run_id, cursor, done = new_run(params), None, 0
+        log.info("Run %s started: %s", run_id, json.dumps({k: v for k, v in params.items() if v is not None}))
+    else:
+        run_id = args.run_id
+        params, cursor, done, finished_at = load_run(run_id)
+        if finished_at:
+            print(f"run {run_id} already finished ({done} frames)")
+            return 0
+        log.info("Resuming run %s after %d frames", run_id, done)
+    summary = execute(run_id, params, cursor, done, workers=args.workers, batch_size=args.batch_size,
+                      prefetch=args.prefetch, commit_every=args.commit_every, report_every=args.report_every)
+    print(json.dumps(summary, indent=2))
+    return 130 if summary["interrupted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+# segments.py
+# Per-session MJPEG segments assembled in the background from stored snapshots.
+#
+#   segments/<shard>/<session_id>/<seq>.mjpeg   concatenated JPEG frames (plays in VLC / ffplay -f mjpeg)
+#   segments/<shard>/<session_id>/<seq>.idx     one fixed-size record per received frame: (ts, offset, length)
+#
+# Frames are appended by one writer thread fed from SnapshotStore listeners, so /proctor never waits
+# on it. A frame the store deduplicated (same blob as the previous one) only adds an index record
+# pointing at the bytes already in the segment. Index records are written after the frame data, so
+# a crash can leave unindexed bytes at the end of a segment but never an index entry without data.
+# A segment is rotated at SEGMENT_MAX_BYTES / SEGMENT_MAX_SECONDS and closed after SEGMENT_IDLE_CLOSE.
+#
+#   python segments.py build [--session ID]   # assemble segments for frames already in the store
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import bisect
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+import db
+from snapshot_store import safe_session_id, shard_of, get_store, opencv
+
+log = logging.getLogger("backend.segments")
+
+BASE_DIR = Path(__file__).resolve().parent
+SEGMENTS_ENABLED = os.environ.get("SEGMENTS", "1").lower() in ("1", "true", "yes")
+SEGMENT_DIR = Path(os.environ.get("SEGMENT_DIR", BASE_DIR / "segments"))
+SEGMENT_MAX_BYTES = int(os.environ.get("SEGMENT_MAX_BYTES", 64 * 1024 * 1024))
+SEGMENT_MAX_SECONDS = float(os.environ.get("SEGMENT_MAX_SECONDS", 3600))
+SEGMENT_IDLE_CLOSE = float(os.environ.get("SEGMENT_IDLE_CLOSE", 120))
+SEGMENT_QUEUE_SIZE = int(os.environ.get("SEGMENT_QUEUE_SIZE", 1000))
+
+INDEX_RECORD = struct.Struct("<dQI")    # ts (epoch seconds), byte offset, byte length
+JPEG_MAGIC = b"\xff\xd8"
+
+
+def session_dir(session_id, root=SEGMENT_DIR):
+    sid = safe_session_id(session_id)
+    return Path(root) / shard_of(sid) / sid
+
+
+def segment_rel(session_id, seq):
+    sid = safe_session_id(session_id)
+    return f"{shard_of(sid)}/{sid}/{seq:06d}.mjpeg"
+
+
+def as_jpeg(data):
+    """MJPEG only holds JPEG frames; WebP/PNG snapshots are re-encoded (None if that is impossible)."""
+    if bytes(data[:2]) == JPEG_MAGIC:
+        return bytes(data)
+    cv = opencv()
+    if cv is None:
+        return None
+    cv2, np = cv
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    ok, enc = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return enc.tobytes() if ok else None
+
+
+class _OpenSegment:
+    def __init__(self, session_id, seq, root):
+        self.session_id = session_id
+        self.seq = seq
+        self.rel = segment_rel(session_id, seq)
+        path = Path(root) / self.rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.data = open(path, "ab", buffering=0)     # frame bytes hit the file before their index record
+        self.index = open(path.with_suffix(".idx"), "ab")
+        self.size = self.data.tell()
+        self.started = None
+        self.touched = time.monotonic()
+        self.last_blob = None
+        self.last_loc = None
+
+    def close(self):
+        for f in (self.data, self.index):
+            try:
+                f.close()
+            except Exception:
+                pass
+
+
+class SegmentAssembler:
+    def __init__(self, root=SEGMENT_DIR, max_bytes=SEGMENT_MAX_BYTES, max_seconds=SEGMENT_MAX_SECONDS,
+                 idle_close=SEGMENT_IDLE_CLOSE, queue_size=SEGMENT_QUEUE_SIZE):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.idle_close = idle_close
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._open = {}
+        self.dropped = 0
+        self.appended = 0
+        self._thread = threading.Thread(target=self._loop, name="segment-writer", daemon=True)
+        self._thread.start()
+
+    # SnapshotStore listener signature
+    def on_frame(self, session_id, ts, blob_hash, path, payload):
+        try:
+            self._queue.put_nowait((session_id, ts, blob_hash, path, payload))
+        except queue.Full:
+            # the per-frame files are still there; segments are a convenience copy
+            self.dropped += 1
+
+    def flush(self, timeout=10.0):
+        """Block until every queued frame has been written (used by tests and the build CLI)."""
+        done = threading.Event()
+        self._queue.put((None, None, None, None, done))
+        done.wait(timeout)
+
+    def open_segments(self):
+        return {sid: seg.rel for sid, seg in list(self._open.items())}
+
+    def _loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=max(1.0, self.idle_close / 4))
+            except queue.Empty:
+                self._close_idle()
+                continue
+            session_id, ts, blob_hash, path, payload = item
+            if session_id is None:
+                for seg in self._open.values():
+                    seg.index.flush()
+                payload.set()
+                continue
+            try:
+                self._append(session_id, ts, blob_hash, path, payload)
+            except Exception:
+                log.exception("Failed to append frame to segment for %s", session_id)
+            if self._queue.empty():
+                for seg in self._open.values():
+                    seg.index.flush()
+                self._close_idle()
+
+    def _segment_for(self, sid, ts):
+        seg = self._open.get(sid)
+        if seg is not None and (seg.size >= self.max_bytes or
+                                (seg.started is not None and ts - seg.started >= self.max_seconds)):
+            seg.close()
+            del self._open[sid]
+            seg = None
+        if seg is None:
+            # never append to a segment from an earlier run: its tail may be torn
+            existing = sorted(session_dir(sid, self.root).glob("*.mjpeg"))
+            seq = int(existing[-1].stem) + 1 if existing else 1
+            seg = self._open[sid] = _OpenSegment(sid, seq, self.root)
+        return seg
+
+    def _append(self, session_id, ts, blob_hash, path, payload):
+        sid = safe_session_id(session_id)
+        seg = self._segment_for(sid, ts)
+        if seg.started is None:
+            seg.started = ts
+        seg.touched = time.monotonic()
+        if blob_hash is not None and blob_hash == seg.last_blob:
+            offset, length = seg.last_loc
+        else:
+            data = payload if payload is not None else blob_bytes(sid, blob_hash, path, self.root)
+            data = as_jpeg(data) if data else None
+            if data is None:
+                return
+            offset, length = seg.size, len(data)
+            seg.data.write(data)
+            seg.size += length
+            seg.last_blob, seg.last_loc = blob_hash, (offset, length)
+            if blob_hash is not None:
+                db.writer().submit([("UPDATE snapshot_blobs SET segment=?, seg_offset=?, seg_length=? "
+                                     "WHERE session_id=? AND hash=?", (seg.rel, offset, length, sid, blob_hash))])
+        seg.index.write(INDEX_RECORD.pack(ts, offset, length))
+        self.appended += 1
+
+    def _close_idle(self):
+        now = time.monotonic()
+        for sid, seg in list(self._open.items()):
+            if now - seg.touched >= self.idle_close:
+                seg.close()
+                del self._open[sid]
+
+
+# ---- reading ----
+
+def read_index(idx_path):
+    """All (ts, offset, length) records of one segment; a torn trailing record is ignored."""
+    try:
+        raw = Path(idx_path).read_bytes()
+    except FileNotFoundError:
+        return []
+    usable = len(raw) - len(raw) % INDEX_RECORD.size
+    return list(INDEX_RECORD.iter_unpack(raw[:usable]))
+
+
+def read_frame(segment_path, offset, length):
+    with open(segment_path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def blob_bytes(session_id, blob_hash, path, root=SEGMENT_DIR):
+    """Bytes of a stored blob: the loose file if it is still there, else its packed copy in a segment."""
+    try:
+        return Path(path).read_bytes()
+    except FileNotFoundError:
+        pass
+    with db.pool().connection() as conn:
+        row = conn.execute("SELECT segment, seg_offset, seg_length FROM snapshot_blobs WHERE session_id=? AND hash=?",
+                           (safe_session_id(session_id), blob_hash)).fetchone()
+    if not row or not row[0]:
+        return None
+    try:
+        return read_frame(Path(root) / row[0], row[1], row[2])
+    except FileNotFoundError:
+        return None
+
+
+def list_segments(session_id, root=SEGMENT_DIR):
+    """Summary of a session's segments in order: seq, first/last frame ts, frame count, bytes."""
+    out = []
+    for p in sorted(session_dir(session_id, root).glob("*.mjpeg")):
+        idx = read_index(p.with_suffix(".idx"))
+        out.append({"seq": int(p.stem), "start": idx[0][0] if idx else None, "end": idx[-1][0] if idx else None,
+                    "frames": len(idx), "bytes": p.stat().st_size})
+    return out
+
+
+def iter_session_frames(session_id, start=None, end=None, root=SEGMENT_DIR):
+    """Yield (ts, jpeg bytes) for a session in time order, seeking straight to `start` via the index."""
+    for p in sorted(session_dir(session_id, root).glob("*.mjpeg")):
+        idx = read_index(p.with_suffix(".idx"))
+        if not idx or (start is not None and idx[-1][0] < start) or (end is not None and idx[0][0] > end):
+            continue
+        i = bisect.bisect_left(idx, (start,)) if start is not None else 0
+        with open(p, "rb") as f:
+            for ts, offset, length in idx[i:]:
+                if end is not None and ts > end:
+                    return
+                f.seek(offset)
+                yield ts, f.read(length)
+
+
+def frame_at(session_id, ts, root=SEGMENT_DIR):
+    """(frame ts, jpeg bytes) of the last frame at or before ts (or the first frame), or None."""
+    best = None
+    for p in sorted(session_dir(session_id, root).glob("*.mjpeg")):
+        idx = read_index(p.with_suffix(".idx"))
+        if not idx:
+            continue
+        if idx[0][0] > ts:
+            if best is None:
+                best = (p, idx[0])
+            break
+        best = (p, idx[max(0, bisect.bisect_right(idx, (ts, float("inf"))) - 1)])
+    if best is None:
+        return None
+    p, (frame_ts, offset, length) = best
+    return frame_ts, read_frame(p, offset, length)
+
+
+def expire(cutoff, root=SEGMENT_DIR, keep=(), dry_run=False):
+    """Delete segments whose last frame is older than cutoff (epoch seconds). Returns (count, bytes)."""
+    count = freed = 0
+    root = Path(root)
+    for p in root.glob("*/*/*.mjpeg"):
+        rel = p.relative_to(root).as_posix()
+        if rel in keep:
+            continue
+        idx = read_index(p.with_suffix(".idx"))
+        last = idx[-1][0] if idx else p.stat().st_mtime
+        if last >= cutoff:
+            continue
+        count += 1
+        freed += p.stat().st_size
+        if not dry_run:
+            p.unlink(missing_ok=True)
+            p.with_suffix(".idx").unlink(missing_ok=True)
+            try:
+                p.parent.rmdir()
+            except OSError:
+                pass
+    return count, freed
+
+
+_assembler = None
+_assembler_lock = threading.Lock()
+
+def get_assembler() -> SegmentAssembler:
+    """Shared assembler, registered as a SnapshotStore listener on first use."""
+    global _assembler
+    with _assembler_lock:
+        if _assembler is None:
+            _assembler = SegmentAssembler()
+            get_store().add_listener(_assembler.on_frame)
+        return _assembler
+
+
+def build(session_id=None):
+    """
+    Assemble segments for frames already in the store (oldest first), skipping frames at or before
+    the last one a session's segments already hold. Returns the number of frames fed.
+    """
+    assembler = get_assembler()
+    store = get_store()
+    sql = "SELECT s.session_id, s.ts, s.hash, b.path, s.rowid FROM snapshots s JOIN snapshot_blobs b " \
+          "ON b.session_id = s.session_id AND b.hash = s.hash WHERE "
+    params = ()
+    if session_id:
+        sql += "s.session_id=?"
+        params = (safe_session_id(session_id),)
+    else:
+        sql += "1"
+    n = 0
+    done = {}
+    rows = db.iter_keyset(sql, params, ("s.session_id", "s.ts", "s.rowid"), key=lambda r: (r[0], r[1], r[4]))
+    for sid, ts, blob_hash, rel, _ in rows:
+        if sid not in done:
+            segs = list_segments(sid, assembler.root)
+            done[sid] = max((s["end"] for s in segs if s["end"] is not None), default=None)
+        path = store.root / rel
+        if (done[sid] is not None and ts <= done[sid]) or not path.is_file():
+            continue
+        while assembler._queue.full():
+            time.sleep(0.01)
+        assembler.on_frame(sid, ts, blob_hash, path, None)
+        n += 1
+    assembler.flush(timeout=600)
+    return n
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Per-session MJPEG segments.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="assemble segments from frames already in the snapshot store")
+    b.add_argument("--session", default=None)
+    ls = sub.add_parser("list", help="show a session's segments")
+    ls.add_argument("session")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db.init_db()
+    if args.cmd == "build":
+        print(json.dumps({"frames": build(args.session)}))
+        db.writer().flush()
+    else:
+        print(json.dumps(list_segments(args.session), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
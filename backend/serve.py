@@ -0,0 +1,78 @@
+# serve.py
+# Production serving modes (app.py's __main__ block is the debug development server):
+#
+#   python serve.py --mode wsgi --threads 32     # waitress: threaded WSGI, no reloader/debugger
+#   python serve.py --mode asgi                  # uvicorn + asgi.py: /proctor and /generate_followup
+#                                                # are served on the event loop
+#
+# Both modes keep one process by default: the detection worker pool, the DB writer thread and the
+# snapshot/segment writers are per process, so scale detection with DETECT_WORKERS rather than
+# more server processes.
+import os
+import sys
+import signal
+import logging
+import argparse
+
+log = logging.getLogger("backend.serve")
+
+SERVE_HOST = os.environ.get("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("SERVE_PORT", os.environ.get("PORT", 5000)))
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", 32))
+
+
+def serve_wsgi(host, port, threads):
+    import app
+    flask_app = app.create_app()
+    if app.WARM_UP:
+        app.warm_up()
+    try:
+        from waitress import serve
+    except ImportError:
+        log.warning("waitress not installed (pip install waitress); using Werkzeug's threaded server")
+        from werkzeug.serving import run_simple
+        run_simple(host, port, flask_app, threaded=True, use_reloader=False, use_debugger=False)
+        return
+    log.info("Serving WSGI with waitress on http://%s:%d (%d threads)", host, port, threads)
+    serve(flask_app, host=host, port=port, threads=threads, connection_limit=max(100, threads * 8),
+          channel_timeout=120)
+
+
+def serve_asgi(host, port, workers):
+    try:
+        import uvicorn
+    except ImportError as e:
+        log.error("ASGI mode needs uvicorn (pip install uvicorn): %s", e)
+        return 1
+    log.info("Serving ASGI with uvicorn on http://%s:%d", host, port)
+    uvicorn.run("asgi:application", host=host, port=port, workers=workers, lifespan="on",
+                log_level="info", access_log=False)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run the interview backend with a production server.")
+    ap.add_argument("--mode", choices=("wsgi", "asgi"), default=os.environ.get("SERVE_MODE", "wsgi"))
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    ap.add_argument("--threads", type=int, default=SERVE_THREADS, help="WSGI worker threads")
+    ap.add_argument("--workers", type=int, default=1, help="ASGI processes (each has its own detection pool)")
+    ap.add_argument("--no-warm-up", action="store_true",
+                    help="skip preloading the DB, detector and LLM client; the first requests initialise them")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # exit through the interpreter's normal shutdown on SIGTERM so the detection pool's worker
+    # processes are joined instead of being orphaned (they hold a copy of the listening socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # read by app.py at import (ASGI worker processes inherit it)
+    os.environ.setdefault("WARM_UP", "0" if args.no_warm_up else "1")
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    if args.mode == "asgi":
+        return serve_asgi(args.host, args.port, args.workers) or 0
+    serve_wsgi(args.host, args.port, args.threads)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+# snapshot_store.py
+# Storage for proctoring snapshots:
+#  - per-session sharded directories: uploads/<shard>/<session_id>/<content hash>.<ext>
+#  - exact deduplication by content hash; optional near-duplicate suppression by a 64-bit difference
+#    hash against the session's previous frame (off by default: a frame that differs only slightly,
+#    e.g. a second face at the edge, must still be kept as the evidence its proctor event refers to)
+#  - optional re-encoding to a target JPEG quality / width before hashing
+#  - an index in the main DB (snapshots -> snapshot_blobs) used by /download for lookups and range reads
+#  - a retention / compaction job (python snapshot_store.py compact --retention-days 30)
+#  - with segments on, a background job deleting loose files of blobs already in a sealed segment
+#
+# Every stored frame gets a unique logical name ({session_id}_{ms}_{rand}.{ext}); that name is what
+# proctor_events.file_path and /download/<filename> refer to. Several names may share one blob.
+import os
+import re
+import sys
+import time
+import json
+import secrets
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+import db
+import metrics
+from cache import LRUCache
+from metrics import PROCTOR_STAGE_SECONDS
+
+log = logging.getLogger("backend.snapshots")
+
+BASE_DIR = Path(__file__).resolve().parent
+SNAPSHOT_DIR = Path(os.environ.get("SNAPSHOT_DIR", BASE_DIR / "uploads"))
+# max Hamming distance between difference hashes for a frame to count as "same as the last one";
+# -1 (default) disables it, leaving exact content-hash dedup only
+SNAPSHOT_DEDUP_BITS = int(os.environ.get("SNAPSHOT_DEDUP_BITS", -1))
+# 0 keeps the uploaded bytes; otherwise frames are re-encoded as JPEG at this quality (kept only if smaller)
+SNAPSHOT_JPEG_QUALITY = int(os.environ.get("SNAPSHOT_JPEG_QUALITY", 0))
+SNAPSHOT_MAX_WIDTH = int(os.environ.get("SNAPSHOT_MAX_WIDTH", 0))
+SNAPSHOT_RETENTION_DAYS = float(os.environ.get("SNAPSHOT_RETENTION_DAYS", 30))
+SNAPSHOT_COMPACT_INTERVAL = float(os.environ.get("SNAPSHOT_COMPACT_INTERVAL", 0))   # seconds; 0 = only via CLI
+# seconds between pack() runs while segments are on; 0 = only via compact --pack
+SNAPSHOT_PACK_INTERVAL = float(os.environ.get("SNAPSHOT_PACK_INTERVAL", 300))
+
+MIME_TYPES = {"jpg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+_LEGACY_NAME = re.compile(r"^(?P<session>.+)_(?P<ts>\d{9,13})\.(?P<ext>jpg|jpeg|webp|png)$")
+
+
+def safe_session_id(session_id):
+    """Session ids come from form fields; keep them usable as a single path component."""
+    return _UNSAFE.sub("_", str(session_id or "unknown"))[:64] or "unknown"
+
+
+def parse_legacy_name(name):
+    """(session_id, epoch seconds, ext) of a flat pre-store upload name {session}_{ts}.ext, or None."""
+    m = _LEGACY_NAME.match(name)
+    if not m:
+        return None
+    ts = int(m.group("ts"))
+    ts = ts / 1000.0 if ts > 10 ** 11 else float(ts)
+    return m.group("session"), ts, "jpg" if m.group("ext") == "jpeg" else m.group("ext")
+
+
+def shard_of(session_id):
+    return hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:2]
+
+
+_opencv = None
+
+def opencv():
+    """(cv2, numpy), imported on first use so importing the store stays cheap; None without OpenCV."""
+    global _opencv
+    if _opencv is None:
+        try:
+            import cv2
+            import numpy as np
+            _opencv = (cv2, np)
+        except Exception:
+            _opencv = False
+    return _opencv or None
+
+
+def difference_hash(data):
+    """64-bit dHash of an encoded frame (decoded at 1/8 scale), or None if it cannot be decoded."""
+    cv = opencv()
+    if cv is None:
+        return None
+    cv2, np = cv
+    buf = np.frombuffer(data, dtype=np.uint8)
+    img = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def reencode(data, quality=SNAPSHOT_JPEG_QUALITY, max_width=SNAPSHOT_MAX_WIDTH):
+    """Re-encode as JPEG (optionally downscaled). Returns (bytes, ext), or the input when that is not smaller."""
+    cv = opencv() if quality > 0 or max_width > 0 else None
+    if cv is None:
+        return data, None
+    cv2, np = cv
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return data, None
+    if max_width > 0 and img.shape[1] > max_width:
+        h = int(img.shape[0] * max_width / img.shape[1])
+        img = cv2.resize(img, (max_width, max(1, h)), interpolation=cv2.INTER_AREA)
+    ok, enc = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality if quality > 0 else 90])
+    if not ok or len(enc) >= len(data):
+        return data, None
+    return enc.tobytes(), "jpg"
+
+
+class SnapshotStore:
+    def __init__(self, root=SNAPSHOT_DIR, dedup_bits=SNAPSHOT_DEDUP_BITS,
+                 jpeg_quality=SNAPSHOT_JPEG_QUALITY, max_width=SNAPSHOT_MAX_WIDTH):
+        self.root = Path(root)
+        self.dedup_bits = dedup_bits
+        self.jpeg_quality = jpeg_quality
+        self.max_width = max_width
+        self._last = LRUCache(4096, ttl=600, name="snapshot-last")     # session -> (dhash, blob hash, rel path, size)
+        self._names = LRUCache(8192, ttl=60, name="snapshot-index")    # logical name -> (path, mime, etag, packed)
+        self._dirs = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "written": 0, "near_duplicates": 0, "exact_duplicates": 0,
+                      "bytes_in": 0, "bytes_written": 0}
+
+    def _count(self, **kw):
+        with self._lock:
+            for k, v in kw.items():
+                self.stats[k] += v
+
+    def add_listener(self, fn):
+        """fn(session_id, ts, blob_hash, path, payload) is called after each put(); payload is None for
+        near-duplicates (same blob as the session's previous frame). Must not block."""
+        self._listeners.append(fn)
+
+    def _ensure_dir(self, path):
+        if path not in self._dirs:
+            path.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(path)
+
+    def _write(self, path, payload):
+        """Atomic write; re-creates the directory if compaction removed it after it was cached."""
+        # a temp name of its own: two requests storing the same content write the same path at once
+        tmp = path.with_name(f"{path.name}.{secrets.token_hex(4)}.tmp")
+        self._ensure_dir(path.parent)
+        try:
+            f = open(tmp, "wb")
+        except FileNotFoundError:
+            self._dirs.discard(path.parent)
+            self._ensure_dir(path.parent)
+            f = open(tmp, "wb")
+        try:
+            with f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def put(self, session_id, data, ext="jpg", ts=None, name=None):
+        """
+        Store one frame and return its logical name. Near-identical consecutive frames and exact
+        duplicates only add an index row; new content is written once, atomically.
+        """
+        ts = ts or time.time()
+        sid = safe_session_id(session_id)
+        name = name or f"{sid}_{int(ts * 1000)}_{secrets.token_hex(3)}.{ext}"
+        self._count(stored=1, bytes_in=len(data))
+
+        t = time.perf_counter()
+        dhash = difference_hash(data) if self.dedup_bits >= 0 else None
+        PROCTOR_STAGE_SECONDS.observe(time.perf_counter() - t, stage="dedup_hash")
+        last = self._last.get(sid)
+        if dhash is not None and last is not None and bin(dhash ^ last[0]).count("1") <= self.dedup_bits:
+            blob_hash, rel, size = last[1], last[2], last[3]
+            payload = None
+            self._count(near_duplicates=1)
+        else:
+            payload, new_ext = reencode(data, self.jpeg_quality, self.max_width)
+            ext = new_ext or ext
+            blob_hash = hashlib.sha256(payload).hexdigest()[:32]
+            rel = f"{shard_of(sid)}/{sid}/{blob_hash}.{ext}"
+            path = self.root / rel
+            size = len(payload)
+            if path.exists():
+                self._count(exact_duplicates=1)
+            else:
+                t = time.perf_counter()
+                self._write(path, payload)
+                PROCTOR_STAGE_SECONDS.observe(time.perf_counter() - t, stage="file_write")
+                self._count(written=1, bytes_written=len(payload))
+            if dhash is not None:
+                self._last.set(sid, (dhash, blob_hash, rel, size))
+
+        self._names.set(name, (self.root / rel, MIME_TYPES.get(rel.rsplit(".", 1)[-1], "application/octet-stream"),
+                               blob_hash, None))
+        db.writer().submit([
+            ("INSERT OR IGNORE INTO snapshot_blobs (session_id,hash,path,size,created) VALUES (?,?,?,?,?)",
+             (sid, blob_hash, rel, size, ts)),
+            ("INSERT OR REPLACE INTO snapshots (name,session_id,ts,hash) VALUES (?,?,?,?)",
+             (name, sid, ts, blob_hash)),
+        ])
+        for fn in self._listeners:
+            try:
+                fn(sid, ts, blob_hash, self.root / rel, payload)
+            except Exception:
+                log.exception("Snapshot listener failed")
+        return name
+
+    def lookup(self, name):
+        """
+        (absolute path, mime type, etag, packed) for a logical snapshot name, or None if it is not indexed.
+        packed is (segment, offset, length) once the blob has been appended to a session segment.
+        """
+        hit = self._names.get(name)
+        if hit is not None and (hit[3] is not None or hit[0].is_file()):
+            return hit
+        with db.pool().connection() as conn:
+            row = conn.execute("SELECT b.path, b.hash, b.segment, b.seg_offset, b.seg_length FROM snapshots s "
+                               "JOIN snapshot_blobs b ON b.session_id = s.session_id AND b.hash = s.hash "
+                               "WHERE s.name=?", (name,)).fetchone()
+        if not row:
+            return None
+        entry = (self.root / row[0], MIME_TYPES.get(row[0].rsplit(".", 1)[-1], "application/octet-stream"), row[1],
+                 (row[2], row[3], row[4]) if row[2] else None)
+        self._names.set(name, entry)
+        return entry
+
+    def session_snapshots(self, session_id, limit=500):
+        """(name, ts) of a session's frames, newest first."""
+        with db.pool().connection() as conn:
+            return conn.execute("SELECT name, ts FROM snapshots WHERE session_id=? ORDER BY ts DESC LIMIT ?",
+                                (safe_session_id(session_id), limit)).fetchall()
+
+    def usage(self):
+        with db.pool().connection() as conn:
+            frames = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+            blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM snapshot_blobs").fetchone()
+        with self._lock:
+            stats = dict(self.stats)
+        return {"frames": frames, "blobs": blobs, "bytes": size, "process": stats}
+
+    # ---- retention / compaction ----
+
+    def compact(self, retention_days=SNAPSHOT_RETENTION_DAYS, import_legacy=False, dry_run=False,
+                orphan_grace=3600, pack=False):
+        """
+        Drop index rows older than retention_days, delete blobs no longer referenced, remove files
+        the index does not know about (older than orphan_grace seconds) and empty directories.
+        import_legacy moves flat uploads/{session}_{ts}.ext files into the store, keeping their names.
+        pack deletes loose files of blobs already copied into a session segment (fewer inodes;
+        /download then range-reads the segment).
+        """
+        report = {"imported": 0, "expired": 0, "blobs_deleted": 0, "orphans_deleted": 0, "packed": 0,
+                  "segments_deleted": 0, "bytes_freed": 0}
+        if import_legacy:
+            report["imported"] = self._import_legacy(dry_run)
+        db.writer().flush()
+        now = time.time()
+        with db.pool().connection() as conn:
+            if retention_days and retention_days > 0:
+                cutoff = now - retention_days * 86400
+                report["expired"] = conn.execute("SELECT COUNT(*) FROM snapshots WHERE ts < ?",
+                                                 (cutoff,)).fetchone()[0]
+                if not dry_run and report["expired"]:
+                    db.writer().submit([("DELETE FROM snapshots WHERE ts < ?", (cutoff,))]).result()
+            unreferenced = conn.execute(
+                "SELECT session_id, hash, path, size FROM snapshot_blobs b WHERE NOT EXISTS "
+                "(SELECT 1 FROM snapshots s WHERE s.session_id = b.session_id AND s.hash = b.hash)").fetchall()
+            known = {row[0] for row in conn.execute("SELECT path FROM snapshot_blobs")}
+        deletes = []
+        for sid, blob_hash, rel, size in unreferenced:
+            report["blobs_deleted"] += 1
+            report["bytes_freed"] += size or 0
+            known.discard(rel)
+            if not dry_run:
+                (self.root / rel).unlink(missing_ok=True)
+                deletes.append(("DELETE FROM snapshot_blobs WHERE session_id=? AND hash=?", (sid, blob_hash)))
+        if deletes:
+            db.writer().submit(deletes).result()
+        if pack:
+            report["packed"], freed = self.pack(grace=orphan_grace, dry_run=dry_run)
+            report["bytes_freed"] += freed
+        if retention_days and retention_days > 0:
+            import segments
+            keep = set(segments._assembler.open_segments().values()) if segments._assembler else ()
+            report["segments_deleted"], freed = segments.expire(now - retention_days * 86400, keep=keep,
+                                                                dry_run=dry_run)
+            report["bytes_freed"] += freed
+        if not dry_run:
+            self._last.clear()
+            self._names.clear()
+
+        # files under the shard directories that the index does not reference
+        for shard in self.root.iterdir() if self.root.exists() else ():
+            if not shard.is_dir() or len(shard.name) != 2:
+                continue
+            for path in shard.rglob("*"):
+                if not path.is_file():
+                    continue
+                rel = path.relative_to(self.root).as_posix()
+                if rel in known or now - path.stat().st_mtime < orphan_grace:
+                    continue
+                report["orphans_deleted"] += 1
+                report["bytes_freed"] += path.stat().st_size
+                if not dry_run:
+                    path.unlink(missing_ok=True)
+            if not dry_run:
+                for d in sorted((p for p in shard.rglob("*") if p.is_dir()), reverse=True) + [shard]:
+                    # forget it first; a put() that still races with the rmdir re-creates it (_write)
+                    self._dirs.discard(d)
+                    try:
+                        d.rmdir()
+                    except OSError:
+                        pass
+        return report
+
+    def pack(self, grace=60, dry_run=False):
+        """
+        Delete the loose files of blobs (older than grace seconds) whose bytes are in a sealed session
+        segment; /download then range-reads the segment. Segments this process still appends to are
+        skipped. Returns (files deleted, bytes freed).
+        """
+        import segments
+        open_segments = set(segments._assembler.open_segments().values()) if segments._assembler else set()
+        with db.pool().connection() as conn:
+            packable = conn.execute("SELECT path, segment FROM snapshot_blobs WHERE segment IS NOT NULL "
+                                    "AND created < ?", (time.time() - grace,)).fetchall()
+        count = freed = 0
+        for rel, segment in packable:
+            path = self.root / rel
+            if segment in open_segments or not (segments.SEGMENT_DIR / segment).is_file():
+                continue
+            try:
+                size = path.stat().st_size
+                if not dry_run:
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+            count += 1
+            freed += size
+        return count, freed
+
+    def _import_legacy(self, dry_run=False):
+        count = 0
+        for path in sorted(self.root.glob("*")):
+            legacy = parse_legacy_name(path.name) if path.is_file() else None
+            if not legacy:
+                continue
+            count += 1
+            if dry_run:
+                continue
+            session_id, ts, ext = legacy
+            self.put(session_id, path.read_bytes(), ext, ts=ts, name=path.name)
+            db.writer().flush()
+            path.unlink()
+        return count
+
+    def start_compaction_thread(self, interval=SNAPSHOT_COMPACT_INTERVAL, retention_days=SNAPSHOT_RETENTION_DAYS,
+                                pack=False):
+        """Run compact() every `interval` seconds in a daemon thread (no-op when interval <= 0)."""
+        return _periodic("snapshot-compaction", interval, lambda: self.compact(retention_days, pack=pack))
+
+    def start_pack_thread(self, interval=SNAPSHOT_PACK_INTERVAL):
+        """Run pack() every `interval` seconds in a daemon thread (no-op when interval <= 0)."""
+        return _periodic("snapshot-pack", interval, self.pack)
+
+
+def _periodic(name, interval, job):
+    if interval <= 0:
+        return None
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                log.info("%s: %s", name, job())
+            except Exception:
+                log.exception("%s failed", name)
+    t = threading.Thread(target=loop, name=name, daemon=True)
+    t.start()
+    return t
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> SnapshotStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+            metrics.callback("snapshot_store_events_total", "Snapshot store counters (frames, bytes, duplicates)",
+                             lambda: [((k,), v) for k, v in sorted(_store.stats.items())], ("kind",), "counter")
+        return _store
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Snapshot store maintenance.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="apply retention, delete unreferenced blobs and orphan files")
+    c.add_argument("--retention-days", type=float, default=SNAPSHOT_RETENTION_DAYS, help="0 keeps everything")
+    c.add_argument("--import-legacy", action="store_true", help="move flat uploads/{session}_{ts}.jpg files in")
+    c.add_argument("--pack", action="store_true", help="drop loose files already copied into segments")
+    c.add_argument("--dry-run", action="store_true")
+    sub.add_parser("stats", help="print index and disk usage")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db.init_db()
+    store = get_store()
+    if args.cmd == "compact":
+        result = store.compact(args.retention_days, import_legacy=args.import_legacy, dry_run=args.dry_run,
+                               pack=args.pack)
+    else:
+        result = store.usage()
+    db.writer().flush()
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
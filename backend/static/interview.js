@@ -13,6 +13,10 @@
   let followUpActive = false;
   let lastQAs = [];
   let manuallyStopped = false; // <= critical: must exist
+  let questionList = null; // prefetched via /get_questions; null -> ask /get_question per index
+  let questionShownAt = 0; // ms timestamps for the per-answer timings
+  let recordStartedAt = 0;
+  let unsentAnswers = []; // turns whose /submit_answers failed; resent with the next one
 
   const SESSION_ID = "{{ session_id }}";
   const AUTO_SPEAK = true;
@@ -45,15 +49,37 @@
   }
 
   // ======= Load question =======
-  async function loadQuestion(index = 0) {
-    setInfo("loading question...");
+  async function prefetchQuestions() {
     try {
-      const r = await fetch("/get_question", {
+      const r = await fetch("/get_questions", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ session_id: SESSION_ID, index })
+        body: JSON.stringify({ session_id: SESSION_ID })
       });
       const j = await r.json();
+      if (j && Array.isArray(j.questions)) questionList = j.questions;
+    } catch (e) {
+      console.warn("prefetchQuestions error (falling back to per-question fetch):", e);
+    }
+  }
+
+  async function fetchQuestion(index) {
+    if (questionList) {
+      if (index < 0 || index >= questionList.length) return { done: true };
+      return { done: false, question: questionList[index], index, total: questionList.length };
+    }
+    const r = await fetch("/get_question", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ session_id: SESSION_ID, index })
+    });
+    return r.json();
+  }
+
+  async function loadQuestion(index = 0) {
+    setInfo("loading question...");
+    try {
+      const j = await fetchQuestion(index);
       if (!j) throw new Error("Bad /get_question response");
       if (j.done) {
         questionText.innerText = "All questions completed. Submit interview.";
@@ -61,6 +87,7 @@
       }
       currentQuestion = j.question;
       followUpActive = false;
+      questionShownAt = Date.now();
       questionText.innerText = currentQuestion;
       if (AUTO_SPEAK) speak(currentQuestion);
       setInfo("question ready");
@@ -330,6 +357,7 @@
     finalTranscript = "";
     answerBox && (answerBox.innerText = "");
     manuallyStopped = false;
+    recordStartedAt = Date.now();
 
     if (!recognition) recognition = createRecognition();
     // recognition may be in 'ended' state; start safely
@@ -367,40 +395,46 @@
 
     setInfo("Saving answer…");
 
-    try {
-      await fetch("/submit_answer", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ session_id: SESSION_ID, question: currentQuestion, answer: ans })
-      });
-      lastQAs.push(`Q: ${currentQuestion}\nA: ${ans}`);
-      if (lastQAs.length > 10) lastQAs.shift();
-    } catch (e) {
-      console.warn("submit_answer failed:", e);
-    }
+    // one request stores the answer (plus any earlier unsent ones) and returns the follow-up
+    const now = Date.now();
+    unsentAnswers.push({
+      question: currentQuestion,
+      answer: ans,
+      kind: followUpActive ? "followup" : "answer",
+      client_id: `${SESSION_ID}-${now}-${Math.random().toString(36).slice(2, 8)}`,
+      timings: {
+        think_ms: recordStartedAt && questionShownAt ? Math.max(0, recordStartedAt - questionShownAt) : null,
+        answer_ms: recordStartedAt ? now - recordStartedAt : null
+      }
+    });
+    lastQAs.push(`Q: ${currentQuestion}\nA: ${ans}`);
+    if (lastQAs.length > 10) lastQAs.shift();
 
-    // generate follow-up
     let followUp = null;
     try {
-      const r = await fetch("/generate_followup", {
+      const r = await fetch("/submit_answers", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
           session_id: SESSION_ID,
-          question: currentQuestion,
-          answer: ans,
+          answers: unsentAnswers,
+          followup: true,
           history: lastQAs.slice(-3)
         })
       });
       const j = await r.json();
-      if (j && j.ok && j.follow_up) followUp = j.follow_up;
+      if (j && j.ok) {
+        unsentAnswers = [];
+        if (j.follow_up) followUp = j.follow_up;
+      }
     } catch (e) {
-      console.warn("generate_followup error:", e);
+      console.warn("submit_answers failed:", e);
     }
 
     if (followUp) {
       followUpActive = true;
       currentQuestion = followUp;
+      questionShownAt = Date.now();
       finalTranscript = "";
       answerBox && (answerBox.innerText = "");
       questionText && (questionText.innerText = currentQuestion);
@@ -461,6 +495,59 @@
     }
   }
 
+  // ======= Proctoring snapshots: interval, size and JPEG quality follow the server's capture policy =======
+  let capture = { interval_ms: 5000, max_width: 640, jpeg_quality: 0.8 };
+  let snapTimer = null;
+  let lastSnapStatus = "ok";
+  const snapCanvas = document.createElement("canvas");
+
+  function applyCapture(p) {
+    if (p && p.interval_ms) capture = p;
+  }
+
+  function scheduleSnapshot() {
+    clearTimeout(snapTimer);
+    snapTimer = setTimeout(sendSnapshot, capture.interval_ms);
+  }
+
+  async function sendSnapshot() {
+    // the next one is only scheduled once this response (and its policy) is in
+    if (camEl && camEl.videoWidth && !document.hidden) {
+      const scale = Math.min(1, capture.max_width / camEl.videoWidth);
+      snapCanvas.width = Math.round(camEl.videoWidth * scale);
+      snapCanvas.height = Math.round(camEl.videoHeight * scale);
+      snapCanvas.getContext("2d").drawImage(camEl, 0, 0, snapCanvas.width, snapCanvas.height);
+      const blob = await new Promise((res) => snapCanvas.toBlob(res, "image/jpeg", capture.jpeg_quality));
+      if (blob) {
+        const fd = new FormData();
+        fd.append("session_id", SESSION_ID);
+        fd.append("capture_width", snapCanvas.width);
+        fd.append("snapshot", blob, "frame.jpg");
+        try {
+          const r = await fetch("/proctor/raw", { method: "POST", body: fd });
+          const j = await r.json();
+          applyCapture(j.capture);
+          const status = j.analysis && j.analysis.status;
+          if (status && status !== lastSnapStatus && status === "alert") {
+            logMsg(`Proctoring: ${j.analysis.faces_detected} face(s) in view`);
+          }
+          if (status) lastSnapStatus = status;
+        } catch (e) {
+          console.warn("snapshot failed:", e);
+        }
+      }
+    }
+    scheduleSnapshot();
+  }
+
+  async function startSnapshots() {
+    try {
+      const r = await fetch("/proctor/policy?session_id=" + encodeURIComponent(SESSION_ID));
+      applyCapture((await r.json()).capture);
+    } catch (e) {}
+    scheduleSnapshot();
+  }
+
   async function startCountdown() {
     let t = 5;
     const counter = document.getElementById("count");
@@ -476,7 +563,9 @@
 
   // ======= init =======
   (async () => {
+    prefetchQuestions();
     try { await initCamera(); } catch (e) {}
+    startSnapshots();
     startCountdown();
   })();
 
@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+# the modules read their settings at import time: point everything at a scratch directory first
+_SCRATCH = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("DB_PATH", os.path.join(_SCRATCH, "import.db"))
+os.environ.setdefault("SNAPSHOT_DIR", os.path.join(_SCRATCH, "uploads"))
+os.environ.setdefault("SEGMENT_DIR", os.path.join(_SCRATCH, "segments"))
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["WARM_UP"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """A migrated, empty database with its own reader pool and writer thread."""
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "test.db")
+    monkeypatch.setattr(db, "_pool", None)
+    monkeypatch.setattr(db, "_writer", None)
+    db.question_cache.clear()
+    db.init_db()
+    yield db
+    if db._writer is not None:
+        db._writer.flush()
+    if db._pool is not None:
+        db._pool.close()
+    db.question_cache.clear()
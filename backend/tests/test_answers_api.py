@@ -0,0 +1,93 @@
+import json
+import uuid
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def client(fresh_db):
+    import app
+    return app.app.test_client()
+
+
+@pytest.fixture
+def session_id(fresh_db):
+    sid = str(uuid.uuid4())
+    db.create_session(sid, "Ada", "ada@example.com", "Math", ["q1", "q2"])
+    return sid
+
+
+def test_retried_batch_reports_duplicates(client, session_id):
+    body = {"session_id": session_id,
+            "answers": [{"question": "q1", "answer": "a1", "client_id": "c1"},
+                        {"question": "q2", "answer": "a2", "client_id": "c2"}]}
+    first = client.post("/submit_answers", json=body).get_json()
+    retry = client.post("/submit_answers", json=body).get_json()
+    assert (first["accepted"], first["duplicates"]) == (2, 0)
+    assert (retry["accepted"], retry["duplicates"]) == (0, 2)
+
+
+def test_followup_is_returned_and_stored(client, session_id):
+    body = {"session_id": session_id, "followup": True,
+            "answers": [{"question": "q1", "answer": "I would use a hash map because lookups are O(1)",
+                         "client_id": "c1", "timings": {"think_ms": 800}}]}
+    payload = client.post("/submit_answers", json=body).get_json()
+    assert payload["ok"] and payload["follow_up"]
+    with db.pool().connection() as conn:
+        stored = conn.execute("SELECT follow_up, timings_json FROM answers WHERE session_id=?",
+                              (session_id,)).fetchone()
+    assert stored == (payload["follow_up"], '{"think_ms": 800}')
+
+
+def test_form_post_with_json_answers(client, session_id):
+    form = {"session_id": session_id, "followup": "false",
+            "answers": json.dumps([{"question": "q1", "answer": "a1", "client_id": "f1"}])}
+    payload = client.post("/submit_answers", data=form).get_json()
+    assert payload == {"ok": True, "accepted": 1, "duplicates": 0}
+
+
+@pytest.mark.parametrize("with_session, answers", [
+    (False, [{"answer": "a"}]),
+    (True, []),
+    (True, [{}]),
+    (True, [{"answer": "a", "timings": [1]}]),
+])
+def test_invalid_batches_are_rejected(client, session_id, with_session, answers):
+    body = {"answers": answers}
+    if with_session:
+        body["session_id"] = session_id
+    assert client.post("/submit_answers", json=body).status_code == 400
+
+
+def test_batch_size_is_capped(client, session_id, monkeypatch):
+    import app
+    monkeypatch.setattr(app, "BULK_MAX_ANSWERS", 2)
+    body = {"session_id": session_id, "answers": [{"answer": str(i)} for i in range(3)]}
+    assert client.post("/submit_answers", json=body).status_code == 413
+
+
+def test_export_streams_one_line_per_session_and_resumes(client, fresh_db):
+    sids = sorted(str(uuid.uuid4()) for _ in range(3))
+    for sid in sids:
+        db.create_session(sid, "Ada", "ada@example.com", "Math", ["q1"])
+        db.add_answers(sid, [{"question": "q1", "answer": f"answer of {sid}"}])
+
+    lines = client.get("/export/transcripts.ndjson").get_data(as_text=True).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [r["session_id"] for r in records] == sids
+    assert records[1]["answers"][0]["answer"] == f"answer of {sids[1]}"
+
+    resumed = client.get(f"/export/transcripts.ndjson?after={sids[0]}&limit=1").get_data(as_text=True)
+    assert [json.loads(line)["session_id"] for line in resumed.splitlines()] == [sids[1]]
+
+
+def test_session_views_show_kind_and_follow_up(client, session_id):
+    db.add_answers(session_id, [{"question": "q1", "answer": "a1", "follow_up": "Why a hash map?"},
+                                {"question": "Why a hash map?", "answer": "speed", "kind": "followup"}])
+    detail = client.get(f"/api/sessions/{session_id}").get_json()
+    assert [(a["kind"], a["follow_up"]) for a in detail["answers"]] == [("answer", "Why a hash map?"),
+                                                                         ("followup", None)]
+    html = client.get(f"/dashboard/session/{session_id}").get_data(as_text=True)
+    assert "<td>followup</td>" in html and "<td>Why a hash map?</td>" in html
@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+import uuid
+
+import pytest
+
+import db
+
+
+def _session(subject="Math", started_at=None):
+    sid = str(uuid.uuid4())
+    db.create_session(sid, "Ada", "ada@example.com", subject, ["q1", "q2"], started_at=started_at)
+    return sid
+
+
+# ---- writer thread ----
+
+def test_writer_survives_a_batch_that_cannot_be_committed(tmp_path):
+    writer = db.WriteQueue(tmp_path / "missing" / "x.db")
+    with pytest.raises(sqlite3.OperationalError):
+        writer.submit([("CREATE TABLE t (x)", ())]).result(timeout=5)
+    assert writer._thread.is_alive()
+
+    writer.path = tmp_path / "x.db"
+    writer.submit([("CREATE TABLE t (x)", ())]).result(timeout=5)
+    assert writer.submit([("INSERT INTO t VALUES (1)", ())]).result(timeout=5) == 1
+
+
+def test_writer_restarts_a_dead_thread(tmp_path):
+    writer = db.WriteQueue(tmp_path / "x.db")
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    writer._thread = dead
+    writer.submit([("CREATE TABLE t (x)", ())]).result(timeout=5)
+    assert writer._thread is not dead and writer._thread.is_alive()
+
+
+def test_submit_changes_counts_rows_not_ignored(tmp_path):
+    writer = db.WriteQueue(tmp_path / "x.db")
+    writer.submit([("CREATE TABLE t (x PRIMARY KEY)", ())]).result(timeout=5)
+    insert = ("INSERT OR IGNORE INTO t VALUES (?)", (1,))
+    assert writer.submit([insert, ("INSERT OR IGNORE INTO t VALUES (?)", (2,))], changes=True).result(timeout=5) == 2
+    assert writer.submit([insert], changes=True).result(timeout=5) == 0
+
+
+def test_pool_acquire_times_out(tmp_path):
+    pool = db.ConnectionPool(tmp_path / "x.db", size=1, timeout=0.1)
+    with pool.connection():
+        with pytest.raises(db.PoolTimeout):
+            with pool.connection():
+                pass
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+    pool.close()
+
+
+# ---- bulk answers ----
+
+def test_add_answers_skips_stored_client_ids(fresh_db):
+    sid = _session()
+    items = [{"question": "q1", "answer": "a1", "client_id": "c1", "timings": {"answer_ms": 1200}},
+             {"question": "q2", "answer": "a2", "client_id": "c2", "kind": "followup"}]
+    assert db.add_answers(sid, items) == 2
+    assert db.add_answers(sid, items) == 0
+    assert db.add_answers(sid, items + [{"question": "q3", "answer": "a3", "client_id": "c3"}]) == 1
+    with db.pool().connection() as conn:
+        rows = conn.execute("SELECT client_id, kind, timings_json FROM answers WHERE session_id=? ORDER BY id",
+                            (sid,)).fetchall()
+    assert rows == [("c1", "answer", '{"answer_ms": 1200}'), ("c2", "followup", None), ("c3", "answer", None)]
+
+
+def test_add_answers_without_client_id_always_inserts(fresh_db):
+    sid = _session()
+    assert db.add_answers(sid, [{"question": "q", "answer": "a"}]) == 1
+    assert db.add_answers(sid, [{"question": "q", "answer": "a"}]) == 1
+
+
+# ---- transcript export ----
+
+def test_iter_transcripts_groups_answers_in_order(fresh_db):
+    first, second, empty = sorted(_session() for _ in range(3))
+    db.add_answers(second, [{"question": "q1", "answer": "late", "ts": "2026-01-01T10:05:00"},
+                            {"question": "q2", "answer": "early", "ts": "2026-01-01T10:00:00"}])
+    db.add_answers(first, [{"question": "q1", "answer": "only"}])
+    db.add_answers(empty, [])
+
+    out = list(db.iter_transcripts(session_ids=[first, second, empty]))
+    assert [row[0] for row, _ in out] == [first, second, empty]
+    assert [t[2] for t in out[0][1]] == ["only"]
+    assert [t[2] for t in out[1][1]] == ["early", "late"]
+    assert out[2][1] == []
+    assert out[0][0][5] == '["q1", "q2"]'
+
+
+def test_iter_transcripts_after_limit_and_filters(fresh_db):
+    math = sorted(_session("Math", f"2026-01-0{i}T09:00:00") for i in range(1, 4))
+    _session("Python", "2026-01-02T09:00:00")
+
+    assert [row[0] for row, _ in db.iter_transcripts(subject="Math")] == math
+    assert [row[0] for row, _ in db.iter_transcripts(subject="Math", after=math[0], limit=1)] == [math[1]]
+    dated = [row[0] for row, _ in db.iter_transcripts(subject="Math", date_from="2026-01-02", date_to="2026-01-02")]
+    assert len(dated) == 1
+
+
+def test_iter_transcripts_pages_hold_no_connection_between_yields(fresh_db, monkeypatch):
+    sids = sorted(_session() for _ in range(5))
+    for sid in sids:
+        db.add_answers(sid, [{"question": "q", "answer": "a1"}, {"question": "q", "answer": "a2"}])
+    # with one reader connection, a checkout while the export is paused would time out
+    monkeypatch.setattr(db, "_pool", db.ConnectionPool(db.DB_PATH, size=1, timeout=0.2))
+    out = []
+    for row, turns in db.iter_transcripts(page=2):
+        assert db.get_session_row(row[0])[0] == row[0]
+        out.append((row[0], [t[2] for t in turns]))
+    assert out == [(sid, ["a1", "a2"]) for sid in sids]
+    assert [row[0] for row, _ in db.iter_transcripts(limit=3, page=2)] == sids[:3]
+
+
+# ---- streamed reads ----
+
+def test_iter_session_answers_pages_through_equal_timestamps(fresh_db, monkeypatch):
+    sid = _session()
+    db.add_answers(sid, [{"question": "q", "answer": f"a{i}", "ts": "2026-01-01T10:00:00"} for i in range(5)])
+    monkeypatch.setattr(db, "DB_STREAM_PAGE", 2)
+    monkeypatch.setattr(db, "_pool", db.ConnectionPool(db.DB_PATH, size=1, timeout=0.2))
+    out = []
+    for question, answer, ts, kind, follow_up in db.iter_session_answers(sid):
+        assert db.get_session_row(sid) is not None
+        out.append(answer)
+    assert out == [f"a{i}" for i in range(5)]
+
+
+# ---- proctoring summary ----
+
+def test_proctor_summary_counts_errors_apart_from_alerts(fresh_db):
+    sid = _session()
+    for analysis in ({"status": "ok", "faces_detected": 1}, {"status": "alert", "faces_detected": 0},
+                     {"status": "alert", "faces_detected": 2}, {"status": "decode_failed"},
+                     {"status": "error: boom"}, {"error": "no status"}):
+        db.add_proctor_event(sid, analysis, wait=True)
+    assert db.proctor_summary(sid) == (6, 2, 3)
@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+
+import detection_engine
+
+
+def _jpeg():
+    return cv2.imencode(".jpg", np.zeros((120, 160, 3), np.uint8))[1].tobytes()
+
+
+def test_full_queue_raises_engine_busy():
+    engine = detection_engine.DetectionEngine(workers=1, queue_size=2)    # not started: nothing drains
+    engine.submit(b"a")
+    engine.submit(b"b")
+    with pytest.raises(detection_engine.EngineBusy):
+        engine.submit(b"c")
+    assert engine.queue_fill() == 1.0
+
+
+def test_busy_engine_answers_503_and_keeps_the_frame(fresh_db, monkeypatch):
+    import app
+    engine = detection_engine.DetectionEngine(workers=1, queue_size=1)
+    engine.submit(b"queued")
+    monkeypatch.setattr(app, "get_detection_engine", lambda: engine)
+
+    resp = app.app.test_client().post("/proctor/raw?session_id=s1", data=_jpeg(), content_type="image/jpeg")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+    payload = resp.get_json()
+    assert payload["error"] == "busy" and payload["saved"]
+    assert app.get_snapshot_store().lookup(payload["saved"]) is not None
+    # the capture policy counts a busy answer as a full queue and slows the client down
+    assert payload["capture"]["reason"] == "load"
+    assert payload["capture"]["interval_ms"] > app.CAPTURE_POLICY.interval_ms
+
+
+def test_pool_runs_batches_in_worker_processes():
+    engine = detection_engine.DetectionEngine(workers=1, batch_wait_ms=1).start()
+    try:
+        futures = [engine.submit(_jpeg()) for _ in range(3)]
+        results = [f.result(timeout=60) for f in futures]
+    finally:
+        engine.stop()
+    assert [r["status"] for r in results] == ["alert"] * 3
+    assert all(r["image_w"] == 160 for r in results)
+
+
+def test_tracked_frames_of_one_session_use_the_latest_state():
+    # with two workers and one-frame batches, the session's frames could run in parallel from the
+    # same stale state (every one a full pass); held back, each starts from its predecessor's result
+    engine = detection_engine.DetectionEngine(workers=2, batch_size=1, batch_wait_ms=1, tracking=True).start()
+    try:
+        futures = [engine.submit(_jpeg(), session_id="s1") for _ in range(4)]
+        results = [f.result(timeout=60) for f in futures]
+    finally:
+        engine.stop()
+    assert [r["path"] for r in results] == ["full", "skip", "skip", "skip"]
+    assert not engine._busy_sessions and not engine._held
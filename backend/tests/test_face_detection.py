@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+import face_detection
+import fetch_models
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_detection, "MODELS_DIR", tmp_path / "models")
+    monkeypatch.delenv("FACE_LBP_CASCADE", raising=False)
+    monkeypatch.delenv("FACE_YUNET_MODEL", raising=False)
+    return tmp_path / "models"
+
+
+@pytest.mark.parametrize("backend", ["lbp", "yunet"])
+def test_chosen_backend_without_its_model_raises(models_dir, monkeypatch, backend):
+    monkeypatch.setattr(face_detection, "FACE_DETECTOR", backend)
+    monkeypatch.setattr(face_detection, "_detector", None)
+    with pytest.raises(RuntimeError, match=f"fetch_models.py {backend}"):
+        face_detection.get_detector()
+    assert face_detection._detector is None
+
+
+def test_unknown_backend_raises(monkeypatch):
+    monkeypatch.setattr(face_detection, "FACE_DETECTOR", "nope")
+    monkeypatch.setattr(face_detection, "_detector", None)
+    with pytest.raises(RuntimeError, match="unknown FACE_DETECTOR"):
+        face_detection.get_detector()
+
+
+def test_fetch_installs_a_model_the_backend_loads(models_dir, monkeypatch):
+    # any OpenCV cascade file stands in for the LBP download
+    source = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+    monkeypatch.setitem(fetch_models.MODELS, "lbp", ("lbp.xml", "file://" + source))
+    path = fetch_models.fetch("lbp")
+    assert path == models_dir / "lbp.xml" and path.is_file()
+    assert face_detection.LbpDetector(model_path=path).cascade is not None
+
+
+def test_fetch_discards_a_download_that_does_not_load(models_dir, tmp_path, monkeypatch):
+    bogus = tmp_path / "bogus.xml"
+    bogus.write_text("<html>rate limited</html>")
+    monkeypatch.setitem(fetch_models.MODELS, "lbp", ("lbp.xml", bogus.as_uri()))
+    with pytest.raises(RuntimeError):
+        fetch_models.fetch("lbp")
+    assert list(models_dir.iterdir()) == []
+
+
+def _frame(w, h):
+    return cv2.imencode(".jpg", np.full((h, w), 128, np.uint8))[1].tobytes()
+
+
+def test_tracking_keeps_the_exact_size_through_reduced_decodes():
+    first, state = face_detection.detect_faces_tracked(_frame(641, 481), work_width=160)
+    second, state = face_detection.detect_faces_tracked(_frame(641, 481), state, work_width=160)
+    assert (second["image_w"], second["image_h"]) == (641, 481)
+    assert second["path"] == "skip"
+
+
+def test_tracking_state_resets_when_the_resolution_changes():
+    _, state = face_detection.detect_faces_tracked(_frame(640, 480), work_width=160)
+    _, state = face_detection.detect_faces_tracked(_frame(640, 480), state, work_width=160)
+    analysis, state = face_detection.detect_faces_tracked(_frame(320, 240), state, work_width=160)
+    assert (analysis["image_w"], analysis["image_h"]) == (320, 240)
+    assert analysis["path"] == "full"
+    assert (state["image_w"], state["image_h"], state["since_full"]) == (320, 240, 0)
@@ -0,0 +1,123 @@
+import json
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import llm_client
+import llm_stub_server
+import question_generator
+
+
+@pytest.fixture
+def stub():
+    server = llm_stub_server.serve(port=0, delay=0.3)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub, tmp_path):
+    c = llm_client.LLMClient(api_key="stub", base_url=stub + "/v1", timeout=5,
+                             cache=llm_client.ResponseCache(path=str(tmp_path / "llm_cache.db")))
+    yield c
+    c.executor.shutdown(wait=True)
+    c.background.shutdown(wait=True)
+
+
+def _stub_requests(stub):
+    with urllib.request.urlopen(stub + "/stats", timeout=5) as resp:
+        return json.load(resp)["requests"]
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+MESSAGES = [{"role": "user", "content": "Tell me about hash maps."}]
+
+
+def test_repeated_prompt_is_answered_from_the_cache(client, stub, tmp_path):
+    before = _stub_requests(stub)
+    first = client.chat(MESSAGES)
+    assert first and client.chat(MESSAGES) == first
+    assert _stub_requests(stub) - before == 1
+
+    # a new client on the same cache file does not call the model either
+    again = llm_client.LLMClient(api_key="stub", base_url=stub + "/v1",
+                                 cache=llm_client.ResponseCache(path=str(tmp_path / "llm_cache.db")))
+    assert again.chat(MESSAGES) == first
+    assert _stub_requests(stub) - before == 1
+    again.executor.shutdown()
+    again.background.shutdown()
+
+
+def test_identical_in_flight_prompts_share_one_call(client, stub):
+    before = _stub_requests(stub)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def ask():
+        barrier.wait()
+        results.append(client.chat(MESSAGES))
+
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 4 and len(set(results)) == 1
+    assert _stub_requests(stub) - before == 1
+
+
+def test_timeout_raises_llm_error(client):
+    with pytest.raises(llm_client.LLMError):
+        client.chat(MESSAGES, timeout=0.05)
+
+
+def test_coalesced_waiter_gets_llm_error_too(client):
+    errors = []
+
+    def ask():
+        try:
+            client.chat(MESSAGES, timeout=0.05)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=ask) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3 and all(isinstance(e, llm_client.LLMError) for e in errors)
+
+
+def test_question_pool_refills_bank_subjects_only(client, stub, monkeypatch):
+    monkeypatch.setattr(question_generator, "get_client", lambda: client)
+    pool = question_generator.QuestionPool(target=2, n=3)
+    before = _stub_requests(stub)
+
+    pool.refill("no such subject")
+    pool.refill("Python")
+    _wait_for(lambda: pool.size("python") == 2)
+    assert _stub_requests(stub) - before == 2
+
+    qs = pool.take("PYTHON", n=3)
+    assert len(qs) == 3 and all("python" in q for q in qs)
+    _wait_for(lambda: pool.size("python") == 2)
+    assert pool.size("no such subject") == 0
+
+
+def test_refills_do_not_queue_ahead_of_request_path_calls(client, monkeypatch):
+    monkeypatch.setattr(question_generator, "get_client", lambda: client)
+    pool = question_generator.QuestionPool(target=3, n=3)
+    # more subjects than request workers, each refill making three sequential 0.3s calls
+    pool.prefill(["python", "java", "web", "Math", "Computer Science", "General Aptitude"])
+    started = time.monotonic()
+    assert client.submit_chat(MESSAGES).result(timeout=5)
+    assert time.monotonic() - started < 0.9
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from proctor_pipeline import ResultStore
+
+
+def test_listener_runs_outside_the_store_lock():
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_listener(event):
+        entered.set()
+        release.wait(5)
+
+    store = ResultStore(listeners=[slow_listener])
+    publisher = threading.Thread(target=store.publish, args=(None, "s1", "a.jpg", {"status": "ok"}))
+    publisher.start()
+    try:
+        assert entered.wait(5)
+        # the listener is still running: readers and other sessions' publishes are not blocked by it
+        started = time.monotonic()
+        assert [e["saved"] for e in store.since("s1")] == ["a.jpg"]
+        assert store.wait_since("s1", 0, timeout=5)
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        publisher.join()
+
+
+def test_listeners_see_concurrent_publishes_in_seq_order():
+    seen = []
+    store = ResultStore(listeners=[lambda e: seen.append(e["seq"])])
+    barrier = threading.Barrier(8)
+
+    def worker(i):
+        barrier.wait()
+        for n in range(50):
+            store.publish(None, f"s{i}", None, {"status": "ok"})
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen == list(range(1, 401))
+
+
+def test_publish_wakes_the_waiters_of_its_session():
+    store = ResultStore()
+    got = {}
+
+    def wait(session_id):
+        got[session_id] = store.wait_since(session_id, 0, timeout=1.5)
+
+    waiters = [threading.Thread(target=wait, args=(sid,)) for sid in ("s1", "s2")]
+    for t in waiters:
+        t.start()
+    while len(store._waiters) < 2:
+        time.sleep(0.01)
+    started = time.monotonic()
+    store.publish(None, "s1", "a.jpg", {"status": "ok"})
+    waiters[0].join()
+    assert time.monotonic() - started < 1
+    assert [e["saved"] for e in got["s1"]] == ["a.jpg"]
+    assert list(store._waiters) == ["s2"]
+    waiters[1].join()
+    assert got["s2"] == [] and store._waiters == {}
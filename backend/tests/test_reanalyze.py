@@ -0,0 +1,127 @@
+from concurrent.futures import Future
+
+import pytest
+
+import db
+import reanalyze
+
+
+class _OutOfOrderPool:
+    """Pool stand-in: every frame is 'ok' with one face; futures stay pending until the patched wait() sets them."""
+    instances = []
+
+    def __init__(self, params=None):
+        self.pending = []
+        _OutOfOrderPool.instances.append(self)
+
+    def submit(self, fn, frames):
+        fut = Future()
+        fut.set_running_or_notify_cancel()
+        self.pending.append((fut, [(1, "ok", []) for _ in frames]))
+        return fut
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        for fut, _ in self.pending:
+            fut.cancel()
+
+
+def _alternating(interrupt_after=None):
+    """
+    reanalyze.wait replacement completing batches out of order: the newest pending batch on odd
+    calls, the oldest on even ones; with interrupt_after, Ctrl-C on the call after that many.
+    """
+    calls = {"n": 0}
+
+    def wait(futures, timeout=None, return_when=None):
+        calls["n"] += 1
+        if interrupt_after is not None and calls["n"] > interrupt_after:
+            raise KeyboardInterrupt
+        pool = _OutOfOrderPool.instances[-1]
+        fut, result = pool.pending.pop(-1 if calls["n"] % 2 else 0)
+        fut.set_result(result)
+        return {fut}, set(futures) - {fut}
+    return wait
+
+
+def _oldest_first(futures, timeout=None, return_when=None):
+    pool = _OutOfOrderPool.instances[-1]
+    fut, result = pool.pending.pop(0)
+    fut.set_result(result)
+    return {fut}, set(futures) - {fut}
+
+
+@pytest.fixture
+def frames_dir(tmp_path):
+    root = tmp_path / "frames"
+    for session in ("s1", "s2"):
+        (root / session).mkdir(parents=True)
+        for i in range(12):
+            (root / session / f"f{i:02d}.jpg").write_bytes(b"frame")
+    return root
+
+
+def _run_state(run_id):
+    db.writer().flush()
+    with db.pool().connection() as conn:
+        frames, cursor = conn.execute("SELECT frames, cursor FROM reanalysis_runs WHERE run_id=?",
+                                      (run_id,)).fetchone()
+        items = [r[0] for r in conn.execute("SELECT item FROM reanalysis_results WHERE run_id=? ORDER BY item",
+                                            (run_id,))]
+    return frames, cursor, items
+
+
+def test_interrupted_run_commits_only_up_to_its_checkpoint(fresh_db, frames_dir, monkeypatch):
+    monkeypatch.setattr(reanalyze, "_InlinePool", _OutOfOrderPool)
+    params = {"dir": str(frames_dir)}
+    run_id = reanalyze.new_run(params)
+
+    # completion order 1, 0, 3, then Ctrl-C: batches 0-1 are committed, finished batch 3 is not
+    monkeypatch.setattr(reanalyze, "wait", _alternating(interrupt_after=3))
+    summary = reanalyze.execute(run_id, params, workers=0, batch_size=4, commit_every=1, report_every=0.01)
+    assert summary["interrupted"]
+    frames, cursor, items = _run_state(run_id)
+    assert frames == len(items) == summary["frames"] == 8
+    assert cursor == "s1/f07.jpg"
+    assert all(item <= cursor for item in items)
+
+    # resume to the end: every frame exactly once, and the counter agrees with the rows
+    monkeypatch.setattr(reanalyze, "wait", _oldest_first)
+    summary = reanalyze.execute(run_id, params, cursor=cursor, done=frames, workers=0, batch_size=4,
+                                commit_every=1, report_every=0.01)
+    assert not summary["interrupted"]
+    frames, cursor, items = _run_state(run_id)
+    assert len(items) == len(set(items)) == 24
+    assert frames == 24
+
+
+def test_out_of_order_batches_are_held_until_contiguous(fresh_db, frames_dir, monkeypatch):
+    monkeypatch.setattr(reanalyze, "_InlinePool", _OutOfOrderPool)
+    params = {"dir": str(frames_dir)}
+    run_id = reanalyze.new_run(params)
+    monkeypatch.setattr(reanalyze, "wait", _alternating())
+    summary = reanalyze.execute(run_id, params, workers=0, batch_size=4, commit_every=1, report_every=0.01)
+    frames, cursor, items = _run_state(run_id)
+    assert summary["frames"] == frames == len(items) == 24
+    assert cursor == "s2/f11.jpg"
+
+
+def test_parse_time_reads_naive_times_as_utc():
+    assert reanalyze._parse_time("2026-01-01") == 1767225600.0
+    assert reanalyze._parse_time("2026-01-01T02:00:00+02:00") == 1767225600.0
+    assert reanalyze._parse_time("1767225600") == 1767225600.0
+
+
+def test_worker_processes_are_not_forked(fresh_db, frames_dir, monkeypatch):
+    started = {}
+
+    class _Pool(_OutOfOrderPool):
+        def __init__(self, workers, initializer=None, initargs=(), mp_context=None):
+            started["method"] = mp_context.get_start_method() if mp_context else "platform default"
+            super().__init__()
+
+    monkeypatch.setattr(reanalyze, "ProcessPoolExecutor", _Pool)
+    monkeypatch.setattr(reanalyze, "wait", _oldest_first)
+    params = {"dir": str(frames_dir)}
+    summary = reanalyze.execute(reanalyze.new_run(params), params, workers=2, batch_size=4, report_every=0.01)
+    assert summary["frames"] == 24
+    assert started["method"] == reanalyze.DETECT_START_METHOD == "spawn"
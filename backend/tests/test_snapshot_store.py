@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+import db
+import segments
+import snapshot_store
+
+
+def _jpeg(i):
+    return b"\xff\xd8" + bytes([i]) * 64 + b"\xff\xd9"
+
+
+@pytest.fixture
+def store(fresh_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, "SEGMENT_DIR", tmp_path / "segments")
+    monkeypatch.setattr(segments, "_assembler", None)
+    return snapshot_store.SnapshotStore(root=tmp_path / "uploads")
+
+
+def _attach(store, monkeypatch):
+    # a frame 10s or more after a segment's first one rotates it, closing the previous segment
+    assembler = segments.SegmentAssembler(root=segments.SEGMENT_DIR, max_seconds=10, idle_close=3600)
+    store.add_listener(assembler.on_frame)
+    monkeypatch.setattr(segments, "_assembler", assembler)
+    return assembler
+
+
+def _loose_files(store):
+    return sorted(p for p in store.root.rglob("*") if p.is_file())
+
+
+def _put_all(store, assembler, frames):
+    names = [store.put("s1", data, ts=ts) for ts, data in frames]
+    assembler.flush()
+    db.writer().flush()
+    return names
+
+
+def test_pack_drops_loose_files_of_sealed_segments_only(store, monkeypatch):
+    assembler = _attach(store, monkeypatch)
+    names = _put_all(store, assembler, [(1000, _jpeg(0)), (1001, _jpeg(1)), (1020, _jpeg(2))])
+    assert len(_loose_files(store)) == 3
+
+    # the first two frames are in a sealed segment, the third in the one still being appended to
+    assert store.pack(grace=0) == (2, 2 * len(_jpeg(0)))
+    assert [p.read_bytes() for p in _loose_files(store)] == [_jpeg(2)]
+    store._names.clear()
+    path, mime, etag, packed = store.lookup(names[1])
+    assert packed is not None and not path.exists()
+    assert segments.read_frame(segments.SEGMENT_DIR / packed[0], packed[1], packed[2]) == _jpeg(1)
+
+
+def test_pack_respects_grace(store, monkeypatch):
+    assembler = _attach(store, monkeypatch)
+    now = time.time()
+    _put_all(store, assembler, [(now - 30, _jpeg(0)), (now, _jpeg(1))])
+    assert store.pack(grace=60) == (0, 0)
+    assert store.pack(grace=0) == (1, len(_jpeg(0)))
+
+
+
+
+def test_identical_write_finishing_first_does_not_break_the_other(store, monkeypatch):
+    real_replace = snapshot_store.os.replace
+    calls = []
+
+    def replace(src, dst):
+        # both requests saw no file yet; the second one finishes its write before the first renames
+        calls.append(src)
+        if len(calls) == 1:
+            store._write(dst, _jpeg(7))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(snapshot_store.os, "replace", replace)
+    store._write(store.root / "ab" / "s1" / "blob.jpg", _jpeg(7))
+    assert len(set(calls)) == 2
+    assert [p.read_bytes() for p in _loose_files(store)] == [_jpeg(7)]